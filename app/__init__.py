@@ -1,8 +1,22 @@
+import time
+from app.startup import StartupProfiler  # first, it notes when the import started
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from config import Config
+from app.caching import Cache
+from app.identity import IdentityCache
+from app.hashing import PasswordHasher
+from app.throttle import LoginThrottle
+from app.storage import ImageStore
+from app import db_profile
+from app.db_profile import WriteQueue
+from app.profiling import Profiler
+from app.progress import ProgressBroadcaster
+from app import templating
+from app.assets import Assets
+from app.compression import Compressor
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -10,22 +24,53 @@ login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Silakan login untuk mengakses halaman ini.'
 login_manager.login_message_category = 'info'
 csrf = CSRFProtect()
+cache = Cache()
+identity_cache = IdentityCache()
+hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+image_store = ImageStore()
+write_queue = WriteQueue()
+profiler = Profiler()
+broadcaster = ProgressBroadcaster()
+startup_profiler = StartupProfiler()
+static_assets = Assets()
+compressor = Compressor()
 
 def create_app(config_class=Config):
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    templating.configure(app)
+    db_profile.configure(app)
     db.init_app(app)
+    with app.app_context():
+        db_profile.install(app, db.engine)
     login_manager.init_app(app)
     csrf.init_app(app)
+    cache.init_app(app)
+    identity_cache.init_app(app)
+    hasher.init_app(app)
+    login_throttle.init_app(app)
+    image_store.init_app(app)
+    write_queue.init_app(app)
+    profiler.init_app(app)
+    broadcaster.init_app(app)
+    static_assets.init_app(app)
+    compressor.init_app(app)
 
     from app.routes.auth import auth_bp
     from app.routes.admin import admin_bp
     from app.routes.donor import donor_bp
+    from app.routes.media import media_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(donor_bp, url_prefix='/donor')
+    app.register_blueprint(media_bp, url_prefix='/media')
+
+    from app.commands import register_commands
+    register_commands(app)
 
     @app.route('/')
     def index():
@@ -37,6 +82,7 @@ def create_app(config_class=Config):
             return redirect(url_for('donor.dashboard'))
         return redirect(url_for('auth.login'))
 
+    startup_profiler.init_app(app, started)
     return app
 
 from app import models
@@ -0,0 +1,102 @@
+"""Hot/cold partitioning of the donation table
+
+Listings, dashboards and the write path almost only touch recent donations,
+but ``donation`` and its three indexes grow without bound, and every page of
+them competes with the recent rows for the page cache. ``archive`` moves
+donations older than ``ARCHIVE_AFTER_DAYS`` and, with
+``ARCHIVE_CLOSED_CAMPAIGNS``, every donation of a deactivated campaign into
+``donation_archive``. Rows move in batches, each copied and deleted in one
+short write transaction, walking ``ix_donation_created`` and
+``ix_donation_campaign_created`` so no batch scans the table.
+
+The archive is a table in the same database file rather than an ATTACHed
+one: SQLite has no foreign keys across files, and deleting a user or
+campaign must still cascade into their archived donations. Its b-trees are
+separate, so they stay out of the cache unless a listing reaches back that
+far.
+
+Archived rows keep their id and are read-only. Campaign totals, the counters
+in app.stats and the rollups already include them, so moving a row changes
+none of those; rebuilds, ``ledger.reconcile`` and the delete paths read both
+tables through ``PARTITIONS`` and ``all_donations``. Triggers move each row
+from ``donation_fts`` to ``donation_archive_fts`` along with it.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, insert, literal, select, union_all
+from app import db
+from app.models import Campaign, Donation, DonationArchive
+
+PARTITIONS = (Donation, DonationArchive)  # hot first
+COLUMNS = ('id', 'user_id', 'campaign_id', 'amount', 'message', 'created_at')
+
+
+def all_donations():
+    """Hot and archived donations as one subquery, for aggregates over every donation"""
+    return union_all(*(select(*(getattr(model, name) for name in COLUMNS)) for model in PARTITIONS)) \
+        .subquery('all_donations')
+
+
+def cutoff(now=None):
+    """Donations created before this are archived"""
+    return (now or datetime.utcnow()) - timedelta(days=current_app.config['ARCHIVE_AFTER_DAYS'])
+
+
+def _move(connection, ids):
+    source = Donation.__table__
+    connection.execute(insert(DonationArchive).from_select(
+        list(COLUMNS) + ['archived_at'],
+        select(*(source.c[name] for name in COLUMNS), literal(datetime.utcnow()))
+        .where(source.c.id.in_(ids))))
+    connection.execute(delete(source).where(source.c.id.in_(ids)))
+
+
+def next_batch(where, batch_size):
+    """Ids of the next donations matching ``where`` to move, oldest first"""
+    return select(Donation.id).where(*where).order_by(Donation.created_at, Donation.id).limit(batch_size)
+
+
+def _drain(connection, where, batch_size, echo, label):
+    """Move the donations matching ``where`` in batches, one transaction each"""
+    ids = next_batch(where, batch_size)
+    moved = 0
+    while True:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        batch = connection.scalars(ids).all()
+        if batch:
+            _move(connection, batch)
+        connection.commit()
+        if not batch:
+            return moved
+        moved += len(batch)
+        if echo:
+            echo(f'{label}: archived {moved:,} donation(s)')
+
+
+def archive(before=None, closed_campaigns=None, batch_size=None, echo=None):
+    """Move cold donations into ``donation_archive``; safe to interrupt and re-run
+
+    Returns the number of donations moved for their age and for belonging to
+    a closed campaign.
+    """
+    from app.schema import needs_rebuild
+
+    config = current_app.config
+    before = before or cutoff()
+    if closed_campaigns is None:
+        closed_campaigns = config['ARCHIVE_CLOSED_CAMPAIGNS']
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+
+    with db.engine.connect() as connection:
+        if needs_rebuild(connection, Donation.__table__):
+            # Without AUTOINCREMENT a new donation could reuse the id of an archived one
+            raise RuntimeError('The donation table is outdated, run flask upgrade-schema first')
+        old = _drain(connection, [Donation.created_at < before], batch_size, echo,
+                     f'before {before:%Y-%m-%d}')
+        closed = 0
+        if closed_campaigns:
+            campaign_ids = connection.scalars(select(Campaign.id).where(Campaign.is_active.is_(False))).all()
+            for campaign_id in campaign_ids:
+                closed += _drain(connection, [Donation.campaign_id == campaign_id], batch_size, echo,
+                                 f'closed campaign {campaign_id}')
+    return {'old': old, 'closed': closed}
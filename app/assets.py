@@ -0,0 +1,154 @@
+"""Fingerprinted, precompressed static files
+
+``flask build-assets`` copies every file under ``app/static`` to
+``app/static/dist`` with a hash of its content in the name
+(``css/style.css`` -> ``dist/css/style.1a2b3c4d5e6f.css``), writes a
+``.gz`` next to each compressible one and records the mapping in
+``dist/manifest.json``. While the manifest is loaded, ``url_for('static',
+filename='css/style.css')`` produces the fingerprinted URL, so templates keep
+using the logical name, and those files are served with an immutable
+``Cache-Control`` (the gzip variant when the browser accepts it). A changed
+file gets a new name, so browsers never revalidate and never see a stale copy.
+
+Sources that changed since the build are served under their plain URL with
+the default caching until the next build. Old fingerprints stay on disk so
+pages rendered before a deploy keep working; ``--clean`` removes them.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+
+
+def _write(path, data):
+    # Through a temporary file so a running worker never serves half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as out:
+        out.write(data)
+    os.replace(temporary, path)
+
+
+def _sources(static_folder, skip):
+    skip = {os.path.abspath(path) for path in skip}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(name for name in dirs
+                         if not name.startswith('.') and os.path.abspath(os.path.join(root, name)) not in skip)
+        for name in sorted(files):
+            if not name.startswith('.'):
+                yield os.path.join(root, name)
+
+
+def build(static_folder, compress_mimetypes, min_size=0, skip=(), clean=False):
+    """Fingerprint and precompress everything under ``static_folder``; returns the manifest"""
+    dist = os.path.join(static_folder, DIST)
+    if clean and os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {}
+    for path in _sources(static_folder, [dist, *skip]):
+        logical = os.path.relpath(path, static_folder).replace(os.sep, '/')
+        with open(path, 'rb') as source:
+            data = source.read()
+        stem, extension = os.path.splitext(logical)
+        hashed = f'{DIST}/{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}'
+        target = os.path.join(static_folder, hashed)
+        if not os.path.exists(target):
+            _write(target, data)
+        compressed = False
+        if mimetypes.guess_type(logical)[0] in compress_mimetypes and len(data) >= min_size:
+            packed = gzip.compress(data, 9, mtime=0)
+            if len(packed) < len(data):
+                if not os.path.exists(target + '.gz'):
+                    _write(target + '.gz', packed)
+                compressed = True
+        stat = os.stat(path)
+        manifest[logical] = {'path': hashed, 'gzip': compressed, 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class Assets:
+    """Flask extension rewriting static URLs through the manifest and serving the fingerprinted files"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_age = 365 * 24 * 3600
+        self.manifest = {}  # logical name -> entry
+        self._built = {}  # fingerprinted name -> entry
+        self.stale = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config.get('ASSETS_CACHE_MAX_AGE', self.max_age)
+        self.manifest = self._load(app)
+        self._built = {entry['path']: entry for entry in self.manifest.values()}
+        app.extensions['assets'] = self
+        if not self.manifest:
+            return
+        app.url_defaults(self._url_defaults)
+        app.view_functions['static'] = self._send_static
+
+    def _load(self, app):
+        if not app.static_folder:
+            return {}
+        path = os.path.join(app.static_folder, DIST, MANIFEST)
+        try:
+            with open(path) as manifest:
+                entries = json.load(manifest)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            app.logger.warning('Ignoring unreadable asset manifest %s', path)
+            return {}
+        fresh, self.stale = {}, 0
+        for logical, entry in entries.items():
+            try:
+                stat = os.stat(os.path.join(app.static_folder, logical))
+            except OSError:
+                continue
+            if (stat.st_size, int(stat.st_mtime)) != (entry['size'], entry['mtime']) \
+                    or not os.path.exists(os.path.join(app.static_folder, entry['path'])):
+                self.stale += 1
+                continue
+            fresh[logical] = entry
+        if self.stale:
+            app.logger.warning('%d static file(s) changed since flask build-assets, serving them unversioned',
+                               self.stale)
+        return fresh
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static':
+            entry = self.manifest.get(values.get('filename'))
+            if entry is not None:
+                values['filename'] = entry['path']
+
+    def _send_static(self, filename):
+        from flask import request, send_from_directory
+
+        entry = self._built.get(filename)
+        if entry is None:
+            return self.app.send_static_file(filename)
+        precompressed = entry['gzip'] and request.accept_encodings['gzip'] > 0
+        response = send_from_directory(self.app.static_folder, filename + '.gz' if precompressed else filename,
+                                       mimetype=mimetypes.guess_type(filename)[0], conditional=True,
+                                       max_age=self.max_age)
+        if precompressed:
+            response.headers['Content-Encoding'] = 'gzip'
+        if entry['gzip']:
+            response.vary.add('Accept-Encoding')
+        # The name changes with the content, so the file can never change under it
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def stats(self):
+        return {'files': len(self.manifest), 'precompressed': sum(entry['gzip'] for entry in self.manifest.values()),
+                'stale': self.stale}
@@ -0,0 +1,264 @@
+"""Pluggable cache with versioned namespaces
+
+Entries are stored under ``<namespace>:<version>:<key>``. Bumping a namespace
+swaps its version stamp, which makes every older entry unreachable at once;
+those entries then age out through TTL or LRU eviction. Version stamps are
+kept by the backend, so with the shared SQLite backend a bump in one worker
+is seen by all of them, while the in-process backend relies on the TTL to
+bound how stale another worker can be.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+MISSING = object()
+
+
+def _new_stamp():
+    return uuid.uuid4().hex[:12]
+
+
+class NullCache:
+    """Backend that never stores anything, used when caching is disabled"""
+
+    shared = False  # whether other worker processes see the same entries and versions
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        self.misses += 1
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def get_version(self, namespace):
+        return '0'
+
+    def bump_version(self, namespace):
+        return '0'
+
+    def __len__(self):
+        return 0
+
+    def stats(self):
+        return {'backend': type(self).__name__, 'entries': len(self), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class LRUCache(NullCache):
+    """Thread-safe in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries=1024, default_ttl=30):
+        super().__init__()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def get_version(self, namespace):
+        with self._lock:
+            return self._versions.setdefault(namespace, _new_stamp())
+
+    def bump_version(self, namespace):
+        with self._lock:
+            stamp = self._versions[namespace] = _new_stamp()
+            return stamp
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(NullCache):
+    """Cache shared by every worker on the host through a small SQLite file
+
+    Values are pickled. Expired rows are purged and the table is trimmed back
+    to ``max_entries`` every ``purge_every`` writes.
+    """
+
+    shared = True
+
+    def __init__(self, path, max_entries=10000, default_ttl=30, purge_every=200):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entry '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entry_expires ON cache_entry(expires_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_version '
+                         '(namespace TEXT PRIMARY KEY, stamp TEXT NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires_at FROM cache_entry WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            value, expires_at = row
+            if expires_at is None or expires_at > time.time():
+                self.hits += 1
+                return pickle.loads(value)
+            conn.execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+            self.expirations += 1
+        self.misses += 1
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at))
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self._purge(conn)
+
+    def _purge(self, conn):
+        conn.execute('DELETE FROM cache_entry WHERE expires_at < ?', (time.time(),))
+        cursor = conn.execute(
+            'DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_entry '
+            'ORDER BY expires_at IS NULL, expires_at LIMIT max(0, (SELECT count(*) FROM cache_entry) - ?))',
+            (self.max_entries,))
+        self.evictions += max(cursor.rowcount, 0)
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('DELETE FROM cache_entry')
+        conn.execute('DELETE FROM cache_version')
+
+    def get_version(self, namespace):
+        conn = self._connect()
+        row = conn.execute('SELECT stamp FROM cache_version WHERE namespace = ?', (namespace,)).fetchone()
+        if row is not None:
+            return row[0]
+        # Only a namespace's first use takes the write lock
+        conn.execute('INSERT OR IGNORE INTO cache_version (namespace, stamp) VALUES (?, ?)',
+                     (namespace, _new_stamp()))
+        return conn.execute('SELECT stamp FROM cache_version WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+    def bump_version(self, namespace):
+        stamp = _new_stamp()
+        self._connect().execute('INSERT OR REPLACE INTO cache_version (namespace, stamp) VALUES (?, ?)',
+                                (namespace, stamp))
+        return stamp
+
+    def __len__(self):
+        return self._connect().execute('SELECT count(*) FROM cache_entry').fetchone()[0]
+
+
+class Cache:
+    """Flask extension wrapping the configured cache backend"""
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        ttl = app.config.get('CACHE_DEFAULT_TTL', 30)
+        max_entries = app.config.get('CACHE_MAX_ENTRIES', 1024)
+        if backend == 'memory':
+            self.backend = LRUCache(max_entries=max_entries, default_ttl=ttl)
+        elif backend == 'sqlite':
+            self.backend = SQLiteCache(app.config['CACHE_SQLITE_PATH'], max_entries=max_entries, default_ttl=ttl)
+        elif backend in (None, 'null'):
+            self.backend = NullCache()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {backend!r}')
+        app.extensions['cache'] = self
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def bump(self, namespace):
+        """Invalidate everything cached under ``namespace``"""
+        return self.backend.bump_version(namespace)
+
+    def version(self, namespace):
+        """Current version stamp of ``namespace``"""
+        return self.backend.get_version(namespace)
+
+    def cached(self, namespace, key, loader, ttl=None):
+        """Return the cached value for ``key``, calling ``loader`` on a miss"""
+        full_key = f'{namespace}:{self.backend.get_version(namespace)}:{key}'
+        value = self.backend.get(full_key)
+        if value is MISSING:
+            value = loader()
+            self.backend.set(full_key, value, ttl)
+        return value
+
+    def stats(self):
+        return self.backend.stats()
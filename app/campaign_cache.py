@@ -0,0 +1,65 @@
+"""Read-through cache for campaigns shown to donors
+
+Cached values are plain ``CampaignSnapshot`` objects rather than ORM
+instances, so they can be shared between requests (and pickled for the
+SQLite backend) without being bound to a session.
+"""
+from app import broadcaster, cache, db
+from app.events import after_commit
+from app.models import Campaign
+
+NAMESPACE = 'campaigns'
+FIELDS = ('id', 'title', 'description', 'image', 'target_amount', 'collected_amount',
+          'is_active', 'created_at')
+
+
+class CampaignSnapshot:
+    """Detached, read-only copy of a Campaign row"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, campaign):
+        for field in FIELDS:
+            setattr(self, field, getattr(campaign, field))
+
+    def __getstate__(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __setstate__(self, state):
+        for field, value in state.items():
+            setattr(self, field, value)
+
+    progress_percentage = Campaign.progress_percentage
+
+    def __repr__(self):
+        return f'<CampaignSnapshot {self.title}>'
+
+
+def _load_active():
+    campaigns = Campaign.query.filter_by(is_active=True).order_by(Campaign.created_at.desc()).all()
+    return [CampaignSnapshot(campaign) for campaign in campaigns]
+
+
+def _load_one(campaign_id):
+    campaign = db.session.get(Campaign, campaign_id)
+    return CampaignSnapshot(campaign) if campaign is not None else None
+
+
+def get_active_campaigns():
+    """Active campaigns, newest first"""
+    return cache.cached(NAMESPACE, 'active', _load_active)
+
+
+def get_campaign(campaign_id):
+    """One campaign by id, or None if it does not exist"""
+    return cache.cached(NAMESPACE, f'id:{campaign_id}', lambda: _load_one(campaign_id))
+
+
+def invalidate():
+    cache.bump(NAMESPACE)
+    broadcaster.notify()
+
+
+def changed():
+    """Invalidate the campaign cache once the current transaction commits"""
+    after_commit(invalidate)
@@ -0,0 +1,331 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command('init-db')
+@click.option('--admin-password', default='admin123', show_default=True, help='Password of a newly created admin.')
+@with_appcontext
+def init_db_command(admin_password):
+    """Create missing tables, seed the counters and the admin account; safe to re-run"""
+    from app import db, stats
+    from app.models import User
+
+    db.create_all()
+    # Seed the materialized counters the first time they are needed
+    if not stats.is_initialized():
+        stats.rebuild()
+    if not User.query.filter_by(username='admin').first():
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password(admin_password)
+        db.session.add(admin)
+        stats.bump(users=1)
+        db.session.commit()
+        click.echo(f'Admin user created: admin / {admin_password}')
+    click.echo('Database is ready.')
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template into the Jinja bytecode cache"""
+    from flask import current_app
+    from app import templating
+
+    compiled, failed = templating.precompile(current_app)
+    for name, error in failed:
+        click.echo(f'{name}: {error}', err=True)
+    cache = templating.stats(current_app)
+    if cache is None:
+        click.echo(f'Checked {len(compiled)} template(s); JINJA_BYTECODE_CACHE is off, nothing was stored.')
+    else:
+        click.echo(f'Compiled {len(compiled)} template(s) into {cache["directory"]} '
+                   f'({cache["hits"]} already up to date).')
+    if failed:
+        raise SystemExit(1)
+
+
+@click.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete earlier fingerprinted files first.')
+@with_appcontext
+def build_assets_command(clean):
+    """Fingerprint and gzip the files in app/static and write the manifest"""
+    from flask import current_app
+    from app import assets
+
+    config = current_app.config
+    manifest = assets.build(current_app.static_folder, config['COMPRESS_MIMETYPES'], config['COMPRESS_MIN_SIZE'],
+                            skip=[config['UPLOAD_FOLDER']], clean=clean)
+    for logical, entry in manifest.items():
+        click.echo(f'{logical} -> {entry["path"]}{" (+ .gz)" if entry["gzip"] else ""}')
+    click.echo(f'{len(manifest)} file(s) built, restart the workers to serve them.')
+
+
+@click.command('profile-startup')
+@click.option('--path', 'paths', multiple=True, default=['/login'], show_default=True,
+              help='Request this path twice after start-up, may be repeated.')
+@click.option('--login', help='username:password to log in with before the requests.')
+@click.option('--top', type=int, default=15, show_default=True, help='Slowest imports to list.')
+def profile_startup_command(paths, login, top):
+    """Start a fresh process and report import, create_app and first-request timings"""
+    from app import startup
+
+    credentials = None
+    if login:
+        username, _, password = login.partition(':')
+        credentials = {'username': username, 'password': password}
+    try:
+        report = startup.profile(list(paths), credentials)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.echo(f'import {report["import_ms"]:.0f} ms, create_app {report["create_app_ms"]:.0f} ms, '
+               f'total {report["total_ms"]:.0f} ms')
+    click.echo('Slowest packages (self import time):')
+    for name, ms in report['packages'][:top]:
+        click.echo(f'  {ms:8.1f} ms  {name}')
+    click.echo('Slowest modules:')
+    for name, ms in report['modules'][:top]:
+        click.echo(f'  {ms:8.1f} ms  {name}')
+    click.echo('Requests (first / second):')
+    for endpoint, timings in report['endpoints'].items():
+        second = f'{timings["second_ms"]:.1f}' if timings['second_ms'] is not None else '-'
+        click.echo(f'  {timings["first_ms"]:8.1f} / {second:>6} ms  {endpoint}')
+    if report['templates']:
+        click.echo(f'Template bytecode cache: {report["templates"]["hits"]} hit(s), '
+                   f'{report["templates"]["misses"]} compiled')
+
+
+@click.command('reconcile-totals')
+@click.option('--fix', is_flag=True, help='Overwrite drifted totals with the recomputed value.')
+@with_appcontext
+def reconcile_totals_command(fix):
+    """Recompute campaign totals from donations and report drift"""
+    from app import ledger
+
+    drift = ledger.reconcile(fix=fix)
+    for campaign_id, title, recorded, actual in drift:
+        click.echo(f'campaign {campaign_id} ({title}): recorded {recorded:,}, '
+                   f'actual {actual:,}, drift {recorded - actual:+,}')
+    if not drift:
+        click.echo('All campaign totals match their donations.')
+    elif fix:
+        click.echo(f'Fixed {len(drift)} campaign total(s).')
+    else:
+        click.echo(f'{len(drift)} campaign total(s) drifted, run with --fix to repair.')
+        raise SystemExit(1)
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute dashboard counters and per-donor totals from scratch"""
+    from app import stats
+
+    counters = stats.rebuild()
+    click.echo(', '.join(f'{name}={value:,.0f}' for name, value in counters.items()))
+
+
+@click.command('export-donations')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--gzip', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True, allow_dash=True), default='-',
+              help='Output file, defaults to stdout.')
+@click.option('--campaign-id', type=int, help='Only donations to this campaign.')
+@click.option('--date-from', type=click.DateTime(['%Y-%m-%d']), help='First day to include (YYYY-MM-DD).')
+@click.option('--date-to', type=click.DateTime(['%Y-%m-%d']), help='Last day to include (YYYY-MM-DD).')
+@with_appcontext
+def export_donations_command(fmt, gzip, output, campaign_id, date_from, date_to):
+    """Stream donations to a CSV or JSONL file"""
+    from flask import current_app
+    from app import export
+    from app.pagination import DonationFilters
+
+    filters = DonationFilters(campaign_id=campaign_id, date_from=date_from, date_to=date_to)
+    chunks = export.generate(filters, fmt, gzip, current_app.config['EXPORT_BATCH_SIZE'])
+    with click.open_file(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+
+@click.command('archive-donations')
+@click.option('--before', type=click.DateTime(['%Y-%m-%d']),
+              help='Archive donations created before this day, defaults to ARCHIVE_AFTER_DAYS ago.')
+@click.option('--closed/--no-closed', default=None,
+              help='Also archive every donation of deactivated campaigns, defaults to ARCHIVE_CLOSED_CAMPAIGNS.')
+@click.option('--batch-size', type=int, help='Donations moved per transaction, defaults to ARCHIVE_BATCH_SIZE.')
+@with_appcontext
+def archive_donations_command(before, closed, batch_size):
+    """Move cold donations into donation_archive; resumable"""
+    from app import archive
+
+    try:
+        moved = archive.archive(before, closed, batch_size, echo=click.echo)
+    except RuntimeError as error:
+        click.echo(str(error), err=True)
+        raise SystemExit(1)
+    click.echo(f"Archived {moved['old']:,} old donation(s) and {moved['closed']:,} of closed campaigns.")
+
+
+@click.command('gc-images')
+@click.option('--grace', type=int, help='Seconds an unreferenced file is kept, defaults to IMAGE_GC_GRACE.')
+@with_appcontext
+def gc_images_command(grace):
+    """Remove uploaded images no campaign references any more"""
+    from app import image_store
+
+    removed = image_store.collect_garbage(grace)
+    click.echo(f'Removed {removed} unreferenced file(s).')
+
+
+@click.command('run-jobs')
+@click.option('--queue', 'queues', multiple=True, metavar='NAME=N',
+              help='Only this queue with N threads, may be repeated. Defaults to JOBS_QUEUES.')
+@click.option('--burst', is_flag=True, help='Exit once no job is ready instead of waiting for more.')
+@with_appcontext
+def run_jobs_command(queues, burst):
+    """Run queued background jobs until interrupted"""
+    import signal
+    from flask import current_app
+    from app.jobs import Worker
+
+    limits = {}
+    for option in queues:
+        name, _, threads = option.partition('=')
+        if not name or not threads.isdigit() or int(threads) < 1:
+            raise click.BadParameter(f'expected NAME=N, got {option!r}', param_hint='--queue')
+        limits[name] = int(threads)
+    app = current_app._get_current_object()
+    worker = Worker(app, limits or None)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    click.echo(f'Worker {worker.id} on {", ".join(f"{q}={n}" for q, n in worker.queues.items())}')
+    worker.run(burst=burst)
+    click.echo(f'Stopped: {worker.succeeded} done, {worker.retried} retried, {worker.failed} failed.')
+
+
+@click.command('enqueue-job')
+@click.argument('name')
+@click.option('--payload', default='{}', show_default=True, help='JSON keyword arguments of the task.')
+@click.option('--dedupe-key', help='Skip if a queued or running job has this key.')
+@with_appcontext
+def enqueue_job_command(name, payload, dedupe_key):
+    """Queue the task NAME, e.g. stats.rebuild or rollups.rebuild"""
+    import json
+    from app import db, jobs
+
+    try:
+        job_id = jobs.enqueue(name, json.loads(payload), dedupe_key=dedupe_key)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    db.session.commit()
+    click.echo(f'Queued job {job_id}.' if job_id else f'A job with key {dedupe_key!r} is already pending.')
+
+
+@click.command('upgrade-schema')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='Rows copied per transaction.')
+@with_appcontext
+def upgrade_schema_command(batch_size):
+    """Convert money columns to integer rupiah and create missing indexes; resumable"""
+    from app import schema
+
+    problems = schema.upgrade(batch_size, echo=click.echo)
+    for table, rowid, parent, fkid in problems:
+        click.echo(f'{table} row {rowid}: missing {parent} row', err=True)
+    click.echo('Schema is up to date.')
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print the full plan of every query.')
+@with_appcontext
+def check_query_plans_command(verbose):
+    """Fail if a route query scans a table or sorts without an index"""
+    from app import schema
+
+    failed = 0
+    for label, plan, problems in schema.check_query_plans():
+        click.echo(f'{"FAIL" if problems else "ok  "}  {label}')
+        for detail in plan if verbose else problems:
+            click.echo(f'        {detail}')
+        failed += bool(problems)
+    if failed:
+        click.echo(f'{failed} query plan(s) without a usable index.')
+        raise SystemExit(1)
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """Create the full-text search indexes if missing and refill them"""
+    from app import db, search
+
+    with db.engine.connect() as connection:
+        counts = search.rebuild(connection)
+        connection.commit()
+    click.echo(', '.join(f'{name}={count:,}' for name, count in counts.items()))
+
+
+@click.command('backfill-rollups')
+@click.option('--campaign-id', type=int, multiple=True, help='Only this campaign, may be repeated.')
+@with_appcontext
+def backfill_rollups_command(campaign_id):
+    """Rebuild the hourly and daily donation rollups from the donation table"""
+    import time
+    from app import rollups
+
+    started = time.perf_counter()
+    count = rollups.rebuild(list(campaign_id) or None, echo=click.echo)
+    click.echo(f'Done in {time.perf_counter() - started:.1f}s, {count:,} bucket(s) stored.')
+
+
+def _run_import(kind, path, fmt, batch_size):
+    from app import importer
+
+    fmt = fmt or importer.detect_format(path)
+    if fmt is None:
+        raise click.BadParameter('cannot tell the format from the file name, pass --format', param_hint='--format')
+    run = importer.import_users if kind == 'users' else importer.import_donations
+    with open(path, 'rb') as stream:
+        report = run(stream, fmt, batch_size)
+    for line, errors in report.rejected:
+        click.echo(f'line {line}: {"; ".join(errors)}', err=True)
+    click.echo(report.summary())
+
+
+@click.command('import-donations')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Rows per transaction.')
+@with_appcontext
+def import_donations_command(path, fmt, batch_size):
+    """Bulk import offline donations (username, campaign/campaign_id, amount, message, created_at, key)"""
+    _run_import('donations', path, fmt, batch_size)
+
+
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows per transaction.')
+@with_appcontext
+def import_users_command(path, fmt, batch_size):
+    """Bulk import donor accounts (username, email, password)"""
+    _run_import('users', path, fmt, batch_size)
+
+
+def register_commands(app):
+    """Attach the maintenance commands to ``flask``"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(precompile_templates_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(profile_startup_command)
+    app.cli.add_command(reconcile_totals_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(export_donations_command)
+    app.cli.add_command(archive_donations_command)
+    app.cli.add_command(import_donations_command)
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(run_jobs_command)
+    app.cli.add_command(enqueue_job_command)
+    app.cli.add_command(gc_images_command)
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(backfill_rollups_command)
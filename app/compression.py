@@ -0,0 +1,101 @@
+"""gzip for dynamic responses
+
+Rendered pages such as the donation and user tables, and JSON responses, are
+compressed in ``after_request`` when the client accepts gzip. Bodies smaller
+than ``COMPRESS_MIN_SIZE`` are left alone since the headers and CPU would cost
+more than the bytes saved. Streamed responses (CSV/JSONL exports) are
+compressed chunk by chunk as they are generated instead of being buffered.
+
+Files sent with ``send_file`` (images, fingerprinted assets with their own
+``.gz``), responses that already carry a ``Content-Encoding``, partial
+content and ``text/event-stream`` are passed through untouched. Compressing an
+event stream would hold events back in the compressor's buffer.
+"""
+import gzip
+import threading
+import zlib
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # zlib container with a gzip header and trailer
+
+
+def _compress_stream(chunks, level, on_close):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        on_close()
+
+
+class Compressor:
+    """Flask extension gzipping eligible responses in ``after_request``"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.min_size = 1024
+        self.level = 6
+        self.mimetypes = frozenset()
+        self._lock = threading.Lock()
+        self.compressed = self.streamed = self.bytes_in = self.bytes_out = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.mimetypes = frozenset(app.config.get('COMPRESS_MIMETYPES', ()))
+        app.extensions['compressor'] = self
+        if self.enabled:
+            app.after_request(self._after_request)
+
+    def _eligible(self, response):
+        status = response.status_code
+        return (response.mimetype in self.mimetypes
+                and response.mimetype != 'text/event-stream'
+                and (200 <= status < 300 and status not in (204, 206) or status >= 400)
+                and not response.direct_passthrough
+                and 'Content-Encoding' not in response.headers)
+
+    def _after_request(self, response):
+        from flask import request
+
+        if not self._eligible(response):
+            return response
+        # Caches must keep the gzip and identity variants apart, even for clients not asking for gzip
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip'] <= 0:
+            return response
+
+        if response.is_streamed:
+            body = response.response
+            response.response = _compress_stream(response.iter_encoded(), self.level,
+                                                 getattr(body, 'close', lambda: None))
+            response.headers.pop('Content-Length', None)
+            with self._lock:
+                self.streamed += 1
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            packed = gzip.compress(data, self.level, mtime=0)
+            response.set_data(packed)
+            with self._lock:
+                self.compressed += 1
+                self.bytes_in += len(data)
+                self.bytes_out += len(packed)
+        response.headers['Content-Encoding'] = 'gzip'
+        # Different bytes, so no longer the same strong validator; weak ones still match If-None-Match
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'compressed': self.compressed, 'streamed': self.streamed,
+                    'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                    'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None}
@@ -0,0 +1,226 @@
+"""SQLite engine profiles and the single-writer queue
+
+``SQLITE_PROFILE`` picks the pragmas applied to every new connection and the
+pool options handed to Flask-SQLAlchemy. The ``production`` profile runs the
+database in WAL mode so readers never wait behind a writer, and sets a busy
+timeout so concurrent writers queue on the lock instead of failing with
+"database is locked". Whatever the profile, foreign keys are enforced, since
+deletes rely on ``ON DELETE CASCADE`` to remove dependent rows.
+
+SQLite only ever has one writer, so with ``SQLITE_WRITE_QUEUE`` enabled short
+write transactions such as donations are handed to a dedicated thread. It
+drains whatever is waiting and commits it as one transaction, each job in its
+own savepoint so a failing job does not take the rest of the batch with it.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+PROFILES = {
+    'default': {
+        'pragmas': {},
+        'engine_options': {},
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',  # durable across crashes in WAL mode, fsync only on checkpoint
+            'busy_timeout': 5000,  # milliseconds
+            'cache_size': -64000,  # negative means KiB, so 64MB per connection
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,
+            'connect_args': {'timeout': 5},
+        },
+    },
+}
+
+
+# Applied under every profile: SQLite leaves foreign keys off unless asked on each connection
+REQUIRED_PRAGMAS = {'foreign_keys': 'ON'}
+
+
+class WriteQueueBusy(Exception):
+    """Raised when the write queue is full"""
+
+
+def _is_file_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def configure(app):
+    """Merge the selected profile's pool options into ``SQLALCHEMY_ENGINE_OPTIONS``
+
+    Must run before ``db.init_app`` creates the engine. Options already set in
+    the config win over the profile's.
+    """
+    name = app.config.get('SQLITE_PROFILE', 'default')
+    if name not in PROFILES:
+        raise ValueError(f'unknown SQLITE_PROFILE {name!r}, expected one of {", ".join(PROFILES)}')
+    profile = PROFILES[name]
+    if not _is_file_database(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    options = dict(profile['engine_options'])
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def install(app, engine):
+    """Apply the selected profile's pragmas to every connection ``engine`` opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(REQUIRED_PRAGMAS)
+    pragmas.update(PROFILES[app.config.get('SQLITE_PROFILE', 'default')]['pragmas'])
+    pragmas.update(app.config.get('SQLITE_PRAGMAS') or {})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def get_pragmas(engine):
+    """Read back the pragmas that matter for concurrency, for diagnostics"""
+    with engine.connect() as connection:
+        return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size',
+                             'foreign_keys')}
+
+
+class WriteQueue:
+    """Flask extension group-committing short writes on a single thread"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_batch = 64
+        self.max_delay = 0.0
+        self.timeout = 10
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submitted = self.committed = self.failed = self.rejected = 0
+        self.batches = self.largest_batch = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SQLITE_WRITE_QUEUE', False)
+        self.max_batch = app.config.get('SQLITE_WRITE_QUEUE_MAX_BATCH', 64)
+        self.max_delay = app.config.get('SQLITE_WRITE_QUEUE_MAX_DELAY', 0.0)
+        self.timeout = app.config.get('SQLITE_WRITE_QUEUE_TIMEOUT', 10)
+        self._queue = queue.Queue(maxsize=app.config.get('SQLITE_WRITE_QUEUE_LIMIT', 1024))
+        self._thread = None
+        app.extensions['write_queue'] = self
+
+    def submit(self, func, *args):
+        """Run ``func(connection, *args)`` in the next group commit and return its result
+
+        Blocks until the batch containing the job has committed. Exceptions
+        raised by ``func`` or by the commit itself are re-raised here.
+        ``timeout`` only bounds the wait for a place in the queue: once queued
+        the write may still commit, so giving up on it would invite a retry
+        that writes it twice.
+        """
+        self._start()
+        future = Future()
+        try:
+            self._queue.put((func, args, future), timeout=self.timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise WriteQueueBusy('write queue is full') from None
+        with self._lock:
+            self.submitted += 1
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        jobs = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                jobs.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        from app import db
+
+        with self.app.app_context():
+            engine = db.engine
+            while True:
+                self._commit(engine, self._next_batch())
+
+    def _commit(self, engine, jobs):
+        outcomes = []
+        try:
+            with engine.connect() as connection:
+                # pysqlite only issues BEGIN before DML, so open the transaction
+                # explicitly; otherwise releasing the first savepoint would commit
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+                for func, args, future in jobs:
+                    savepoint = connection.begin_nested()
+                    try:
+                        result = func(connection, *args)
+                    except Exception as exc:
+                        savepoint.rollback()
+                        outcomes.append((future, None, exc))
+                    else:
+                        savepoint.commit()
+                        outcomes.append((future, result, None))
+                connection.commit()
+        except Exception as exc:
+            with self._lock:
+                self.failed += len(jobs)
+            for _, _, future in jobs:
+                future.set_exception(exc)
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(jobs))
+            for future, result, exc in outcomes:
+                if exc is None:
+                    self.committed += 1
+                else:
+                    self.failed += 1
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'queued': self._queue.qsize() if self._queue is not None else 0,
+                'submitted': self.submitted,
+                'committed': self.committed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'largest_batch': self.largest_batch,
+                'avg_batch': self.committed / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,25 @@
+"""Run callbacks once the current database transaction has committed"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+
+
+def after_commit(callback, *args):
+    """Queue ``callback(*args)`` to run after the next successful commit
+
+    The same callback/arguments pair is only run once per transaction, and
+    everything queued is dropped if the transaction rolls back.
+    """
+    pending = db.session.info.setdefault('after_commit', {})
+    pending[(callback, args)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    for callback, args in session.info.pop('after_commit', {}):
+        callback(*args)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit(session):
+    session.info.pop('after_commit', None)
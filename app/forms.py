@@ -1,9 +1,30 @@
+from decimal import Decimal, InvalidOperation
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
-from wtforms import StringField, PasswordField, TextAreaField, FloatField, BooleanField, SelectField, SubmitField
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import StringField, PasswordField, TextAreaField, IntegerField, BooleanField, SelectField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange, Optional
 from app.models import User
 
+# Far below SQLite's 2**63 integer limit, so campaign and donor totals cannot overflow either
+MAX_AMOUNT = 10 ** 12
+
+
+class MoneyField(IntegerField):
+    """Whole rupiah amount; accepts ``10000`` and ``10000.0`` but not fractions"""
+
+    def process_formdata(self, valuelist):
+        if not valuelist or not valuelist[0].strip():
+            return
+        try:
+            value = Decimal(valuelist[0].strip())
+        except InvalidOperation:
+            self.data = None
+            raise ValueError(self.gettext('Nominal harus berupa angka.'))
+        if not value.is_finite() or value != value.to_integral_value():
+            self.data = None
+            raise ValueError(self.gettext('Nominal harus dalam rupiah penuh, tanpa desimal.'))
+        self.data = int(value)
+
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -36,13 +57,17 @@ class CampaignForm(FlaskForm):
     image = FileField('Featured Image', validators=[
         FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'], 'Hanya file gambar yang diizinkan!')
     ])
-    target_amount = FloatField('Target Donasi (Rp)', validators=[DataRequired(), NumberRange(min=1)])
+    target_amount = MoneyField('Target Donasi (Rp)', validators=[
+        DataRequired(), NumberRange(min=1, max=MAX_AMOUNT, message='Target harus antara Rp 1 dan Rp 1 triliun.')
+    ])
     is_active = BooleanField('Aktif')
     submit = SubmitField('Simpan')
 
 
 class DonationForm(FlaskForm):
-    amount = FloatField('Jumlah Donasi (Rp)', validators=[DataRequired(), NumberRange(min=1000)])
+    amount = MoneyField('Jumlah Donasi (Rp)', validators=[
+        DataRequired(), NumberRange(min=1000, max=MAX_AMOUNT, message='Donasi harus antara Rp 1.000 dan Rp 1 triliun.')
+    ])
     message = TextAreaField('Pesan (Opsional)')
     submit = SubmitField('Donasi Sekarang')
 
@@ -52,3 +77,12 @@ class UserEditForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     role = SelectField('Role', choices=[('donor', 'Donor'), ('admin', 'Admin')])
     submit = SubmitField('Simpan')
+
+
+class ImportForm(FlaskForm):
+    kind = SelectField('Jenis Data', choices=[('donations', 'Donasi Offline'), ('users', 'User (Donor)')])
+    file = FileField('File CSV / JSONL', validators=[
+        FileRequired('Pilih file untuk diimpor.'),
+        FileAllowed(['csv', 'jsonl'], 'Hanya file CSV atau JSONL yang diizinkan!')
+    ])
+    submit = SubmitField('Impor')
@@ -0,0 +1,165 @@
+"""Password hashing on a dedicated, bounded thread pool
+
+pbkdf2 runs in C and releases the GIL, so moving it off the request thread
+onto a small pool caps how many cores a burst of logins or registrations can
+take. Requests beyond the pool size wait in a bounded queue; once that is
+full, or a hash is not done within ``PASSWORD_HASH_TIMEOUT``, ``HasherBusy``
+is raised so the caller can shed load instead of piling up worker threads.
+A queue slot is only given back once its hash has actually finished.
+
+Bulk imports hash on a separate pool of ``PASSWORD_HASH_BULK_WORKERS``
+threads, so an import never queues ahead of interactive logins.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full or a hash timed out"""
+
+
+class PasswordHasher:
+    """Flask extension running password hashing on a bounded executor"""
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:600000'
+        self.salt_length = 16
+        self.workers = 0
+        self.bulk_workers = 0
+        self.queue_limit = 0
+        self.timeout = None
+        self._executor = None
+        self._bulk_executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._reset_metrics()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset_metrics(self):
+        self.submitted = self.completed = self.rejected = self.timed_out = self.rehashed = 0
+        self.queued = self.running = self.max_queued = 0
+        self.bulk_submitted = self.bulk_running = self.bulk_completed = 0
+        self.wait_seconds = 0.0
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_HASH_SALT_LENGTH', self.salt_length)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        self.bulk_workers = app.config.get('PASSWORD_HASH_BULK_WORKERS', 1)
+        self.queue_limit = app.config.get('PASSWORD_HASH_QUEUE_LIMIT', 64)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 30)
+        for executor in (self._executor, self._bulk_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self._executor = self._bulk_executor = None
+        if self.workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+            self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+            self._bulk_executor = ThreadPoolExecutor(max_workers=max(1, self.bulk_workers),
+                                                     thread_name_prefix='password-hasher-bulk')
+        app.extensions['password_hasher'] = self
+
+    def _task(self, func, args, enqueued_at):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += time.perf_counter() - enqueued_at
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _done(self, future):
+        # A hash cancelled while still queued never ran _task
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+        self._slots.release()
+
+    def _submit(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy('password hashing queue is full')
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        try:
+            future = self._executor.submit(self._task, func, args, time.perf_counter())
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+        # The slot stays taken until the hash is done, even if this caller gives up waiting
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise HasherBusy('password hashing timed out') from None
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method, self.salt_length)
+
+    def _bulk_task(self, password):
+        with self._lock:
+            self.bulk_running += 1
+        try:
+            return generate_password_hash(password, self.method, self.salt_length)
+        finally:
+            with self._lock:
+                self.bulk_running -= 1
+                self.bulk_completed += 1
+
+    def hash_many(self, passwords):
+        """Hash a batch of passwords for bulk imports, on the bulk pool rather than the login one"""
+        passwords = list(passwords)
+        if self._bulk_executor is None:
+            return [self.hash(password) for password in passwords]
+        with self._lock:
+            self.bulk_submitted += len(passwords)
+        return list(self._bulk_executor.map(self._bulk_task, passwords))
+
+    def verify(self, pwhash, password):
+        return self._submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if ``pwhash`` was made with different parameters than configured
+
+        Parameters left out of ``method`` (``'scrypt'``, ``'pbkdf2:sha256'``)
+        are werkzeug's choice and are not compared.
+        """
+        configured = self.method.split(':')
+        return pwhash.split('$', 1)[0].split(':')[:len(configured)] != configured
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'running': self.running,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'rehashed': self.rehashed,
+                'bulk_workers': self.bulk_workers if self._bulk_executor is not None else 0,
+                'bulk_submitted': self.bulk_submitted,
+                'bulk_running': self.bulk_running,
+                'bulk_completed': self.bulk_completed,
+                'avg_wait_ms': self.wait_seconds / self.completed * 1000 if self.completed else 0.0,
+            }
@@ -0,0 +1,97 @@
+"""Bounded TTL cache for the Flask-Login user loader
+
+The cache stores a plain dict of the user's column values. On a hit the
+values are turned back into a session-bound instance with
+``Session.merge(load=False)``, which attaches it without emitting SQL, so
+``current_user`` behaves exactly as if it had been queried.
+
+Entries live in a per-process LRU. Invalidating one also bumps a per-user
+version stamp in the app cache backend and every hit compares its stamp
+with the current one. With ``CACHE_BACKEND=sqlite`` the stamps are shared,
+so a role change, deactivation or deletion takes effect in every worker on
+the next request. The ``memory`` backend cannot tell other workers: there
+they keep the old row for up to ``IDENTITY_CACHE_TTL`` seconds, which is
+why that defaults to a few seconds.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from app.caching import LRUCache, MISSING
+
+
+class IdentityCache:
+    """Flask extension caching users by primary key"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = LRUCache(max_entries=0)
+        self.db = None
+        self.versions = None  # the app Cache, when its backend is shared between workers
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from app import cache, db
+
+        self.db = db
+        self.enabled = app.config.get('IDENTITY_CACHE_ENABLED', True)
+        self.backend = LRUCache(max_entries=app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 4096),
+                                default_ttl=app.config.get('IDENTITY_CACHE_TTL', 5))
+        self.versions = cache if cache.backend.shared else None
+        app.extensions['identity_cache'] = self
+
+    def get(self, model, id):
+        """Return the ``model`` instance with primary key ``id`` bound to the current session"""
+        session = self.db.session
+        if not self.enabled:
+            return session.get(model, id)
+
+        # Read before loading, so an invalidation racing the load leaves a stale stamp behind
+        stamp = self._stamp(model, id)
+        entry = self.backend.get((model.__name__, id))
+        if entry is MISSING or entry[0] != stamp:
+            instance = session.get(model, id)
+            if instance is not None:
+                mapper = inspect(model)
+                self.backend.set((model.__name__, id),
+                                 (stamp, {attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs}))
+            return instance
+
+        values = entry[1]
+        instance = inspect(model).class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(instance, key, value)
+        make_transient_to_detached(instance)
+        return session.merge(instance, load=False)
+
+    @staticmethod
+    def _namespace(model, id):
+        return f'identity:{model.__name__}:{id}'
+
+    def _stamp(self, model, id):
+        return self.versions.version(self._namespace(model, id)) if self.versions is not None else None
+
+    def invalidate(self, model, id):
+        self.backend.delete((model.__name__, id))
+        if self.versions is not None:
+            self.versions.bump(self._namespace(model, id))
+
+    def invalidate_after_commit(self, model, id):
+        """Drop the entry now and again once the current transaction commits
+
+        The second drop covers a concurrent request that re-cached the old row
+        between the first invalidation and the commit.
+        """
+        from app.events import after_commit
+
+        self.invalidate(model, id)
+        after_commit(self.invalidate, model, id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats['enabled'] = self.enabled
+        stats['shared_versions'] = self.versions is not None
+        return stats
@@ -0,0 +1,301 @@
+"""Bulk import of offline donations and users from CSV or JSONL
+
+Rows are validated with the same field rules as ``DonationForm`` and
+``RegisterForm``, then processed in chunks: usernames and campaign titles
+are resolved with one query per chunk, rows go in as a single executemany
+INSERT, and campaign totals and dashboard counters are updated once per
+chunk, all inside that chunk's transaction.
+"""
+import csv
+import hashlib
+import io
+import json
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import insert, select
+from werkzeug.datastructures import MultiDict
+from app import db, hasher, ledger, rollups, stats
+from app.forms import DonationForm, RegisterForm
+from app.models import User, Campaign, Donation, ImportKey
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportReport:
+    """Outcome of one import run"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.total = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line, errors):
+        self.rejected.append((line, errors))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f'{self.kind}: {self.total} rows, {self.inserted} inserted, {self.duplicates} duplicates, '
+                f'{len(self.rejected)} rejected in {self.elapsed:.2f}s ({self.rows_per_second:,.0f} rows/s)')
+
+
+def detect_format(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return ext if ext in FORMATS else None
+
+
+def read_rows(stream, format):
+    """Yield ``(line_number, dict)`` pairs from a binary CSV or JSONL stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+    elif format == 'jsonl':
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, exc
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError('Baris harus berupa objek JSON')
+    else:
+        raise ValueError(f'Unsupported import format {format!r}')
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _form_errors(form):
+    return [f'{field}: {error}' for field, errors in form.errors.items() for error in errors]
+
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def _parse_created_at(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+# ==================== DONATIONS ====================
+
+def _donation_key(row, seen):
+    """Use the row's own key, or derive one from its content
+
+    Derived keys include how many identical rows came before in the same
+    file, so genuinely repeated donations are kept while a re-run of the same
+    file maps onto the same keys.
+    """
+    if _text(row, 'key'):
+        return _text(row, 'key')[:64]
+    content = '\x1f'.join(_text(row, field) for field in
+                          ('username', 'campaign', 'campaign_id', 'amount', 'message', 'created_at'))
+    seen[content] += 1
+    return hashlib.sha256(f'{content}\x1e{seen[content]}'.encode()).hexdigest()
+
+
+def _resolve_campaigns(rows):
+    """Map campaign titles and ids used in ``rows`` to campaign ids"""
+    titles = {_text(row, 'campaign') for row in rows if _text(row, 'campaign')}
+    ids = {int(_text(row, 'campaign_id')) for row in rows if _text(row, 'campaign_id').isdigit()}
+    by_title, by_id = defaultdict(list), set()
+    if titles:
+        for id, title in db.session.execute(select(Campaign.id, Campaign.title).where(Campaign.title.in_(titles))):
+            by_title[title].append(id)
+    if ids:
+        by_id = set(db.session.scalars(select(Campaign.id).where(Campaign.id.in_(ids))))
+    return by_title, by_id
+
+
+def _import_donation_chunk(chunk, report, seen):
+    valid = []
+    for line, row in chunk:
+        if isinstance(row, Exception):
+            report.reject(line, [str(row)])
+            continue
+        form = DonationForm(formdata=MultiDict({'amount': _text(row, 'amount'), 'message': _text(row, 'message')}),
+                            meta={'csrf': False})
+        errors = [] if form.validate() else _form_errors(form)
+        if not _text(row, 'username'):
+            errors.append('username: Wajib diisi.')
+        if not (_text(row, 'campaign') or _text(row, 'campaign_id')):
+            errors.append('campaign: Isi judul campaign atau campaign_id.')
+        try:
+            created_at = _parse_created_at(_text(row, 'created_at'))
+        except ValueError:
+            errors.append('created_at: Format tanggal harus ISO 8601.')
+        if errors:
+            report.reject(line, errors)
+            continue
+        valid.append((line, row, form.amount.data, form.message.data or None, created_at))
+    if not valid:
+        return
+
+    usernames = {_text(row, 'username') for _, row, *_ in valid}
+    user_ids = dict(db.session.execute(select(User.username, User.id).where(User.username.in_(usernames))).all())
+    by_title, by_id = _resolve_campaigns([row for _, row, *_ in valid])
+
+    keyed = {}
+    for line, row, amount, message, created_at in valid:
+        user_id = user_ids.get(_text(row, 'username'))
+        if _text(row, 'campaign_id'):
+            campaign_id = int(_text(row, 'campaign_id')) if _text(row, 'campaign_id').isdigit() else None
+            campaign_id = campaign_id if campaign_id in by_id else None
+            campaign_error = 'campaign_id: Campaign tidak ditemukan.'
+        else:
+            matches = by_title.get(_text(row, 'campaign'), [])
+            campaign_id = matches[0] if len(matches) == 1 else None
+            campaign_error = ('campaign: Judul campaign ambigu, gunakan campaign_id.' if matches
+                              else 'campaign: Campaign tidak ditemukan.')
+        errors = []
+        if user_id is None:
+            errors.append('username: User tidak ditemukan.')
+        if campaign_id is None:
+            errors.append(campaign_error)
+        if errors:
+            report.reject(line, errors)
+            continue
+        key = _donation_key(row, seen)
+        if key in keyed:
+            report.duplicates += 1
+            continue
+        keyed[key] = {'user_id': user_id, 'campaign_id': campaign_id, 'amount': amount,
+                      'message': message, 'created_at': created_at or datetime.utcnow()}
+
+    existing = set(db.session.scalars(select(ImportKey.key).where(ImportKey.key.in_(keyed))))
+    report.duplicates += len(existing)
+    rows = [values for key, values in keyed.items() if key not in existing]
+    if not rows:
+        return
+
+    now = datetime.utcnow()
+    db.session.execute(insert(ImportKey.__table__),
+                       [{'key': key, 'created_at': now} for key in keyed if key not in existing])
+    db.session.execute(insert(Donation.__table__), rows)
+
+    campaign_totals, user_totals = defaultdict(int), defaultdict(lambda: [0, 0])
+    for values in rows:
+        campaign_totals[values['campaign_id']] += values['amount']
+        user_totals[values['user_id']][0] += values['amount']
+        user_totals[values['user_id']][1] += 1
+    ledger.apply_deltas(campaign_totals)
+    stats.bump(donations=len(rows), collected=sum(campaign_totals.values()))
+    stats.bump_users({user_id: tuple(total) for user_id, total in user_totals.items()})
+    rollups.donations_added(rows)
+    report.inserted += len(rows)
+
+
+def import_donations(stream, format, batch_size=1000):
+    """Import donations; each chunk of ``batch_size`` rows is one transaction"""
+    report = ImportReport('donations')
+    seen = Counter()
+    for chunk in chunked(read_rows(stream, format), batch_size):
+        report.total += len(chunk)
+        try:
+            _import_donation_chunk(chunk, report, seen)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return report.finish()
+
+
+# ==================== USERS ====================
+
+def _validate_user(row):
+    """Run RegisterForm's field validators; uniqueness is checked per chunk"""
+    password = _text(row, 'password')
+    form = RegisterForm(formdata=MultiDict({
+        'username': _text(row, 'username'),
+        'email': _text(row, 'email'),
+        'password': password,
+        'password2': _text(row, 'password2') or password,
+    }), meta={'csrf': False})
+    for field in form:
+        # Field.validate skips the validate_<field> hooks, which query per row
+        field.validate(form)
+    return form
+
+
+def _import_user_chunk(chunk, report):
+    valid = []
+    for line, row in chunk:
+        if isinstance(row, Exception):
+            report.reject(line, [str(row)])
+            continue
+        form = _validate_user(row)
+        if form.errors:
+            report.reject(line, _form_errors(form))
+            continue
+        valid.append((line, form))
+    if not valid:
+        return
+
+    usernames = {form.username.data for _, form in valid}
+    emails = {form.email.data for _, form in valid}
+    taken_usernames = set(db.session.scalars(select(User.username).where(User.username.in_(usernames))))
+    taken_emails = set(db.session.scalars(select(User.email).where(User.email.in_(emails))))
+
+    accepted = []
+    for line, form in valid:
+        username, email = form.username.data, form.email.data
+        if username in taken_usernames:
+            # The username is the natural idempotency key for users
+            report.duplicates += 1
+            continue
+        if email in taken_emails:
+            report.reject(line, ['email: Email sudah terdaftar.'])
+            continue
+        taken_usernames.add(username)
+        taken_emails.add(email)
+        accepted.append(form)
+    if not accepted:
+        return
+
+    now = datetime.utcnow()
+    hashes = hasher.hash_many([form.password.data for form in accepted])
+    rows = [{'username': form.username.data, 'email': form.email.data, 'role': 'donor', 'created_at': now,
+             'password_hash': password_hash} for form, password_hash in zip(accepted, hashes)]
+
+    db.session.execute(insert(User.__table__), rows)
+    stats.bump(users=len(rows))
+    report.inserted += len(rows)
+
+
+def import_users(stream, format, batch_size=500):
+    """Import donor accounts; each chunk of ``batch_size`` rows is one transaction"""
+    report = ImportReport('users')
+    for chunk in chunked(read_rows(stream, format), batch_size):
+        report.total += len(chunk)
+        try:
+            _import_user_chunk(chunk, report)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return report.finish()
@@ -0,0 +1,401 @@
+"""Durable background jobs stored in the application database
+
+Routes hand slow side work to ``enqueue``. The job row is inserted in the
+caller's session, so it commits or rolls back together with the change that
+asked for it: a worker never runs a job for something that did not happen,
+and a committed change never loses its job. No broker is involved, the
+queue is the ``job`` table.
+
+``flask run-jobs`` starts a ``Worker``. A dispatcher thread claims ready
+jobs with a single ``UPDATE ... RETURNING`` and hands them to a thread pool
+per queue. SQLite runs that statement under its write lock, so two workers
+can never claim the same job, and the statement also counts the queue's
+running jobs, so ``JOBS_QUEUES`` limits concurrency across every worker
+process, not just one.
+
+A claimed job is leased to its worker until ``locked_until``. The worker
+renews its leases while it runs them. If it dies or hangs, the lease runs
+out after ``JOBS_VISIBILITY_TIMEOUT`` and the job is queued again (jobs are
+therefore run at least once and tasks must be idempotent). Failures are
+retried with exponential backoff until ``max_attempts``, then kept as
+``failed`` for inspection. A ``dedupe_key`` allows at most one queued or
+running job per key, so repeated requests for the same rebuild collapse
+into one.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import case, delete, func, literal, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.sqlite import insert
+
+STATES = ('queued', 'running', 'done', 'failed')
+ERROR_LENGTH = 2000
+
+TASKS = {}  # name -> Task
+
+
+class Task:
+    def __init__(self, name, func, queue, max_attempts):
+        self.name = name
+        self.func = func
+        self.queue = queue
+        self.max_attempts = max_attempts
+
+
+def task(name, queue='default', max_attempts=5):
+    """Register a function as the task ``name``; it receives the job payload as keyword arguments"""
+    def decorator(func):
+        TASKS[name] = Task(name, func, queue, max_attempts)
+        return func
+    return decorator
+
+
+def _load_tasks():
+    from app import tasks  # noqa: F401, registers the tasks on import
+
+
+def enqueue(name, payload=None, queue=None, dedupe_key=None, delay=0, max_attempts=None):
+    """Add a job to the current transaction
+
+    Returns the job id, or None if a queued or running job already holds
+    ``dedupe_key``. Nothing runs until the caller commits.
+    """
+    from app import db
+    from app.models import Job, JOB_DEDUPE_WHERE
+
+    _load_tasks()
+    if name not in TASKS:
+        raise ValueError(f'Unknown task {name!r}')
+    task = TASKS[name]
+    now = datetime.utcnow()
+    statement = insert(Job).values(
+        queue=queue or task.queue, name=name, payload=json.dumps(payload or {}), dedupe_key=dedupe_key,
+        state='queued', attempts=0, max_attempts=max_attempts or task.max_attempts,
+        run_at=now + timedelta(seconds=delay), created_at=now)
+    if dedupe_key is not None:
+        statement = statement.on_conflict_do_nothing(index_elements=[Job.dedupe_key],
+                                                     index_where=text(JOB_DEDUPE_WHERE))
+    return db.session.execute(statement.returning(Job.id)).scalar()
+
+
+def retry(job_id):
+    """Queue a failed job again with fresh attempts; False if it is not failed"""
+    from app import db
+    from app.models import Job
+
+    result = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.state == 'failed')
+        .values(state='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None),
+        execution_options={'synchronize_session': False})
+    return bool(result.rowcount)
+
+
+def prune(retention):
+    """Delete finished jobs older than ``retention`` seconds, returning their rows"""
+    from app import db
+    from app.models import Job
+
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    return db.session.execute(
+        delete(Job).where(Job.state.in_(('done', 'failed')), Job.finished_at < cutoff)
+        .returning(Job.id, Job.name, Job.result)).all()
+
+
+def backoff(attempts, base, maximum):
+    """Seconds before retry number ``attempts``: doubling, capped, with jitter against thundering herds"""
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ==================== WORKER ====================
+
+class Worker:
+    """Claims jobs from the ``job`` table and runs them on a thread pool per queue"""
+
+    def __init__(self, app, queues=None):
+        config = app.config
+        self.app = app
+        self.queues = dict(queues or config['JOBS_QUEUES'])  # threads of this worker
+        self.limits = {queue: config['JOBS_QUEUES'].get(queue, threads)  # across all workers
+                       for queue, threads in self.queues.items()}
+        self.poll_interval = config['JOBS_POLL_INTERVAL']
+        self.visibility_timeout = config['JOBS_VISIBILITY_TIMEOUT']
+        self.backoff_base = config['JOBS_BACKOFF_BASE']
+        self.backoff_max = config['JOBS_BACKOFF_MAX']
+        self.schedule = {name: interval for name, interval in (
+            ('images.gc', config.get('IMAGE_GC_INTERVAL', 0)),
+            ('jobs.prune', config.get('JOBS_PRUNE_INTERVAL', 0)),
+            ('donations.archive', config.get('ARCHIVE_INTERVAL', 0)),
+        ) if interval}
+        self.id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._pools = {queue: ThreadPoolExecutor(limit, thread_name_prefix=f'job-{queue}')
+                       for queue, limit in self.queues.items()}
+        self._running = {queue: set() for queue in self.queues}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._next_renewal = 0
+        self._next_scheduled = {}
+        self.succeeded = self.failed = self.retried = 0
+        _load_tasks()
+
+    def stop(self):
+        """Claim nothing more; ``run`` returns once the running jobs finished"""
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self, burst=False):
+        """Process jobs until ``stop``; with ``burst``, until no job is ready"""
+        from app import db
+
+        try:
+            while not self._stopping.is_set():
+                with self.app.app_context():
+                    try:
+                        self._maintain(schedule=not burst)
+                        claimed = sum(self._claim(queue) for queue in self.queues)
+                    except SQLAlchemyError:
+                        # Typically "database is locked" while a request holds the writer; try again later
+                        db.session.rollback()
+                        self.app.logger.exception('job dispatcher failed, retrying in %ss', self.poll_interval)
+                        self._wake.wait(self.poll_interval)
+                        self._wake.clear()
+                        continue
+                with self._lock:
+                    busy = any(self._running.values())
+                if burst and not claimed and not busy:
+                    break
+                if not claimed:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=True)
+
+    def _maintain(self, schedule=True):
+        from app import db
+
+        now = time.monotonic()
+        if now >= self._next_renewal:
+            self._renew()
+            self._recover()
+            self._next_renewal = now + self.visibility_timeout / 3
+        for name, interval in self.schedule.items() if schedule else ():
+            if now >= self._next_scheduled.get(name, 0):
+                # Every worker schedules; the dedupe key keeps it to one pending run
+                enqueue(name, dedupe_key=f'schedule:{name}')
+                self._next_scheduled[name] = now + interval
+        db.session.commit()
+
+    def _renew(self):
+        from app import db
+        from app.models import Job
+
+        with self._lock:
+            ids = [id for running in self._running.values() for id in running]
+        if ids:
+            db.session.execute(
+                update(Job).where(Job.id.in_(ids), Job.locked_by == self.id, Job.state == 'running')
+                .values(locked_until=datetime.utcnow() + timedelta(seconds=self.visibility_timeout)),
+                execution_options={'synchronize_session': False})
+            db.session.commit()
+
+    def _recover(self):
+        """Requeue jobs whose worker let the lease run out"""
+        from app import db
+        from app.models import Job
+
+        now = datetime.utcnow()
+        exhausted = Job.attempts >= Job.max_attempts
+        result = db.session.execute(
+            update(Job).where(Job.state == 'running', Job.locked_until < now)
+            .values(state=case((exhausted, 'failed'), else_='queued'),
+                    finished_at=case((exhausted, now), else_=None),
+                    run_at=now, locked_by=None, locked_until=None,
+                    last_error='lease expired, the worker stopped or hung'),
+            execution_options={'synchronize_session': False})
+        if result.rowcount:
+            self.app.logger.warning('%d job(s) recovered from expired leases', result.rowcount)
+        db.session.commit()
+
+    def _claim(self, queue):
+        from app import db
+        from app.models import Job
+
+        with self._lock:
+            free = self.queues[queue] - len(self._running[queue])
+        if free <= 0:
+            return 0
+        now = datetime.utcnow()
+        # Global per-queue limit, counted inside the same write so concurrent workers cannot overshoot
+        running = (select(func.count()).select_from(Job)
+                   .where(Job.queue == queue, Job.state == 'running').scalar_subquery())
+        slots = func.max(0, func.min(free, literal(self.limits[queue]) - running))
+        ready = (select(Job.id).where(Job.queue == queue, Job.state == 'queued', Job.run_at <= now)
+                 .order_by(Job.run_at, Job.id).limit(slots))
+        rows = db.session.execute(
+            update(Job).where(Job.id.in_(ready))
+            .values(state='running', locked_by=self.id, attempts=Job.attempts + 1, started_at=now,
+                    locked_until=now + timedelta(seconds=self.visibility_timeout))
+            .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts),
+            execution_options={'synchronize_session': False}).all()
+        db.session.commit()
+        for row in rows:
+            with self._lock:
+                self._running[queue].add(row.id)
+            self._pools[queue].submit(self._execute, queue, row)
+        return len(rows)
+
+    def _execute(self, queue, job):
+        from app import db
+
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                try:
+                    if job.name not in TASKS:
+                        raise LookupError(f'unknown task {job.name!r}')
+                    result = TASKS[job.name].func(**json.loads(job.payload))
+                    # A result that cannot be stored fails the job like any other error
+                    result = json.dumps(result) if result is not None else None
+                    db.session.commit()
+                except Exception as error:
+                    db.session.rollback()
+                    self.app.logger.exception('job %s (%s) failed on attempt %d', job.id, job.name, job.attempts)
+                    self._record(self._finish_failed, job, error)
+                else:
+                    if self._record(self._finish, job, result):
+                        self.app.logger.info('job %s (%s) done in %.1fs',
+                                             job.id, job.name, time.perf_counter() - started)
+        finally:
+            # Once off the running set its lease is no longer renewed, so an unrecorded job is recovered
+            with self._lock:
+                self._running[queue].discard(job.id)
+            self._wake.set()
+
+    def _record(self, finish, job, outcome):
+        """Store a job's outcome; on failure leave it to expire and be recovered"""
+        from app import db
+
+        try:
+            finish(job, outcome)
+            return True
+        except SQLAlchemyError:
+            db.session.rollback()
+            self.app.logger.exception('could not record the outcome of job %s (%s), its lease will expire',
+                                      job.id, job.name)
+            return False
+
+    def _finish(self, job, result):
+        from app import db
+        from app.models import Job
+
+        db.session.execute(
+            update(Job).where(Job.id == job.id, Job.locked_by == self.id, Job.state == 'running')
+            .values(state='done', finished_at=datetime.utcnow(), locked_by=None, locked_until=None,
+                    last_error=None, result=result),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+        with self._lock:
+            self.succeeded += 1
+
+    def _finish_failed(self, job, error):
+        from app import db
+        from app.models import Job
+
+        now = datetime.utcnow()
+        message = f'{type(error).__name__}: {error}'[:ERROR_LENGTH]
+        if job.attempts >= job.max_attempts:
+            values = {'state': 'failed', 'finished_at': now}
+        else:
+            delay = backoff(job.attempts, self.backoff_base, self.backoff_max)
+            values = {'state': 'queued', 'run_at': now + timedelta(seconds=delay)}
+        db.session.execute(
+            update(Job).where(Job.id == job.id, Job.locked_by == self.id, Job.state == 'running')
+            .values(locked_by=None, locked_until=None, last_error=message, **values),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+        with self._lock:
+            if values['state'] == 'failed':
+                self.failed += 1
+            else:
+                self.retried += 1
+
+
+# ==================== MONITORING ====================
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def overview(window=3600, sample=1000):
+    """Depth per queue and state, plus wait and run time percentiles of jobs finished in ``window`` seconds"""
+    from app import db
+    from app.models import Job
+
+    now = datetime.utcnow()
+    since = now - timedelta(seconds=window)
+    queues = {}
+
+    def queue_row(name):
+        return queues.setdefault(name, {'ready': 0, 'delayed': 0, 'running': 0, 'failed': 0, 'done': 0,
+                                        'oldest_ready_seconds': None, 'wait': {}, 'run': {}})
+
+    pending = db.session.execute(
+        select(Job.queue, Job.state, Job.run_at <= now, func.count(), func.min(Job.run_at))
+        .where(Job.state.in_(('queued', 'running')))
+        .group_by(Job.queue, Job.state, Job.run_at <= now)).all()
+    for queue, state, due, count, oldest in pending:
+        row = queue_row(queue)
+        if state == 'running':
+            row['running'] += count
+        elif due:
+            row['ready'] += count
+            row['oldest_ready_seconds'] = round((now - oldest).total_seconds(), 1)
+        else:
+            row['delayed'] += count
+
+    finished = db.session.execute(
+        select(Job.queue, Job.state, func.count())
+        .where(Job.state.in_(('done', 'failed')), Job.finished_at >= since)
+        .group_by(Job.queue, Job.state)).all()
+    for queue, state, count in finished:
+        queue_row(queue)[state] = count
+    # Failures older than the window stay visible until they are retried or pruned
+    for queue, count in db.session.execute(
+            select(Job.queue, func.count()).where(Job.state == 'failed').group_by(Job.queue)):
+        queue_row(queue)['failed'] = count
+
+    timings = db.session.execute(
+        select(Job.queue, Job.run_at, Job.started_at, Job.finished_at)
+        .where(Job.state == 'done', Job.finished_at >= since)
+        .order_by(Job.finished_at.desc()).limit(sample)).all()
+    waits, runs = {}, {}
+    for queue, run_at, started_at, finished_at in timings:
+        waits.setdefault(queue, []).append(max(0.0, (started_at - run_at).total_seconds()))
+        runs.setdefault(queue, []).append((finished_at - started_at).total_seconds())
+    for queue in waits:
+        row = queue_row(queue)
+        for key, values in (('wait', waits[queue]), ('run', runs[queue])):
+            row[key] = {'p50': _percentile(values, 50), 'p95': _percentile(values, 95), 'max': max(values)}
+    return dict(sorted(queues.items()))
+
+
+def recent(limit=50, state=None):
+    from app import db
+    from app.models import Job
+
+    query = select(Job).order_by(Job.id.desc()).limit(limit)
+    if state:
+        query = query.where(Job.state == state)
+    return db.session.scalars(query).all()
@@ -0,0 +1,151 @@
+"""Donation ledger: every change to Campaign.collected_amount goes through here
+
+Totals are adjusted with SQL-side deltas inside the caller's transaction
+instead of read-modify-write in Python, so concurrent donations to the same
+campaign cannot overwrite each other.
+"""
+from datetime import datetime
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from app import campaign_cache, db, rollups, stats, write_queue
+from app.archive import PARTITIONS
+from app.models import Campaign, Donation
+
+def _execute(statement, connection=None):
+    return (connection or db.session).execute(statement, execution_options={'synchronize_session': False})
+
+
+def apply_delta(campaign_id, delta, connection=None):
+    """Atomically add ``delta`` to a campaign's collected amount
+
+    With ``connection`` the update runs there and invalidating the campaign
+    cache after commit is left to the caller.
+    """
+    _execute(update(Campaign)
+             .where(Campaign.id == campaign_id)
+             .values(collected_amount=func.coalesce(Campaign.collected_amount, 0) + delta), connection)
+    if connection is None:
+        campaign_cache.changed()
+
+
+def apply_deltas(deltas):
+    """Credit several campaigns at once from a ``{campaign_id: delta}`` mapping"""
+    if not deltas:
+        return
+    table = Campaign.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('campaign_id'))
+        .values(collected_amount=func.coalesce(table.c.collected_amount, 0) + bindparam('delta')),
+        [{'campaign_id': campaign_id, 'delta': delta} for campaign_id, delta in deltas.items()])
+    campaign_cache.changed()
+
+
+def record_donation(user_id, campaign_id, amount, message=None):
+    """Insert a donation and credit its campaign in the current transaction"""
+    donation = Donation(user_id=user_id, campaign_id=campaign_id, amount=amount, message=message,
+                        created_at=datetime.utcnow())
+    db.session.add(donation)
+    apply_delta(campaign_id, amount)
+    stats.donation_added(user_id, amount)
+    rollups.donation_added(campaign_id, user_id, donation.created_at, amount)
+    return donation
+
+
+def _insert_donation(connection, user_id, campaign_id, amount, message):
+    created_at = datetime.utcnow()
+    result = connection.execute(insert(Donation).values(
+        user_id=user_id, campaign_id=campaign_id, amount=amount, message=message, created_at=created_at))
+    apply_delta(campaign_id, amount, connection)
+    stats.donation_added(user_id, amount, connection)
+    rollups.donation_added(campaign_id, user_id, created_at, amount, connection)
+    return result.inserted_primary_key[0]
+
+
+def commit_donation(user_id, campaign_id, amount, message=None):
+    """Record a donation and commit it, returning the new donation id
+
+    With ``SQLITE_WRITE_QUEUE`` enabled the write is handed to the single
+    writer thread and group-committed with other donations; otherwise it is
+    committed on the request's own session.
+    """
+    if write_queue.enabled:
+        donation_id = write_queue.submit(_insert_donation, user_id, campaign_id, amount, message)
+        campaign_cache.invalidate()
+        return donation_id
+    donation = record_donation(user_id, campaign_id, amount, message)
+    db.session.commit()
+    return donation.id
+
+
+def change_donation(donation, amount, message=None):
+    """Change a donation's amount, moving only the difference onto its campaign
+
+    The delta is computed in SQL from the stored amount, so a concurrent edit
+    of the same donation cannot make the campaign total drift.
+    """
+    stored_amount = select(Donation.amount).where(Donation.id == donation.id).scalar_subquery()
+    delta = amount - func.coalesce(stored_amount, amount)
+    _execute(update(Campaign)
+             .where(Campaign.id == donation.campaign_id)
+             .values(collected_amount=func.coalesce(Campaign.collected_amount, 0) + delta))
+    campaign_cache.changed()
+    stats.donation_changed(donation.user_id, delta)
+    rollups.donation_changed(donation, delta)
+    _execute(update(Donation)
+             .where(Donation.id == donation.id)
+             .values(amount=amount, message=message))
+
+
+def remove_donation(donation):
+    """Delete a donation and debit whatever amount is still stored for it"""
+    stored_amount = func.coalesce(
+        select(Donation.amount).where(Donation.id == donation.id).scalar_subquery(), 0)
+    _execute(update(Campaign)
+             .where(Campaign.id == donation.campaign_id)
+             .values(collected_amount=func.coalesce(Campaign.collected_amount, 0) - stored_amount))
+    campaign_cache.changed()
+    stats.donation_removed(donation.user_id, stored_amount)
+    rollups.donation_removed(donation, stored_amount)
+    _execute(delete(Donation).where(Donation.id == donation.id))
+    db.session.expunge(donation)
+
+
+def remove_users_donations(user_ids):
+    """Debit every campaign the users donated to, before the users (and by cascade their donations) are deleted"""
+    for model in PARTITIONS:
+        from_users = model.user_id.in_(user_ids)
+        users_total = (select(func.coalesce(func.sum(model.amount), 0))
+                       .where(from_users, model.campaign_id == Campaign.id)
+                       .scalar_subquery())
+        _execute(update(Campaign)
+                 .where(Campaign.id.in_(select(model.campaign_id).where(from_users)))
+                 .values(collected_amount=func.coalesce(Campaign.collected_amount, 0) - users_total))
+    campaign_cache.changed()
+
+
+def reconcile(fix=False):
+    """Compare every campaign total with the sum of its donations, archived ones included
+
+    Returns a list of ``(campaign_id, title, recorded, actual)`` tuples for
+    campaigns whose stored total drifted. With ``fix=True`` the drifted totals
+    are overwritten with the recomputed value in the same transaction.
+    """
+    # One indexed sum per table and campaign
+    actual = sum(select(func.coalesce(func.sum(model.amount), 0))
+                 .where(model.campaign_id == Campaign.id)
+                 .scalar_subquery() for model in PARTITIONS)
+    rows = db.session.execute(
+        select(Campaign.id, Campaign.title, Campaign.collected_amount, actual)
+        .order_by(Campaign.id)
+    ).all()
+
+    drift = [(id, title, recorded or 0, total) for id, title, recorded, total in rows
+             if recorded is None or recorded != total]
+
+    if fix and drift:
+        _execute(update(Campaign)
+                 .where(Campaign.id.in_([row[0] for row in drift]))
+                 .values(collected_amount=actual))
+        campaign_cache.changed()
+        db.session.commit()
+    return drift
@@ -1,7 +1,6 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from app import db, login_manager
+from app import db, login_manager, identity_cache, hasher
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,15 +8,29 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), default='donor')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Read by Flask-Login; deactivated accounts cannot log in and lose their sessions
+    is_active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
-    donations = db.relationship('Donation', backref='donor', lazy='dynamic', cascade='all, delete-orphan')
+    # Rows go with ON DELETE CASCADE in the database, the ORM never loads them to delete one by one
+    donations = db.relationship('Donation', backref='donor', lazy='dynamic', cascade='all, delete-orphan',
+                                passive_deletes=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+        self.password_hash = hasher.hash(password)
+        if self.id is not None:
+            identity_cache.invalidate_after_commit(User, self.id)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def upgrade_password_hash(self, password):
+        """Rehash with the configured parameters after a successful login"""
+        if not hasher.needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        hasher.rehashed += 1
+        return True
 
     def is_admin(self):
         return self.role == 'admin'
@@ -31,12 +44,19 @@ class Campaign(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     image = db.Column(db.String(255))  # Featured image filename
-    target_amount = db.Column(db.Float, nullable=False)
-    collected_amount = db.Column(db.Float, default=0)
+    target_amount = db.Column(db.Integer, nullable=False)  # whole rupiah
+    collected_amount = db.Column(db.Integer, default=0)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_campaign_active_created', 'is_active', 'created_at'),
+        db.Index('ix_campaign_created', 'created_at'),
+        db.Index('ix_campaign_title', 'title'),  # covers the (id, title) filter dropdown
+    )
     
-    donations = db.relationship('Donation', backref='campaign', lazy='dynamic', cascade='all, delete-orphan')
+    donations = db.relationship('Donation', backref='campaign', lazy='dynamic', cascade='all, delete-orphan',
+                                passive_deletes=True)
 
     def progress_percentage(self):
         if self.target_amount == 0:
@@ -49,16 +69,165 @@ class Campaign(db.Model):
 
 class Donation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # whole rupiah
     message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Per-donor and per-campaign listings filter on the first column and
+        # sort by created_at; the implicit trailing rowid covers the id tie-breaker
+        db.Index('ix_donation_user_created', 'user_id', 'created_at'),
+        db.Index('ix_donation_campaign_created', 'campaign_id', 'created_at'),
+        db.Index('ix_donation_created', 'created_at'),
+        # Never hand out an id again once its row moved to donation_archive
+        {'sqlite_autoincrement': True},
+    )
+
+    archived = False
+
     def __repr__(self):
         return f'<Donation {self.amount} by User {self.user_id}>'
 
 
+class DonationArchive(db.Model):
+    """Cold donations moved out of ``donation`` by app.archive, read-only and under their original ids"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # whole rupiah
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Same listing indexes as donation, the merged pages seek both tables the same way
+        db.Index('ix_donation_archive_user_created', 'user_id', 'created_at'),
+        db.Index('ix_donation_archive_campaign_created', 'campaign_id', 'created_at'),
+        db.Index('ix_donation_archive_created', 'created_at'),
+    )
+
+    archived = True
+    donor = db.relationship('User', viewonly=True)
+    campaign = db.relationship('Campaign', viewonly=True)
+
+    def __repr__(self):
+        return f'<DonationArchive {self.amount} by User {self.user_id}>'
+
+
+class ImageBlob(db.Model):
+    """Content-addressed upload, shared by every campaign using the same file"""
+    filename = db.Column(db.String(80), primary_key=True)  # <sha256>.<ext>
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime)  # when ref_count last dropped to zero
+
+    def __repr__(self):
+        return f'<ImageBlob {self.filename} refs={self.ref_count}>'
+
+
+class ImportKey(db.Model):
+    """Idempotency keys of bulk-imported donations, so re-runs skip them"""
+    key = db.Column(db.String(64), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ImportKey {self.key}>'
+
+
+class StatCounter(db.Model):
+    """Site-wide counters maintained by app.stats"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StatCounter {self.name}={self.value}>'
+
+
+class UserDonationTotal(db.Model):
+    """Per-donor donation totals maintained by app.stats"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    total_amount = db.Column(db.Integer, nullable=False, default=0)
+    donation_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserDonationTotal {self.total_amount} by User {self.user_id}>'
+
+
+class DonationRollup(db.Model):
+    """Donations per campaign and time bucket, maintained by app.rollups"""
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(8), primary_key=True)  # 'hour' or 'day'
+    bucket = db.Column(db.Integer, primary_key=True)  # bucket start, unix seconds UTC
+    donation_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Integer, nullable=False, default=0)
+    donor_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_donation_rollup_bucket', 'granularity', 'bucket'),
+        {'sqlite_with_rowid': False},  # clustered on the primary key, no separate rowid b-tree
+    )
+
+    def __repr__(self):
+        return f'<DonationRollup {self.granularity} {self.bucket} of Campaign {self.campaign_id}>'
+
+
+class DonationRollupDonor(db.Model):
+    """One donor's share of a rollup bucket, so distinct donors can be counted over any range"""
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    donation_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_donation_rollup_donor_bucket', 'granularity', 'bucket', 'user_id'),
+        db.Index('ix_donation_rollup_donor_user', 'user_id', 'granularity', 'bucket'),
+        {'sqlite_with_rowid': False},
+    )
+
+    def __repr__(self):
+        return f'<DonationRollupDonor {self.granularity} {self.bucket} by User {self.user_id}>'
+
+
+# Predicate of the partial unique index on job.dedupe_key, repeated by ON CONFLICT in app.jobs
+JOB_DEDUPE_WHERE = "dedupe_key IS NOT NULL AND state IN ('queued', 'running')"
+
+
+class Job(db.Model):
+    """Deferred work run by ``flask run-jobs``, see app.jobs"""
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(50), nullable=False, default='default')
+    name = db.Column(db.String(100), nullable=False)  # registered task name
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    dedupe_key = db.Column(db.String(200))  # at most one queued or running job per key
+    state = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before, moved on retries
+    locked_by = db.Column(db.String(64))  # worker holding the lease
+    locked_until = db.Column(db.DateTime)  # lease expiry, after which another worker may take it over
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)  # JSON returned by the task
+
+    __table_args__ = (
+        # Claiming scans ready jobs of one queue in run_at order
+        db.Index('ix_job_claim', 'queue', 'state', 'run_at'),
+        db.Index('ix_job_finished', 'state', 'finished_at'),
+        db.Index('ux_job_dedupe', 'dedupe_key', unique=True, sqlite_where=db.text(JOB_DEDUPE_WHERE)),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.state}>'
+
+
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    user = identity_cache.get(User, int(id))
+    return user if user is not None and user.is_active else None
@@ -0,0 +1,212 @@
+import base64
+import heapq
+from datetime import datetime, timedelta
+from flask import current_app, request, url_for
+from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager
+from app.archive import PARTITIONS
+from app.models import User, Donation
+
+
+def encode_cursor(created_at, id):
+    """Encode a (created_at, id) keyset position as an opaque url-safe token"""
+    raw = f'{created_at.isoformat()}|{id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token, returning None for anything malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD query argument, ignoring invalid input"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def get_per_page():
+    """Read the requested page size, clamped to the configured bounds"""
+    default = current_app.config['DONATIONS_PER_PAGE']
+    maximum = current_app.config['DONATIONS_MAX_PER_PAGE']
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+class DonationFilters:
+    """Campaign, donor and date-range filters taken from the query string
+
+    ``user_id`` is never read from the request; the donor pages set it to the
+    logged-in user.
+    """
+
+    def __init__(self, campaign_id=None, donor=None, date_from=None, date_to=None, user_id=None):
+        self.campaign_id = campaign_id
+        self.donor = donor
+        self.date_from = date_from
+        self.date_to = date_to
+        self.user_id = user_id
+
+    @classmethod
+    def from_request(cls):
+        return cls(
+            campaign_id=request.args.get('campaign_id', type=int),
+            donor=request.args.get('donor', '').strip() or None,
+            date_from=parse_date(request.args.get('date_from')),
+            date_to=parse_date(request.args.get('date_to')),
+        )
+
+    def as_payload(self):
+        """JSON-safe copy for a background export job"""
+        return {'campaign_id': self.campaign_id, 'donor': self.donor,
+                'date_from': self.date_from.strftime('%Y-%m-%d') if self.date_from else None,
+                'date_to': self.date_to.strftime('%Y-%m-%d') if self.date_to else None}
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(campaign_id=payload.get('campaign_id'), donor=payload.get('donor'),
+                   date_from=parse_date(payload.get('date_from')), date_to=parse_date(payload.get('date_to')))
+
+    def apply(self, query, model=Donation):
+        """Filter a query over ``model``, the donation table or the archive"""
+        if self.user_id:
+            query = query.filter(model.user_id == self.user_id)
+        if self.campaign_id:
+            query = query.filter(model.campaign_id == self.campaign_id)
+        if self.donor:
+            query = query.filter(User.username == self.donor)
+        if self.date_from:
+            query = query.filter(model.created_at >= self.date_from)
+        if self.date_to:
+            # date_to is inclusive, so compare against the start of the next day
+            query = query.filter(model.created_at < self.date_to + timedelta(days=1))
+        return query
+
+
+class KeysetPage:
+    """One page of donations plus the cursors needed to move around it"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def _url(self, **cursor):
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        args.update(cursor)
+        return url_for(request.endpoint, **request.view_args, **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.has_prev else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def donation_query(model=Donation):
+    """Donations joined to their donor and campaign, loaded in a single SELECT"""
+    return (model.query
+            .join(model.donor)
+            .join(model.campaign)
+            .options(contains_eager(model.donor), contains_eager(model.campaign)))
+
+
+def _beyond(query, model, position, newer):
+    """Rows newer than ``position`` in (created_at, id) order if ``newer``, else older ones"""
+    created_at, id = position
+    # The plain range lets SQLite seek the created_at index instead of filtering its way there
+    if newer:
+        return query.filter(model.created_at >= created_at,
+                            or_(model.created_at > created_at, model.id > id))
+    return query.filter(model.created_at <= created_at,
+                        or_(model.created_at < created_at, model.id < id))
+
+
+def page_query(filters, model, limit, position=None, newer=False, bound=None):
+    """One table's share of a page: up to ``limit`` rows past ``position``, ahead of ``bound``"""
+    query = filters.apply(donation_query(model), model)
+    if position is not None:
+        query = _beyond(query, model, position, newer)
+    if bound is not None:
+        query = _beyond(query, model, bound, not newer)
+    if newer:
+        return query.order_by(model.created_at.asc(), model.id.asc()).limit(limit)
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+
+
+def find_donations(filters, limit, after=None, before=None):
+    """Up to ``limit`` donations from the hot table and the archive, newest first
+
+    With a decoded ``before`` cursor the rows come oldest first, walking back
+    towards the newest. Each table is read with the same keyset query and the
+    two sorted runs are merged. The archive is only asked for rows that would
+    still make the cut: once the hot rows fill ``limit``, its query is bounded
+    by the last of them, so for recent pages it is one index seek that finds
+    nothing.
+    """
+    newer = before is not None
+    key = lambda row: (row.created_at, row.id)
+    rows = []
+    for model in PARTITIONS:
+        bound = key(rows[-1]) if len(rows) == limit else None
+        query = page_query(filters, model, limit, before if newer else after, newer, bound)
+        rows = list(heapq.merge(rows, query.all(), key=key, reverse=not newer))[:limit]
+    return rows
+
+
+def paginate_donations(filters):
+    """Paginate donations using the cursor and page size from the request
+
+    Pages are positioned by the (created_at, id) of their first or last row,
+    so each one costs a LIMIT query per table regardless of its depth.
+    """
+    per_page = get_per_page()
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before')) if after is None else None
+
+    rows = find_donations(filters, per_page + 1, after, before)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before is not None:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    if rows and has_prev:
+        prev_cursor = encode_cursor(rows[0].created_at, rows[0].id)
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
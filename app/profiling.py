@@ -0,0 +1,195 @@
+"""Opt-in per-request SQL profiler
+
+With ``PROFILER_ENABLED`` set, engine events time every statement and the
+request hooks add up query count, database time and template render time per
+request. The numbers go out as a ``Server-Timing`` header, are aggregated per
+endpoint for the admin summary page, and statements slower than
+``PROFILER_SLOW_QUERY_MS`` are written to a rotating log. A statement shape
+repeated ``PROFILER_N_PLUS_ONE_THRESHOLD`` times in one request is flagged as
+a likely N+1.
+
+When disabled nothing is registered at all, so the only cost is the config
+lookup in ``init_app``.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+# Expanded IN lists and multi-row VALUES differ only in placeholder count
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize a statement so repeats with different parameters compare equal"""
+    return _WHITESPACE.sub(' ', _PLACEHOLDER_LIST.sub('?', statement)).strip()
+
+
+class RequestProfile:
+    """Counters for the request currently being handled"""
+    __slots__ = ('started', 'queries', 'db_time', 'render_time', 'render_started', 'shapes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = self.render_time = 0.0
+        self.render_started = None
+        self.shapes = Counter()
+
+    def repeated(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+class EndpointStats:
+    """Running totals for one endpoint"""
+    __slots__ = ('requests', 'queries', 'max_queries', 'db_time', 'render_time', 'total_time',
+                 'n_plus_one', 'suspect')
+
+    def __init__(self):
+        self.requests = self.queries = self.max_queries = self.n_plus_one = 0
+        self.db_time = self.render_time = self.total_time = 0.0
+        self.suspect = None
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'avg_queries': self.queries / requests,
+            'max_queries': self.max_queries,
+            'avg_db_ms': self.db_time / requests * 1000,
+            'avg_render_ms': self.render_time / requests * 1000,
+            'avg_total_ms': self.total_time / requests * 1000,
+            'n_plus_one': self.n_plus_one,
+            'suspect': self.suspect,
+        }
+
+
+class Profiler:
+    """Flask extension wiring the profiler into the engine and request lifecycle"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.slow_query_seconds = 0.1
+        self.n_plus_one_threshold = 5
+        self.server_timing = True
+        self.slow_log = logging.getLogger('app.slow_queries')
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILER_ENABLED', False)
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        self.slow_query_seconds = app.config.get('PROFILER_SLOW_QUERY_MS', 100) / 1000
+        self.n_plus_one_threshold = app.config.get('PROFILER_N_PLUS_ONE_THRESHOLD', 5)
+        self.server_timing = app.config.get('PROFILER_SERVER_TIMING', True)
+        self._setup_slow_log(app)
+
+        from app import db
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_execute)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _setup_slow_log(self, app):
+        path = app.config.get('PROFILER_SLOW_QUERY_LOG')
+        if not path or any(getattr(handler, 'baseFilename', None) == os.path.abspath(path)
+                           for handler in self.slow_log.handlers):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=app.config.get('PROFILER_SLOW_QUERY_LOG_MAX_BYTES', 1024 * 1024),
+                                      backupCount=app.config.get('PROFILER_SLOW_QUERY_LOG_BACKUPS', 5))
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.slow_log.addHandler(handler)
+        self.slow_log.setLevel(logging.INFO)
+        self.slow_log.propagate = False
+
+    # ==================== ENGINE EVENTS ====================
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiler_started'].pop()
+        profile = g.get('profile') if has_request_context() else None
+        if profile is not None:
+            profile.queries += 1
+            profile.db_time += elapsed
+            profile.shapes[statement_shape(statement)] += 1
+        if elapsed >= self.slow_query_seconds:
+            endpoint = request.endpoint if has_request_context() else '-'
+            self.slow_log.info('%.1fms endpoint=%s statement=%s parameters=%.200r',
+                               elapsed * 1000, endpoint, statement_shape(statement), parameters)
+
+    # ==================== REQUEST LIFECYCLE ====================
+
+    def _before_render(self, app, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+
+    def _after_render(self, app, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None and profile.render_started is not None:
+            profile.render_time += time.perf_counter() - profile.render_started
+            profile.render_started = None
+
+    def _start_request(self):
+        g.profile = RequestProfile()
+
+    def _finish_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        total = time.perf_counter() - profile.started
+        repeated = profile.repeated(self.n_plus_one_threshold)
+        endpoint = request.endpoint or request.path
+
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.requests += 1
+            stats.queries += profile.queries
+            stats.max_queries = max(stats.max_queries, profile.queries)
+            stats.db_time += profile.db_time
+            stats.render_time += profile.render_time
+            stats.total_time += total
+            if repeated:
+                stats.n_plus_one += 1
+                stats.suspect = repeated[0]
+
+        if repeated:
+            shape, count = repeated[0]
+            self.slow_log.warning('possible N+1 endpoint=%s repeats=%d statement=%s', endpoint, count, shape)
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', ', '.join((
+                f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+                f'render;dur={profile.render_time * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            )))
+        return response
+
+    # ==================== SUMMARY ====================
+
+    def summary(self):
+        """Per-endpoint averages, busiest database time first"""
+        with self._lock:
+            rows = [(endpoint, stats.as_dict(), stats.db_time) for endpoint, stats in self._endpoints.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return [(endpoint, values) for endpoint, values, _ in rows]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
@@ -0,0 +1,204 @@
+"""Live campaign progress for the donor dashboard
+
+``progress_payload`` is the compact JSON the polling endpoint returns.
+``ProgressBroadcaster`` pushes changes over Server-Sent Events: one thread
+per process reloads progress when a commit touched campaigns (``notify`` is
+called from the campaign cache invalidation) or every ``SSE_POLL_INTERVAL``
+seconds to pick up commits made by other workers. It diffs the result with
+the last known state and publishes only the changed campaigns, so a change
+costs one query however many streams are open. Streams wait on a shared
+condition rather than polling the database themselves.
+"""
+import json
+import threading
+import uuid
+from collections import deque
+
+RETRY_MS = 3000  # how long browsers wait before reconnecting a dropped stream
+
+
+def _progress(id, collected_amount, target_amount):
+    collected_amount = collected_amount or 0
+    progress = min(100, collected_amount / target_amount * 100) if target_amount else 0
+    return {'id': id, 'collected_amount': collected_amount, 'target_amount': target_amount,
+            'progress': round(progress, 1)}
+
+
+def progress_payload(campaigns):
+    return {'campaigns': [_progress(campaign.id, campaign.collected_amount, campaign.target_amount)
+                          for campaign in campaigns]}
+
+
+def _load():
+    from sqlalchemy import select
+    from app import db
+    from app.models import Campaign
+
+    # Straight from the database, a cached copy may predate another worker's commit
+    rows = db.session.execute(select(Campaign.id, Campaign.collected_amount, Campaign.target_amount)
+                              .where(Campaign.is_active.is_(True))).all()
+    return {row.id: _progress(*row) for row in rows}
+
+
+def _event(name, data, id=None):
+    lines = [f'id: {id}'] if id is not None else []
+    lines += [f'event: {name}', 'data: ' + json.dumps(data, separators=(',', ':')), '', '']
+    return '\n'.join(lines)
+
+
+class ProgressBroadcaster:
+    """Flask extension fanning campaign progress changes out to SSE streams"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.heartbeat = 15
+        self.poll_interval = 5
+        self.max_clients = 1000
+        self._condition = threading.Condition()
+        self._wake = threading.Event()
+        self._thread = None
+        self._reset(256)
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self, history):
+        self._state = None  # {campaign_id: progress dict}, None until first loaded
+        # Versions only mean something within this process and run, event ids carry both
+        self.epoch = uuid.uuid4().hex[:8]
+        self._history = deque(maxlen=history)  # (version, changed, removed)
+        self.version = 0
+        self.clients = self.connections = self.rejected = 0
+        self.reloads = self.published = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.heartbeat = app.config.get('SSE_HEARTBEAT', 15)
+        self.poll_interval = app.config.get('SSE_POLL_INTERVAL', 5)
+        self.max_clients = app.config.get('SSE_MAX_CLIENTS', 1000)
+        with self._condition:
+            self._reset(app.config.get('SSE_HISTORY', 256))
+        self._thread = None
+        app.extensions['progress_broadcaster'] = self
+
+    def notify(self):
+        """Something changed campaign totals; reload soon if anyone is listening"""
+        self._wake.set()
+
+    def _start(self):
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='progress-broadcaster', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Idle until a client connects, then also poll for other workers' commits
+            timeout = (self.poll_interval or None) if self.clients else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if not self.clients:
+                continue
+            with self.app.app_context():
+                current = _load()
+            self.publish(current)
+
+    def publish(self, current):
+        """Diff ``{campaign_id: progress}`` with the last state and wake every stream if anything changed"""
+        with self._condition:
+            self.reloads += 1
+            previous, self._state = self._state, current
+            if previous is None:
+                self._condition.notify_all()
+                return
+            changed = [progress for id, progress in current.items() if previous.get(id) != progress]
+            removed = [id for id in previous if id not in current]
+            if not changed and not removed:
+                return
+            self.version += 1
+            self.published += 1
+            self._history.append((self.version, changed, removed))
+            self._condition.notify_all()
+
+    def _changes_since(self, version):
+        """Changes after ``version`` as ``(changed, removed)``, or None if no longer in the history"""
+        if version == self.version:
+            return [], []
+        if not self._history or version < self._history[0][0] - 1 or version > self.version:
+            return None
+        merged, removed = {}, set()
+        for entry_version, changed, gone in self._history:
+            if entry_version > version:
+                for progress in changed:
+                    merged[progress['id']] = progress
+                    removed.discard(progress['id'])
+                for id in gone:
+                    merged.pop(id, None)
+                    removed.add(id)
+        return list(merged.values()), sorted(removed)
+
+    def subscribe(self, last_event_id=None):
+        """Register a stream and return its iterable of events, or None if the process is full"""
+        with self._condition:
+            if self.clients >= self.max_clients:
+                self.rejected += 1
+                return None
+            self.clients += 1
+            self.connections += 1
+        self._start()
+        if self._state is None:
+            self.notify()
+        return _Subscription(self, last_event_id)
+
+    def _unsubscribe(self):
+        with self._condition:
+            self.clients -= 1
+
+    def _events(self, last_event_id):
+        version = None
+        epoch, _, number = (last_event_id or '').partition('-')
+        if epoch == self.epoch and number.isdigit():
+            version = int(number)
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            with self._condition:
+                if self._state is None or version == self.version:
+                    self._condition.wait(self.heartbeat)
+                state, current = self._state, self.version
+                changes = self._changes_since(version) if version is not None else None
+            event_id = f'{self.epoch}-{current}'
+            if state is None:
+                yield ': waiting\n\n'
+                continue
+            if changes is None:
+                yield _event('snapshot', {'campaigns': list(state.values())}, event_id)
+            elif changes[0] or changes[1]:
+                yield _event('progress', {'campaigns': changes[0], 'removed': changes[1]}, event_id)
+            else:
+                # Keep-alive, writing it is also how a dropped connection is noticed
+                yield ': ping\n\n'
+            version = current
+
+    def stats(self):
+        with self._condition:
+            return {'clients': self.clients, 'connections': self.connections, 'rejected': self.rejected,
+                    'version': self.version, 'reloads': self.reloads, 'published': self.published,
+                    'running': self._thread is not None and self._thread.is_alive()}
+
+
+class _Subscription:
+    """One open stream; the server calls ``close`` when the client goes away"""
+
+    def __init__(self, broadcaster, last_event_id):
+        self._broadcaster = broadcaster
+        self._events = broadcaster._events(last_event_id)
+        self._closed = False
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        # Also reached if the client left before the first event was sent
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            self._broadcaster._unsubscribe()
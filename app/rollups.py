@@ -0,0 +1,327 @@
+"""Pre-bucketed donation analytics
+
+Every donation is counted into an hourly and a daily bucket of its campaign
+in ``donation_rollup`` (donations, amount and distinct donors), with SQL-side
+deltas in the same transaction as the donation write, like app.stats does
+for the dashboard counters. Distinct donors do not add up across buckets or
+campaigns, so ``donation_rollup_donor`` keeps each donor's share of a bucket:
+a bucket's donor count is recounted from it on every change, and ranges that
+span several buckets count distinct donors there instead of in ``donation``.
+
+Buckets are the UTC unix timestamp of their start, matching ``created_at``.
+Weeks (starting Monday) and months are summed from the daily buckets.
+"""
+import calendar
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import Integer, bindparam, cast, delete, distinct, func, literal, select, update
+from sqlalchemy.dialects.sqlite import insert
+from app import db, stats
+from app.archive import all_donations
+from app.models import DonationRollup, DonationRollupDonor, UserDonationTotal
+
+# Stored granularities and their width in seconds
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+# Queryable periods, the stored granularity each is summed from and its default span
+PERIODS = {'hour': ('hour', 48), 'day': ('day', 30), 'week': ('day', 12), 'month': ('day', 12)}
+
+_rollup = DonationRollup.__table__
+_donor = DonationRollupDonor.__table__
+
+
+def bucket_start(moment, granularity):
+    """Unix timestamp of the ``granularity`` bucket holding ``moment`` (naive UTC)"""
+    seconds = calendar.timegm(moment.timetuple())
+    return seconds - seconds % GRANULARITIES[granularity]
+
+
+def _sql_bucket(created_at, granularity):
+    seconds = cast(func.strftime('%s', created_at), Integer)
+    return seconds - seconds % GRANULARITIES[granularity]
+
+
+def _same_bucket(table):
+    return ((table.c.campaign_id == bindparam('c')) & (table.c.granularity == bindparam('g'))
+            & (table.c.bucket == bindparam('b')))
+
+
+def _donor_upsert(amount):
+    statement = insert(_donor).values(campaign_id=bindparam('c'), granularity=bindparam('g'),
+                                      bucket=bindparam('b'), user_id=bindparam('u'),
+                                      donation_count=bindparam('n'), amount=amount)
+    return statement.on_conflict_do_update(
+        index_elements=[_donor.c.campaign_id, _donor.c.granularity, _donor.c.bucket, _donor.c.user_id],
+        set_={'donation_count': _donor.c.donation_count + statement.excluded.donation_count,
+              'amount': _donor.c.amount + statement.excluded.amount})
+
+
+def _rollup_upsert(amount):
+    # Runs after the donor rows were adjusted, so the recount is already current
+    donors = select(func.count()).select_from(_donor).where(_same_bucket(_donor)).scalar_subquery()
+    statement = insert(_rollup).values(campaign_id=bindparam('c'), granularity=bindparam('g'),
+                                       bucket=bindparam('b'), donation_count=bindparam('n'), amount=amount,
+                                       donor_count=donors)
+    return statement.on_conflict_do_update(
+        index_elements=[_rollup.c.campaign_id, _rollup.c.granularity, _rollup.c.bucket],
+        set_={'donation_count': _rollup.c.donation_count + statement.excluded.donation_count,
+              'amount': _rollup.c.amount + statement.excluded.amount,
+              'donor_count': statement.excluded.donor_count})
+
+
+def _apply(deltas, connection=None, amount=None):
+    """Add ``{(campaign_id, user_id, created_at): (count, amount)}`` to every granularity
+
+    ``amount`` replaces the per-donation amounts with one SQL expression, for
+    changes whose size is only known from the stored donation.
+    """
+    donors = defaultdict(lambda: [0, 0])
+    for (campaign_id, user_id, created_at), (count, value) in deltas.items():
+        for granularity in GRANULARITIES:
+            total = donors[campaign_id, granularity, bucket_start(created_at, granularity), user_id]
+            total[0] += count
+            total[1] += value or 0
+    _apply_shares(donors, connection, amount)
+
+
+def _apply_shares(donors, connection=None, amount=None):
+    """Add ``{(campaign_id, granularity, bucket, user_id): (count, amount)}`` to the rollups"""
+    if not donors:
+        return
+    buckets = defaultdict(lambda: [0, 0])
+    for (campaign_id, granularity, bucket, _), (count, value) in donors.items():
+        buckets[campaign_id, granularity, bucket][0] += count
+        buckets[campaign_id, granularity, bucket][1] += value
+
+    execute = (connection or db.session).execute
+    value = bindparam('a') if amount is None else amount
+    donor_rows = [{'c': c, 'g': g, 'b': b, 'u': u, 'n': n, 'a': a} for (c, g, b, u), (n, a) in donors.items()]
+    bucket_rows = [{'c': c, 'g': g, 'b': b, 'n': n, 'a': a} for (c, g, b), (n, a) in buckets.items()]
+    if amount is not None:
+        for row in donor_rows + bucket_rows:
+            del row['a']
+    execute(_donor_upsert(value), donor_rows)
+    shrinking = any(count < 0 for count, _ in donors.values())
+    if shrinking:
+        execute(delete(_donor).where(_same_bucket(_donor), _donor.c.user_id == bindparam('u'),
+                                     _donor.c.donation_count <= 0),
+                [{'c': c, 'g': g, 'b': b, 'u': u} for c, g, b, u in donors])
+    execute(_rollup_upsert(value), bucket_rows)
+    if shrinking:
+        execute(delete(_rollup).where(_same_bucket(_rollup), _rollup.c.donation_count <= 0),
+                [{'c': c, 'g': g, 'b': b} for c, g, b in buckets])
+
+
+def donation_added(campaign_id, user_id, created_at, amount, connection=None):
+    _apply({(campaign_id, user_id, created_at): (1, amount)}, connection)
+
+
+def donations_added(rows):
+    """Count many new donations at once, ``rows`` being dicts with the donation columns"""
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        delta = deltas[row['campaign_id'], row['user_id'], row['created_at']]
+        delta[0] += 1
+        delta[1] += row['amount']
+    _apply(deltas)
+
+
+def donation_changed(donation, delta):
+    """Move an amount change into the donation's buckets; ``delta`` may be a SQL expression"""
+    _apply({(donation.campaign_id, donation.user_id, donation.created_at): (0, None)}, amount=delta)
+
+
+def donation_removed(donation, amount):
+    """Take a donation out of its buckets; ``amount`` may be a SQL expression"""
+    _apply({(donation.campaign_id, donation.user_id, donation.created_at): (-1, None)}, amount=-amount)
+
+
+def users_deleted(user_ids):
+    """Subtract everything the donors gave from the buckets they appear in, before they are deleted
+
+    Their own shares, like every bucket of a deleted campaign, go through ON DELETE CASCADE.
+    """
+    shares = (select(_donor.c.campaign_id, _donor.c.granularity, _donor.c.bucket,
+                     func.sum(_donor.c.donation_count).label('donations'),
+                     func.sum(_donor.c.amount).label('amount'), func.count().label('donors'))
+              .where(_donor.c.user_id.in_(user_ids))
+              .group_by(_donor.c.campaign_id, _donor.c.granularity, _donor.c.bucket)
+              .subquery())
+    db.session.execute(
+        update(_rollup)
+        .where(_rollup.c.campaign_id == shares.c.campaign_id, _rollup.c.granularity == shares.c.granularity,
+               _rollup.c.bucket == shares.c.bucket)
+        .values(donation_count=_rollup.c.donation_count - shares.c.donations,
+                amount=_rollup.c.amount - shares.c.amount,
+                donor_count=_rollup.c.donor_count - shares.c.donors))
+    db.session.execute(
+        delete(_rollup)
+        .where(_rollup.c.campaign_id.in_(select(_donor.c.campaign_id).where(_donor.c.user_id.in_(user_ids))),
+               _rollup.c.donation_count <= 0))
+
+
+def _rebuild(campaign_id=None):
+    """Recompute the buckets of one campaign, or of all, from the donations and commit
+
+    The delete takes the write lock first, so donations committed while this
+    runs are either counted here or wait and apply their delta afterwards.
+    """
+    def scope(table):
+        return [] if campaign_id is None else [table.c.campaign_id == campaign_id]
+
+    db.session.execute(delete(_donor).where(*scope(_donor)))
+    db.session.execute(delete(_rollup).where(*scope(_rollup)))
+    # A full rebuild loads millions of rows, cheaper to index them once afterwards
+    indexes = list(_donor.indexes) if campaign_id is None else []
+    connection = db.session.connection()
+    for index in indexes:
+        index.drop(connection)
+    donations = all_donations()  # archived donations are still counted
+    for granularity in GRANULARITIES:
+        bucket = _sql_bucket(donations.c.created_at, granularity)
+        # Grouped in primary key order, so the rows are appended rather than scattered
+        db.session.execute(insert(_donor).from_select(
+            ['campaign_id', 'granularity', 'bucket', 'user_id', 'donation_count', 'amount'],
+            select(donations.c.campaign_id, literal(granularity), bucket, donations.c.user_id,
+                   func.count(donations.c.id), func.sum(donations.c.amount))
+            .where(*scope(donations))
+            .group_by(donations.c.campaign_id, bucket, donations.c.user_id)))
+    for index in indexes:
+        index.create(connection)
+    db.session.execute(insert(_rollup).from_select(
+        ['campaign_id', 'granularity', 'bucket', 'donation_count', 'amount', 'donor_count'],
+        select(_donor.c.campaign_id, _donor.c.granularity, _donor.c.bucket,
+               func.sum(_donor.c.donation_count), func.sum(_donor.c.amount), func.count())
+        .where(*scope(_donor))
+        .group_by(_donor.c.campaign_id, _donor.c.granularity, _donor.c.bucket)))
+    db.session.commit()
+
+
+def rebuild(campaign_ids=None, echo=None):
+    """Backfill the rollups from the donations, archived ones included
+
+    Without ``campaign_ids`` everything is rebuilt in one pass and one
+    transaction; with them each campaign gets its own short transaction.
+    Returns the number of buckets stored afterwards.
+    """
+    if campaign_ids is None:
+        _rebuild()
+    for number, campaign_id in enumerate(campaign_ids or (), 1):
+        _rebuild(campaign_id)
+        if echo:
+            echo(f'campaign {campaign_id}: rebuilt ({number}/{len(campaign_ids)})')
+    return db.session.scalar(select(func.count()).select_from(_rollup))
+
+
+def is_empty():
+    return db.session.execute(select(_rollup.c.bucket).limit(1)).first() is None
+
+
+# ==================== QUERIES ====================
+
+def floor(moment, period):
+    """Start of the ``period`` holding ``moment``"""
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def step(moment, period):
+    """Start of the period after the one starting at ``moment``"""
+    if period == 'month':
+        return moment.replace(year=moment.year + moment.month // 12, month=moment.month % 12 + 1)
+    return moment + {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(weeks=1)}[period]
+
+
+def default_range(period, count=None, now=None):
+    """The last ``count`` periods up to and including the current one, ``PERIODS`` has the default"""
+    end = step(floor(now or datetime.utcnow(), period), period)
+    start = end
+    for _ in range(count or PERIODS[period][1]):
+        start = floor(start - timedelta(seconds=1), period)
+    return start, end
+
+
+def _period_bucket(bucket, period):
+    """SQL expression mapping a stored bucket to the start of its ``period``"""
+    if period == 'week':
+        # 1970-01-01 was a Thursday, three days after a Monday
+        return bucket - ((bucket // 86400 + 3) % 7) * 86400
+    if period == 'month':
+        return cast(func.strftime('%s', bucket, 'unixepoch', 'start of month'), Integer)
+    return bucket
+
+
+def _in_range(table, granularity, start, end, campaign_id):
+    conditions = [table.c.granularity == granularity,
+                  table.c.bucket >= calendar.timegm(start.timetuple()),
+                  table.c.bucket < calendar.timegm(end.timetuple())]
+    if campaign_id is not None:
+        conditions.append(table.c.campaign_id == campaign_id)
+    return conditions
+
+
+def _probe_donors(granularity, start, end):
+    """Distinct donors with a share in ``[start, end)``, one index seek per donor"""
+    share = select(_donor.c.user_id).where(_donor.c.user_id == UserDonationTotal.user_id,
+                                           *_in_range(_donor, granularity, start, end, None))
+    return db.session.scalar(select(func.count()).select_from(UserDonationTotal).where(share.exists()))
+
+
+def series(period, start, end, campaign_id=None):
+    """Donations, amount and distinct donors per ``period`` in ``[start, end)``
+
+    ``start`` and ``end`` are naive UTC datetimes on period boundaries. Empty
+    periods are included with zeros. Returns ``(buckets, totals)``.
+    """
+    granularity = PERIODS[period][0]
+    conditions = _in_range(_rollup, granularity, start, end, campaign_id)
+    donor_conditions = _in_range(_donor, granularity, start, end, campaign_id)
+    key = _period_bucket(_rollup.c.bucket, period).label('period')
+    sums = {row.period: row for row in db.session.execute(
+        select(key, func.sum(_rollup.c.donation_count).label('donations'), func.sum(_rollup.c.amount).label('amount'))
+        .where(*conditions).group_by(key))}
+    moments = []
+    moment = start
+    while moment < end:
+        moments.append(moment)
+        moment = step(moment, period)
+
+    # Scanning the shares touches about one row per donation in range, probing
+    # every donor costs one seek per donor and period; pick the cheaper
+    shares = sum(row.donations for row in sums.values())
+    if campaign_id is None and shares > stats.get_counters()['users'] * (len(moments) + 1):
+        donors = {calendar.timegm(moment.timetuple()): _probe_donors(granularity, moment, step(moment, period))
+                  for moment in moments}
+        total_donors = _probe_donors(granularity, start, end)
+    else:
+        if campaign_id is not None and period == granularity:
+            # One stored bucket per period, its donor count is already distinct
+            donors = dict(db.session.execute(select(_rollup.c.bucket, _rollup.c.donor_count).where(*conditions)).all())
+        else:
+            donor_key = _period_bucket(_donor.c.bucket, period)
+            donors = dict(db.session.execute(
+                select(donor_key, func.count(distinct(_donor.c.user_id)))
+                .where(*donor_conditions).group_by(donor_key)).all())
+        total_donors = db.session.scalar(select(func.count(distinct(_donor.c.user_id))).where(*donor_conditions))
+
+    buckets = []
+    for moment in moments:
+        seconds = calendar.timegm(moment.timetuple())
+        row = sums.get(seconds)
+        buckets.append({'start': moment, 'donations': row.donations if row else 0,
+                        'amount': row.amount if row else 0, 'donors': donors.get(seconds, 0)})
+    totals = {'donations': shares, 'amount': sum(b['amount'] for b in buckets), 'donors': total_donors or 0}
+    return buckets, totals
+
+
+def count_periods(period, start, end):
+    """Number of periods in ``[start, end)``, both on period boundaries"""
+    if period == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month
+    width = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}[period]
+    return int((end - start).total_seconds()) // width
@@ -1,12 +1,15 @@
-import os
-import uuid
+from datetime import datetime, timezone
 from functools import wraps
-from flask import Blueprint, render_template, redirect, url_for, flash, abort, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, abort, request, current_app, jsonify, \
+    Response, stream_with_context
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from app import db
-from app.models import User, Campaign, Donation
-from app.forms import CampaignForm, UserEditForm
+from sqlalchemy import delete, select, update
+from werkzeug.datastructures import FileStorage
+from app import broadcaster, cache, campaign_cache, compressor, db, db_profile, hasher, identity_cache, image_store, \
+    jobs, ledger, login_throttle, profiler, rollups, search, startup_profiler, static_assets, stats, write_queue
+from app.models import User, Campaign, Job
+from app.forms import CampaignForm, UserEditForm, ImportForm
+from app.pagination import DonationFilters, find_donations, get_per_page, paginate_donations
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -18,29 +21,48 @@ def allowed_file(filename):
 
 
 def save_image(file):
-    """Save uploaded image and return filename"""
-    if file and file.filename and allowed_file(file.filename):
-        # Generate unique filename
+    """Store uploaded image by content hash and return filename"""
+    if isinstance(file, FileStorage) and file.filename and allowed_file(file.filename):
         ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        
-        # Ensure upload directory exists
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # Save file
-        filepath = os.path.join(upload_folder, filename)
-        file.save(filepath)
-        return filename
+        return image_store.store(file, ext)
     return None
 
 
 def delete_image(filename):
-    """Delete image file if exists"""
+    """Drop this campaign's reference; the file is removed by a queued images.gc job"""
     if filename:
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        image_store.release(filename)
+
+
+def selected_ids():
+    """Ids ticked in a bulk action form"""
+    return sorted(set(request.form.getlist('ids', type=int)))
+
+
+def delete_campaigns(ids):
+    """Delete campaigns with a fixed number of statements, however many donations they have
+
+    Donations, archived or not, and rollup buckets go with ON DELETE CASCADE; only the
+    counters and image references are adjusted here. Returns how many were deleted.
+    """
+    image_store.release_many(db.session.scalars(select(Campaign.image).where(Campaign.id.in_(ids))))
+    stats.campaigns_deleted(ids)
+    deleted = db.session.execute(delete(Campaign).where(Campaign.id.in_(ids)),
+                                 execution_options={'synchronize_session': False}).rowcount
+    campaign_cache.changed()
+    return deleted
+
+
+def delete_users(ids):
+    """Delete users and, through ON DELETE CASCADE, their donations; returns how many were deleted"""
+    # Their donations disappear with them, so take them out of the campaign totals first
+    ledger.remove_users_donations(ids)
+    stats.users_deleted(ids)
+    rollups.users_deleted(ids)
+    for id in ids:
+        identity_cache.invalidate_after_commit(User, id)
+    return db.session.execute(delete(User).where(User.id.in_(ids)),
+                              execution_options={'synchronize_session': False}).rowcount
 
 
 def admin_required(f):
@@ -57,22 +79,22 @@ def admin_required(f):
 @admin_bp.route('/')
 @admin_required
 def dashboard():
-    total_users = User.query.count()
-    total_campaigns = Campaign.query.count()
-    total_donations = Donation.query.count()
-    total_collected = db.session.query(db.func.sum(Donation.amount)).scalar() or 0
+    counters = stats.get_counters()
     
-    recent_donations = Donation.query.order_by(Donation.created_at.desc()).limit(5).all()
+    recent_donations = find_donations(DonationFilters(), 5)
     active_campaigns = Campaign.query.filter_by(is_active=True).limit(5).all()
+    daily, daily_totals = rollups.series('day', *rollups.default_range('day', 14))
     
     return render_template('admin/dashboard.html', 
                           title='Admin Dashboard',
-                          total_users=total_users,
-                          total_campaigns=total_campaigns,
-                          total_donations=total_donations,
-                          total_collected=total_collected,
+                          total_users=int(counters['users']),
+                          total_campaigns=int(counters['campaigns']),
+                          total_donations=int(counters['donations']),
+                          total_collected=counters['collected'],
                           recent_donations=recent_donations,
-                          active_campaigns=active_campaigns)
+                          active_campaigns=active_campaigns,
+                          daily=daily,
+                          daily_totals=daily_totals)
 
 
 # ==================== CAMPAIGN CRUD ====================
@@ -102,6 +124,8 @@ def create_campaign():
             is_active=form.is_active.data
         )
         db.session.add(campaign)
+        stats.bump(campaigns=1)
+        campaign_cache.changed()
         db.session.commit()
         flash('Campaign berhasil dibuat!', 'success')
         return redirect(url_for('admin.campaigns'))
@@ -118,16 +142,18 @@ def edit_campaign(id):
     
     if form.validate_on_submit():
         # Handle image upload
-        if form.image.data:
-            # Delete old image
+        # Without a new upload the field still holds the current filename from obj=campaign
+        new_image = save_image(form.image.data)
+        if new_image:
+            # Released after saving, the new upload may be the very same file
             delete_image(campaign.image)
-            # Save new image
-            campaign.image = save_image(form.image.data)
+            campaign.image = new_image
         
         campaign.title = form.title.data
         campaign.description = form.description.data
         campaign.target_amount = form.target_amount.data
         campaign.is_active = form.is_active.data
+        campaign_cache.changed()
         db.session.commit()
         flash('Campaign berhasil diperbarui!', 'success')
         return redirect(url_for('admin.campaigns'))
@@ -139,14 +165,34 @@ def edit_campaign(id):
 @admin_required
 def delete_campaign(id):
     campaign = Campaign.query.get_or_404(id)
-    # Delete image file
-    delete_image(campaign.image)
-    db.session.delete(campaign)
+    delete_campaigns([campaign.id])
     db.session.commit()
     flash('Campaign berhasil dihapus!', 'success')
     return redirect(url_for('admin.campaigns'))
 
 
+@admin_bp.route('/campaigns/bulk', methods=['POST'])
+@admin_required
+def bulk_campaigns():
+    action, ids = request.form.get('action'), selected_ids()
+    if action not in ('activate', 'deactivate', 'delete'):
+        abort(400)
+    if not ids:
+        flash('Pilih minimal satu campaign.', 'warning')
+        return redirect(url_for('admin.campaigns'))
+    if action == 'delete':
+        count = delete_campaigns(ids)
+        flash(f'{count} campaign berhasil dihapus!', 'success')
+    else:
+        count = db.session.execute(
+            update(Campaign).where(Campaign.id.in_(ids)).values(is_active=action == 'activate'),
+            execution_options={'synchronize_session': False}).rowcount
+        campaign_cache.changed()
+        flash(f'{count} campaign berhasil {"diaktifkan" if action == "activate" else "dinonaktifkan"}!', 'success')
+    db.session.commit()
+    return redirect(url_for('admin.campaigns'))
+
+
 # ==================== USER CRUD ====================
 
 @admin_bp.route('/users')
@@ -179,6 +225,7 @@ def edit_user(id):
         user.username = form.username.data
         user.email = form.email.data
         user.role = form.role.data
+        identity_cache.invalidate_after_commit(User, user.id)
         db.session.commit()
         flash('User berhasil diperbarui!', 'success')
         return redirect(url_for('admin.users'))
@@ -194,16 +241,249 @@ def delete_user(id):
         flash('Anda tidak bisa menghapus akun sendiri!', 'danger')
         return redirect(url_for('admin.users'))
     
-    db.session.delete(user)
+    delete_users([user.id])
     db.session.commit()
     flash('User berhasil dihapus!', 'success')
     return redirect(url_for('admin.users'))
 
 
+@admin_bp.route('/users/bulk', methods=['POST'])
+@admin_required
+def bulk_users():
+    action = request.form.get('action')
+    if action not in ('activate', 'deactivate', 'delete'):
+        abort(400)
+    # Never lock out or delete the account doing it
+    ids = [id for id in selected_ids() if id != current_user.id]
+    if not ids:
+        flash('Pilih minimal satu user selain akun Anda sendiri.', 'warning')
+        return redirect(url_for('admin.users'))
+    if action == 'delete':
+        count = delete_users(ids)
+        flash(f'{count} user berhasil dihapus!', 'success')
+    else:
+        count = db.session.execute(
+            update(User).where(User.id.in_(ids)).values(is_active=action == 'activate'),
+            execution_options={'synchronize_session': False}).rowcount
+        for id in ids:
+            identity_cache.invalidate_after_commit(User, id)
+        flash(f'{count} user berhasil {"diaktifkan" if action == "activate" else "dinonaktifkan"}!', 'success')
+    db.session.commit()
+    return redirect(url_for('admin.users'))
+
+
 # ==================== DONATIONS READ ====================
 
 @admin_bp.route('/donations')
 @admin_required
 def donations():
-    donations = Donation.query.order_by(Donation.created_at.desc()).all()
-    return render_template('admin/donations.html', title='Semua Donasi', donations=donations)
+    filters = DonationFilters.from_request()
+    page = paginate_donations(filters)
+    campaigns = db.session.query(Campaign.id, Campaign.title).order_by(Campaign.title).all()
+    # Exports take the same filters, but not the page position
+    export_args = {key: value for key, value in request.args.items()
+                   if key not in ('after', 'before', 'per_page')}
+    return render_template('admin/donations.html', title='Semua Donasi',
+                          donations=page, filters=filters, campaigns=campaigns, export_args=export_args)
+
+
+@admin_bp.route('/donations/export')
+@admin_required
+def export_donations():
+    from app import export  # only needed here, keeps csv/zlib out of worker start-up
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        abort(400)
+    gzip = request.args.get('gzip', type=int) == 1
+    filters = DonationFilters.from_request()
+    chunks = export.generate(filters, fmt, gzip, current_app.config['EXPORT_BATCH_SIZE'])
+    headers = {'Content-Disposition': f'attachment; filename={export.filename(fmt, gzip)}'}
+    mimetype = 'application/gzip' if gzip else export.FORMATS[fmt]
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+@admin_bp.route('/donations/export/background', methods=['POST'])
+@admin_required
+def export_donations_background():
+    """Queue a large export instead of streaming it; the file is downloaded from the jobs page"""
+    import uuid
+    from app import export
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        abort(400)
+    gzip = request.args.get('gzip', type=int) == 1
+    filename = f'donations-{uuid.uuid4().hex}.{fmt}' + ('.gz' if gzip else '')
+    job_id = jobs.enqueue('exports.donations', {'filename': filename, 'format': fmt, 'gzip': gzip,
+                                                'filters': DonationFilters.from_request().as_payload()})
+    db.session.commit()
+    flash(f'Export dijadwalkan sebagai job #{job_id}. File dapat diunduh di halaman Job setelah selesai.', 'info')
+    return redirect(url_for('admin.job_queue'))
+
+
+# ==================== BULK IMPORT ====================
+
+@admin_bp.route('/import', methods=['GET', 'POST'])
+@admin_required
+def import_data():
+    from app import importer
+
+    form = ImportForm()
+    report = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = importer.detect_format(upload.filename)
+        if form.kind.data == 'users':
+            report = importer.import_users(upload.stream, fmt, current_app.config['IMPORT_BATCH_SIZE'])
+        else:
+            report = importer.import_donations(upload.stream, fmt, current_app.config['IMPORT_BATCH_SIZE'])
+        flash(f'Impor selesai: {report.inserted} baris ditambahkan, {report.duplicates} duplikat dilewati, '
+              f'{len(report.rejected)} ditolak.', 'success' if not report.rejected else 'warning')
+    return render_template('admin/import.html', title='Impor Data', form=form, report=report)
+
+
+# ==================== SEARCH ====================
+
+@admin_bp.route('/search')
+@admin_required
+def search_records():
+    scope = request.args.get('scope', 'donations')
+    if scope not in search.SCOPES:
+        scope = 'donations'
+    query = request.args.get('q', '').strip()
+    results = search.search(scope, query, get_per_page()) if query else None
+    return render_template('admin/search.html', title='Pencarian', scope=scope, query=query, results=results)
+
+
+# ==================== ANALYTICS ====================
+
+def _parse_moment(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400)
+    # Buckets are naive UTC like created_at
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+@admin_bp.route('/analytics/donations')
+@admin_required
+def donation_analytics():
+    """Donation volume per hour/day/week/month, answered from the rollups"""
+    period = request.args.get('period', 'day')
+    if period not in rollups.PERIODS:
+        return jsonify(error=f'period harus salah satu dari {", ".join(rollups.PERIODS)}'), 400
+    campaign_id = request.args.get('campaign_id', type=int)
+    default_start, default_end = rollups.default_range(period)
+    start, end = _parse_moment('start'), _parse_moment('end')
+    start = rollups.floor(start, period) if start else default_start
+    # The period holding ``end`` is included
+    end = rollups.step(rollups.floor(end, period), period) if end else default_end
+    if start >= end:
+        return jsonify(error='start harus sebelum end'), 400
+    if rollups.count_periods(period, start, end) > current_app.config['ROLLUP_MAX_BUCKETS']:
+        return jsonify(error=f'Rentang terlalu panjang, maksimal {current_app.config["ROLLUP_MAX_BUCKETS"]} '
+                             'periode'), 400
+
+    buckets, totals = rollups.series(period, start, end, campaign_id)
+    for bucket in buckets:
+        bucket['start'] = bucket['start'].isoformat()
+    return jsonify(campaign_id=campaign_id, period=period, start=start.isoformat(), end=end.isoformat(),
+                   buckets=buckets, totals=totals)
+
+
+# ==================== BACKGROUND JOBS ====================
+
+# Maintenance the admin may trigger by hand; the dedupe key collapses repeated clicks into one job
+MANUAL_JOBS = {
+    'stats.rebuild': 'Hitung ulang statistik',
+    'rollups.rebuild': 'Bangun ulang rollup donasi',
+    'images.gc': 'Bersihkan gambar tak terpakai',
+    'donations.archive': 'Arsipkan donasi lama',
+}
+
+
+@admin_bp.route('/jobs')
+@admin_required
+def job_queue():
+    state = request.args.get('state')
+    if state not in jobs.STATES:
+        state = None
+    return render_template('admin/jobs.html', title='Job', queues=jobs.overview(),
+                           recent=jobs.recent(state=state), state=state, manual_jobs=MANUAL_JOBS,
+                           workers=current_app.config['JOBS_QUEUES'])
+
+
+@admin_bp.route('/jobs/enqueue', methods=['POST'])
+@admin_required
+def enqueue_job():
+    name = request.form.get('name')
+    if name not in MANUAL_JOBS:
+        abort(400)
+    job_id = jobs.enqueue(name, dedupe_key=name)
+    db.session.commit()
+    if job_id:
+        flash(f'{MANUAL_JOBS[name]} dijadwalkan sebagai job #{job_id}.', 'success')
+    else:
+        flash(f'{MANUAL_JOBS[name]} sudah menunggu atau sedang berjalan.', 'info')
+    return redirect(url_for('admin.job_queue'))
+
+
+@admin_bp.route('/jobs/<int:id>/retry', methods=['POST'])
+@admin_required
+def retry_job(id):
+    if jobs.retry(id):
+        db.session.commit()
+        flash(f'Job #{id} dijadwalkan ulang.', 'success')
+    else:
+        flash(f'Job #{id} tidak dalam status gagal.', 'warning')
+    return redirect(url_for('admin.job_queue', state=request.args.get('state')))
+
+
+@admin_bp.route('/jobs/<int:id>/download')
+@admin_required
+def download_export(id):
+    import json
+    from flask import send_from_directory
+    from app import export
+
+    job = Job.query.get_or_404(id)
+    if job.name != 'exports.donations' or job.state != 'done' or not job.result:
+        abort(404)
+    result = json.loads(job.result)
+    return send_from_directory(current_app.config['EXPORT_FOLDER'], result['file'], as_attachment=True,
+                               download_name=export.filename(result['format'], result['gzip']))
+
+
+# ==================== METRICS ====================
+
+@admin_bp.route('/metrics')
+@admin_required
+def metrics():
+    return jsonify(campaigns=cache.stats(), identity=identity_cache.stats(), password_hasher=hasher.stats(),
+                   login_throttle=login_throttle.stats(),
+                   images=image_store.stats(), write_queue=write_queue.stats(), progress=broadcaster.stats(),
+                   compression=compressor.stats(), assets=static_assets.stats(), startup=startup_profiler.report(),
+                   jobs=jobs.overview(),
+                   sqlite=dict(db_profile.get_pragmas(db.engine), profile=current_app.config['SQLITE_PROFILE']))
+
+
+@admin_bp.route('/profiler')
+@admin_required
+def profiler_summary():
+    return render_template('admin/profiler.html', title='Profiler', enabled=profiler.enabled,
+                           endpoints=profiler.summary(), threshold=profiler.n_plus_one_threshold)
+
+
+@admin_bp.route('/profiler/reset', methods=['POST'])
+@admin_required
+def reset_profiler():
+    profiler.reset()
+    flash('Statistik profiler direset.', 'success')
+    return redirect(url_for('admin.profiler_summary'))
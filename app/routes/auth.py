@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, Response
 from flask_login import login_user, logout_user, login_required, current_user
-from app import db
+from app import db, login_throttle, stats
+from app.hashing import HasherBusy
 from app.models import User
 from app.forms import LoginForm, RegisterForm
 
@@ -16,11 +17,28 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        # Before the user query and pbkdf2, so a flood of attempts costs almost nothing
+        retry_after = login_throttle.admit(request.remote_addr, form.username.data)
+        if retry_after is not None:
+            # No template and no flash (which would rewrite the session cookie), rejects stay cheap
+            return Response(f'Terlalu banyak percobaan login. Coba lagi dalam {retry_after} detik.\n', 429,
+                            {'Retry-After': str(retry_after)}, mimetype='text/plain')
         user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+            if valid and user.upgrade_password_hash(form.password.data):
+                db.session.commit()
+        except HasherBusy:
+            flash('Server sedang sibuk, silakan coba lagi sebentar.', 'warning')
+            return render_template('auth/login.html', title='Login', form=form), 503
+        if not valid:
             flash('Username atau password salah.', 'danger')
             return redirect(url_for('auth.login'))
+        if not user.is_active:
+            flash('Akun Anda dinonaktifkan. Hubungi admin.', 'danger')
+            return redirect(url_for('auth.login'))
         
+        login_throttle.succeeded(form.username.data)
         login_user(user, remember=form.remember_me.data)
         flash(f'Selamat datang, {user.username}!', 'success')
         
@@ -43,8 +61,13 @@ def register():
     form = RegisterForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data, role='donor')
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HasherBusy:
+            flash('Server sedang sibuk, silakan coba lagi sebentar.', 'warning')
+            return render_template('auth/register.html', title='Daftar', form=form), 503
         db.session.add(user)
+        stats.bump(users=1)
         db.session.commit()
         flash('Registrasi berhasil! Silakan login.', 'success')
         return redirect(url_for('auth.login'))
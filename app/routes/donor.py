@@ -1,8 +1,11 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, redirect, url_for, flash, abort, jsonify, request, Response
 from flask_login import login_required, current_user
-from app import db
-from app.models import Campaign, Donation
+from app import broadcaster, campaign_cache, db, ledger, stats
+from app.progress import progress_payload
+from app.db_profile import WriteQueueBusy
+from app.models import Donation
 from app.forms import DonationForm
+from app.pagination import DonationFilters, find_donations, paginate_donations
 
 donor_bp = Blueprint('donor', __name__)
 
@@ -10,9 +13,9 @@ donor_bp = Blueprint('donor', __name__)
 @donor_bp.route('/')
 @login_required
 def dashboard():
-    active_campaigns = Campaign.query.filter_by(is_active=True).order_by(Campaign.created_at.desc()).all()
-    my_donations = Donation.query.filter_by(user_id=current_user.id).order_by(Donation.created_at.desc()).limit(5).all()
-    total_donated = db.session.query(db.func.sum(Donation.amount)).filter_by(user_id=current_user.id).scalar() or 0
+    active_campaigns = campaign_cache.get_active_campaigns()
+    my_donations = find_donations(DonationFilters(user_id=current_user.id), 5)
+    total_donated = stats.get_user_total(current_user.id)
     
     return render_template('donor/dashboard.html',
                           title='Dashboard Donor',
@@ -21,10 +24,35 @@ def dashboard():
                           total_donated=total_donated)
 
 
+@donor_bp.route('/progress')
+@login_required
+def progress():
+    """Progress of every active campaign; unchanged polls get a 304"""
+    response = jsonify(progress_payload(campaign_cache.get_active_campaigns()))
+    response.add_etag()
+    # Let browsers keep the body but revalidate it on every poll
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@donor_bp.route('/progress/stream')
+@login_required
+def progress_stream():
+    """Server-Sent Events: a snapshot, then changed campaigns as donations commit"""
+    events = broadcaster.subscribe(request.headers.get('Last-Event-ID'))
+    if events is None:
+        return Response('Terlalu banyak koneksi, coba lagi nanti.', status=503, headers={'Retry-After': '30'})
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @donor_bp.route('/donate/<int:campaign_id>', methods=['GET', 'POST'])
 @login_required
 def donate(campaign_id):
-    campaign = Campaign.query.get_or_404(campaign_id)
+    campaign = campaign_cache.get_campaign(campaign_id)
+    if campaign is None:
+        abort(404)
     
     if not campaign.is_active:
         flash('Campaign ini sudah tidak aktif.', 'warning')
@@ -32,15 +60,16 @@ def donate(campaign_id):
     
     form = DonationForm()
     if form.validate_on_submit():
-        donation = Donation(
-            user_id=current_user.id,
-            campaign_id=campaign.id,
-            amount=form.amount.data,
-            message=form.message.data
-        )
-        campaign.collected_amount += form.amount.data
-        db.session.add(donation)
-        db.session.commit()
+        try:
+            ledger.commit_donation(
+                user_id=current_user.id,
+                campaign_id=campaign.id,
+                amount=form.amount.data,
+                message=form.message.data
+            )
+        except WriteQueueBusy:
+            flash('Server sedang sibuk, silakan coba lagi sebentar.', 'warning')
+            return render_template('donor/donate.html', title=f'Donasi - {campaign.title}', form=form, campaign=campaign), 503
         flash(f'Terima kasih! Donasi sebesar Rp {form.amount.data:,.0f} berhasil.', 'success')
         return redirect(url_for('donor.history'))
     
@@ -50,8 +79,12 @@ def donate(campaign_id):
 @donor_bp.route('/history')
 @login_required
 def history():
-    donations = Donation.query.filter_by(user_id=current_user.id).order_by(Donation.created_at.desc()).all()
-    return render_template('donor/history.html', title='Riwayat Donasi', donations=donations)
+    filters = DonationFilters.from_request()
+    # Donors only ever see their own donations, whatever the query string says
+    filters.donor = None
+    filters.user_id = current_user.id
+    page = paginate_donations(filters)
+    return render_template('donor/history.html', title='Riwayat Donasi', donations=page, filters=filters)
 
 
 @donor_bp.route('/donations/<int:id>/edit', methods=['GET', 'POST'])
@@ -64,15 +97,10 @@ def edit_donation(id):
         abort(403)
     
     form = DonationForm(obj=donation)
-    old_amount = donation.amount
     
     if form.validate_on_submit():
-        # Update campaign collected amount
-        donation.campaign.collected_amount -= old_amount
-        donation.campaign.collected_amount += form.amount.data
-        
-        donation.amount = form.amount.data
-        donation.message = form.message.data
+        # Move only the difference onto the campaign total
+        ledger.change_donation(donation, form.amount.data, form.message.data)
         db.session.commit()
         flash('Donasi berhasil diperbarui!', 'success')
         return redirect(url_for('donor.history'))
@@ -89,10 +117,8 @@ def delete_donation(id):
     if donation.user_id != current_user.id:
         abort(403)
     
-    # Update campaign collected amount
-    donation.campaign.collected_amount -= donation.amount
-    
-    db.session.delete(donation)
+    # Debit the campaign and delete the donation in one transaction
+    ledger.remove_donation(donation)
     db.session.commit()
     flash('Donasi berhasil dihapus!', 'success')
     return redirect(url_for('donor.history'))
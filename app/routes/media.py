@@ -0,0 +1,18 @@
+from flask import Blueprint, current_app, send_from_directory
+from app.storage import is_content_addressed
+
+media_bp = Blueprint('media', __name__)
+
+
+@media_bp.route('/<filename>')
+def image(filename):
+    """Serve an uploaded image with conditional and Range request support"""
+    if is_content_addressed(filename):
+        # The name is the content hash, so the file can never change under it
+        response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename,
+                                       conditional=True, etag=filename.split('.', 1)[0],
+                                       max_age=current_app.config['IMAGE_CACHE_MAX_AGE'])
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, conditional=True)
@@ -0,0 +1,232 @@
+"""Schema upgrades and query plan checks for existing databases
+
+Money columns used to be ``FLOAT``, foreign keys used to be declared
+without ``ON DELETE CASCADE`` and donation ids without ``AUTOINCREMENT``.
+``upgrade`` rebuilds every table that still declares any of them (money as
+``INTEGER`` whole rupiah), using SQLite's create-copy-swap procedure, since
+none can be changed in place: rows are copied into ``<table>__migrate`` in
+batches, each its own transaction, and the old table is swapped out in one
+final transaction. An interrupted run leaves the copy behind and the next run
+carries on from the last copied row. Run it with the app stopped, writes made
+during the copy would be missed. The rollup tables only hold figures derived
+from donations, so they are dropped and recomputed instead of copied. Columns
+added to the models since are added with ``ALTER TABLE``.
+
+``check_query_plans`` runs ``EXPLAIN QUERY PLAN`` over the statements the
+routes issue and reports any that scan a table without an index or sort in a
+temporary b-tree.
+"""
+from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateTable
+from app import archive, db, export, ledger, rollups, search, stats
+from app.models import User, Campaign, Donation, DonationArchive, DonationRollup, DonationRollupDonor, \
+    StatCounter, UserDonationTotal
+from app.pagination import DonationFilters, page_query
+
+MONEY_COLUMNS = {
+    Campaign.__table__: ('target_amount', 'collected_amount'),
+    Donation.__table__: ('amount',),
+    StatCounter.__table__: ('value',),
+    UserDonationTotal.__table__: ('total_amount',),
+}
+
+# Recomputed by rollups.rebuild, so recreated empty rather than copied when their schema is outdated
+DERIVED_TABLES = (DonationRollup.__table__, DonationRollupDonor.__table__)
+
+# Single-column indexes from schema.sql, superseded by the composite ones
+LEGACY_INDEXES = ('idx_donation_user', 'idx_donation_campaign', 'idx_campaign_active')
+
+
+def _staging_name(table):
+    return f'{table.name}__migrate'
+
+
+def _table_names(connection):
+    return set(inspect(connection).get_table_names())
+
+
+def _declared_types(connection, table):
+    rows = connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")').all()
+    return {row[1]: (row[2] or '').upper() for row in rows}
+
+
+def needs_cascade(connection, table):
+    """True if a foreign key the model declares with an ON DELETE action lacks it in the database"""
+    rows = connection.exec_driver_sql(f'PRAGMA foreign_key_list("{table.name}")').all()
+    actions = {(row[3], row[2]): row[6].upper() for row in rows}  # (column, parent table) -> on_delete
+    return any(actions.get((key.parent.name, key.column.table.name)) != key.ondelete.upper()
+               for key in table.foreign_keys if key.ondelete)
+
+
+def needs_autoincrement(connection, table):
+    """True if the model declares AUTOINCREMENT ids but the table was created without"""
+    if not table.dialect_options['sqlite']['autoincrement']:
+        return False
+    sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (table.name,)).scalar()
+    return sql is not None and 'AUTOINCREMENT' not in sql.upper()
+
+
+def needs_rebuild(connection, table):
+    """True if ``table`` has outdated money types, foreign keys or ids, or a rebuild was interrupted"""
+    if _staging_name(table) in _table_names(connection):
+        return True
+    declared = _declared_types(connection, table)
+    return (any(declared.get(column, 'INTEGER') != 'INTEGER' for column in MONEY_COLUMNS[table])
+            or needs_cascade(connection, table) or needs_autoincrement(connection, table))
+
+
+def add_missing_columns(connection, echo=print):
+    """Add model columns an existing table lacks; they need a server default or must be nullable"""
+    preparer = connection.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        existing = _declared_types(connection, table)
+        for column in table.columns:
+            if existing and column.name not in existing:
+                ddl = CreateColumn(column).compile(connection)
+                connection.exec_driver_sql(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}')
+                echo(f'{table.name}: added column {column.name}')
+
+
+def _copy_key(table):
+    """Column the copy resumes on: the integer primary key, else the rowid"""
+    primary_key = list(table.primary_key.columns)
+    if len(primary_key) == 1 and primary_key[0].type._type_affinity is db.Integer:
+        return primary_key[0].name
+    return 'rowid'
+
+
+def rebuild_table(connection, table, batch_size=5000, echo=print):
+    """Copy ``table`` into its model definition batch by batch, then swap it in"""
+    staging = _staging_name(table)
+    preparer = connection.dialect.identifier_preparer
+    if staging not in _table_names(connection):
+        ddl = str(CreateTable(table).compile(connection))
+        ddl = ddl.replace(f'CREATE TABLE {preparer.format_table(table)} ', f'CREATE TABLE "{staging}" ', 1)
+        connection.exec_driver_sql(ddl)
+        connection.commit()
+
+    # Only copy columns both sides have, older databases may lack newer ones
+    existing = _declared_types(connection, table)
+    columns = [column.name for column in table.columns if column.name in existing]
+    key = _copy_key(table)
+    if key == 'rowid':
+        columns.insert(0, 'rowid')
+    targets = ', '.join(preparer.quote(name) for name in columns)
+    sources = ', '.join(
+        f'CAST(ROUND({preparer.quote(name)}) AS INTEGER)' if name in MONEY_COLUMNS[table]
+        else preparer.quote(name) for name in columns)
+    copy = (f'INSERT INTO "{staging}" ({targets}) SELECT {sources} FROM {preparer.format_table(table)} '
+            f'WHERE {key} > (SELECT COALESCE(MAX({key}), 0) FROM "{staging}") ORDER BY {key} LIMIT ?')
+
+    copied = 0
+    while True:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        count = connection.exec_driver_sql(copy, (batch_size,)).rowcount
+        connection.commit()
+        if count <= 0:
+            break
+        copied += count
+        echo(f'{table.name}: copied {copied:,} row(s)')
+
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+    connection.exec_driver_sql(f'DROP TABLE {preparer.format_table(table)}')
+    connection.exec_driver_sql(f'ALTER TABLE "{staging}" RENAME TO {preparer.format_table(table)}')
+    for index in table.indexes:
+        index.create(connection)
+    connection.commit()
+    echo(f'{table.name}: rebuilt to match its model')
+
+
+def upgrade(batch_size=5000, echo=print):
+    """Bring an existing database up to the current models; safe to re-run"""
+    db.create_all()
+    with db.engine.connect() as connection:
+        # Dropping the old table must not cascade into the tables referencing it
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        add_missing_columns(connection, echo)
+        for table in DERIVED_TABLES:
+            if needs_cascade(connection, table):
+                table.drop(connection)
+                table.create(connection)
+                echo(f'{table.name}: recreated with cascading foreign keys, refilled below')
+        connection.commit()
+        for table in MONEY_COLUMNS:
+            if needs_rebuild(connection, table):
+                rebuild_table(connection, table, batch_size, echo)
+
+        names = _table_names(connection)
+        had_search = all(f'{name}_fts' in names for name in search.INDEXES)
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        for name in LEGACY_INDEXES:
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        # Rebuilt tables lost their sync triggers; the index contents are still valid
+        if had_search:
+            search.install(connection)
+        else:
+            search.rebuild(connection)
+        connection.commit()
+
+        problems = connection.exec_driver_sql('PRAGMA foreign_key_check').all()
+        connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+
+    # Rounding each row separately can leave stored totals off by a rupiah
+    ledger.reconcile(fix=True)
+    stats.rebuild()
+    if rollups.is_empty():
+        rollups.rebuild(echo=echo)
+    return problems
+
+
+def route_queries():
+    """Yield ``(label, statement)`` for every listing and lookup the routes run"""
+    cursor = (datetime(2024, 1, 1), 1)
+    last_hot = (datetime(2023, 12, 1), 1)
+
+    def pages(label, filters, limit=21, position=cursor):
+        # The hot table, then the archive bounded by the last hot row as find_donations does
+        yield label, page_query(filters, Donation, limit, position)
+        yield f'{label} (archive)', page_query(filters, DonationArchive, limit, position, bound=last_hot)
+
+    yield 'login', User.query.filter_by(username='admin')
+    yield from pages('admin dashboard: recent donations', DonationFilters(), 5, None)
+    yield 'admin dashboard: active campaigns', Campaign.query.filter_by(is_active=True).limit(5)
+    yield 'admin campaigns', Campaign.query.order_by(Campaign.created_at.desc())
+    yield 'admin users', User.query.order_by(User.created_at.desc())
+    yield from pages('admin donations', DonationFilters())
+    yield from pages('admin donations by campaign', DonationFilters(campaign_id=1))
+    yield from pages('admin donations by donor', DonationFilters(donor='admin'))
+    yield from pages('admin donations by date', DonationFilters(date_from=cursor[0], date_to=cursor[0]))
+    yield 'admin donations campaign list', db.session.query(Campaign.id, Campaign.title).order_by(Campaign.title)
+    yield 'admin export', export.export_statement(DonationFilters(campaign_id=1), 1000)
+    yield 'donor dashboard: campaigns', \
+        Campaign.query.filter_by(is_active=True).order_by(Campaign.created_at.desc())
+    yield from pages('donor dashboard: my donations', DonationFilters(user_id=1), 5, None)
+    yield from pages('donor history', DonationFilters(user_id=1))
+    yield from pages('donor history by campaign', DonationFilters(user_id=1, campaign_id=1))
+    for label, where in (('archive: old donations', Donation.created_at < cursor[0]),
+                         ('archive: closed campaign', Donation.campaign_id == 1)):
+        yield label, archive.next_batch([where], 5000)
+
+
+def _is_problem(detail):
+    if detail.startswith('SCAN ') and 'USING' not in detail:
+        return True
+    return 'USE TEMP B-TREE' in detail
+
+
+def check_query_plans():
+    """Return ``(label, plan, problems)`` for each route query"""
+    results = []
+    with db.engine.connect() as connection:
+        for label, query in route_queries():
+            statement = getattr(query, 'statement', query)
+            sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+            plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+            results.append((label, plan, [detail for detail in plan if _is_problem(detail)]))
+    return results
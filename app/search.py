@@ -0,0 +1,213 @@
+"""Full-text search over campaigns, donation messages and users
+
+Each searchable table has an FTS5 external-content index (``<table>_fts``)
+that stores only the tokens and points back at the row by rowid. Triggers on
+the source table keep it in sync, so ORM writes, Core bulk inserts and the
+write queue are all covered without the application having to remember.
+Users are indexed with the trigram tokenizer so any three or more
+consecutive characters of a username or email match.
+
+Archived donations get their own index on ``donation_archive`` rather than
+staying in ``donation_fts``: an external-content index can only point at one
+table, and the archive's rows keep their ids, so moving a row deletes it from
+one index and inserts it into the other. Donation searches rank both indexes
+and merge the two runs by score.
+
+The indexes are created together with their tables by ``db.create_all``;
+``flask rebuild-search`` installs them on an existing database and
+repopulates them from the source tables.
+"""
+import heapq
+import re
+from flask import current_app, request
+from sqlalchemy import DDL, column, event, select, table, text
+from app.archive import PARTITIONS
+from app.models import User, Campaign, Donation, DonationArchive
+from app.pagination import KeysetPage, donation_query
+
+# table -> (indexed columns, tokenizer, bm25 weight per column)
+INDEXES = {
+    'campaign': (('title', 'description'), 'unicode61 remove_diacritics 2', (10.0, 1.0)),
+    'donation': (('message',), 'unicode61 remove_diacritics 2', (1.0,)),
+    'donation_archive': (('message',), 'unicode61 remove_diacritics 2', (1.0,)),
+    'user': (('username', 'email'), 'trigram', (5.0, 1.0)),
+}
+SCOPES = ('donations', 'campaigns', 'users')
+MIN_TRIGRAM_LENGTH = 3
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _ddl(name):
+    columns, tokenizer, _ = INDEXES[name]
+    fts = f'{name}_fts'
+    quoted = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({quoted}, content='{name}', "
+        f"content_rowid='id', tokenize='{tokenizer}')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{name}" BEGIN '
+        f'INSERT INTO {fts}(rowid, {quoted}) VALUES (new.id, {new}); END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{name}" BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {quoted}) VALUES ('delete', old.id, {old}); END",
+        # Only reindex when an indexed column changed, not on every amount or total update
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON "{name}" WHEN {changed} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {quoted}) VALUES ('delete', old.id, {old}); "
+        f'INSERT INTO {fts}(rowid, {quoted}) VALUES (new.id, {new}); END',
+    ]
+
+
+def _trigger_names(name):
+    return [f'{name}_fts_ai', f'{name}_fts_ad', f'{name}_fts_au']
+
+
+for _model in (Campaign, Donation, DonationArchive, User):
+    for _statement in _ddl(_model.__tablename__):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+def install(connection):
+    """Create any missing FTS tables and triggers"""
+    for name in INDEXES:
+        for statement in _ddl(name):
+            connection.exec_driver_sql(statement)
+
+
+def drop_triggers(connection):
+    """Stop syncing, for bulk loads that call ``rebuild`` afterwards"""
+    for name in INDEXES:
+        for trigger in _trigger_names(name):
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+
+
+def rebuild(connection):
+    """Recreate every index from its source table"""
+    install(connection)
+    counts = {}
+    for name in INDEXES:
+        connection.exec_driver_sql(f"INSERT INTO {name}_fts({name}_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql(f"INSERT INTO {name}_fts({name}_fts) VALUES ('optimize')")
+        counts[name] = connection.exec_driver_sql(f'SELECT COUNT(*) FROM "{name}"').scalar()
+    return counts
+
+
+def match_expression(query, prefix=True):
+    """Turn free text into a safe FTS5 query: every word must occur, the last as a prefix
+
+    Words are quoted so FTS5 operators and punctuation typed by the user are
+    never interpreted. Returns None if nothing searchable is left.
+    """
+    words = _TOKEN.findall(query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def substring_expression(query):
+    """FTS5 query for the trigram index: the whole input as one substring"""
+    query = (query or '').strip()
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        return None
+    return '"' + query.replace('"', '""') + '"'
+
+
+class SearchPage(KeysetPage):
+    """Numbered page of ranked results, same interface as a keyset page"""
+
+    def __init__(self, items, per_page, number, has_more):
+        super().__init__(items, per_page,
+                         next_cursor=number + 1 if has_more else None,
+                         prev_cursor=number - 1 if number > 1 else None)
+        self.number = number
+
+    @property
+    def next_url(self):
+        return self._url(page=self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(page=self.prev_cursor) if self.has_prev else None
+
+
+def _paginate(query, per_page, number):
+    rows = query.limit(per_page + 1).offset((number - 1) * per_page).all()
+    return SearchPage(rows[:per_page], per_page, number, len(rows) > per_page)
+
+
+def _hits(model, expression):
+    """Rowid and bm25 score of the index hits for ``expression``
+
+    A common word can match a large share of all donations and scoring every
+    match would take seconds, so only the newest ``SEARCH_CANDIDATE_LIMIT``
+    matches are scored. FTS5 walks its index by rowid, which is why that
+    limit stays cheap however many rows match.
+    """
+    name = model.__tablename__
+    fts = table(f'{name}_fts', column('rowid'), column('rank'))
+    weights = ', '.join(str(weight) for weight in INDEXES[name][2])
+    return (select(fts.c.rowid, fts.c.rank)
+            .where(text(f'{name}_fts MATCH :expression').bindparams(expression=expression))
+            .where(text(f"{name}_fts.rank MATCH 'bm25({weights})'"))
+            .order_by(fts.c.rowid.desc())
+            .limit(current_app.config['SEARCH_CANDIDATE_LIMIT'])
+            .subquery('hits'))
+
+
+def _ranked(query, model, expression):
+    """Join ``query`` to its index hits, best bm25 score first"""
+    hits = _hits(model, expression)
+    return query.join(hits, hits.c.rowid == model.id).order_by(hits.c.rank, model.id.desc())
+
+
+def search_donations(query, per_page, number=1):
+    """Hot and archived donations in one ranking
+
+    The page can only hold rows from the first ``number`` pages of either
+    index, so each is asked for that many and the two runs are merged.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    start = (number - 1) * per_page
+    runs = []
+    for model in PARTITIONS:
+        hits = _hits(model, expression)
+        runs.append(donation_query(model)
+                    .join(hits, hits.c.rowid == model.id)
+                    .add_columns(hits.c.rank)
+                    .order_by(hits.c.rank, model.id.desc())
+                    .limit(start + per_page + 1)
+                    .all())
+    rows = [donation for donation, _ in heapq.merge(*runs, key=lambda row: (row[1], -row[0].id))]
+    return SearchPage(rows[start:start + per_page], per_page, number, len(rows) > start + per_page)
+
+
+def search_campaigns(query, per_page, number=1):
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    return _paginate(_ranked(Campaign.query, Campaign, expression), per_page, number)
+
+
+def search_users(query, per_page, number=1):
+    expression = substring_expression(query)
+    if expression is None:
+        return None
+    return _paginate(_ranked(User.query, User, expression), per_page, number)
+
+
+SEARCHES = {
+    'donations': search_donations,
+    'campaigns': search_campaigns,
+    'users': search_users,
+}
+
+
+def search(scope, query, per_page):
+    """Run one scope's search for the current request's ``page`` argument"""
+    number = max(1, request.args.get('page', 1, type=int))
+    return SEARCHES[scope](query, per_page, number)
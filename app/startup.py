@@ -0,0 +1,143 @@
+"""Startup profiling: import, ``create_app`` and first-request timings
+
+Cold starts matter whenever a worker is (re)started: after a deploy, a crash
+or an autoscaling event the first requests pay for imports, URL map
+compilation, the first database connection and template compilation. With
+``STARTUP_PROFILE`` enabled the process logs how long importing the ``app``
+package and ``create_app`` took, and the first and second request to every
+endpoint, so the gap between them shows the one-off cost. The numbers are
+also in ``/admin/metrics``. When disabled nothing is hooked in.
+
+``flask profile-startup`` runs a fresh interpreter with ``-X importtime`` and
+this mode switched on and prints the slowest imports next to the timings.
+"""
+import logging
+import threading
+import time
+
+IMPORT_STARTED = time.perf_counter()  # app/__init__ imports this module first
+
+# Run in a fresh interpreter by ``profile`` so nothing is imported yet
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app, startup_profiler
+app = create_app()
+app.config['WTF_CSRF_ENABLED'] = False
+paths, credentials = json.loads(sys.argv[1])
+client = app.test_client()
+if credentials:
+    client.post('/login', data=credentials)
+for path in paths:
+    for _ in range(2):
+        client.get(path)
+print(json.dumps({'total_ms': (time.perf_counter() - started) * 1000, **startup_profiler.report()}))
+'''
+
+
+class StartupProfiler:
+    """Flask extension recording how long the process took to serve each endpoint the first time"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.import_ms = None
+        self.create_app_ms = None
+        self._first = {}  # 'METHOD endpoint' -> [first ms, second ms]
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, started=None):
+        """Call last in ``create_app``; ``started`` is when ``create_app`` began"""
+        self.app = app
+        self.enabled = app.config.get('STARTUP_PROFILE', False)
+        self._first = {}
+        app.extensions['startup_profiler'] = self
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if app.logger.level == logging.NOTSET:
+            app.logger.setLevel(logging.INFO)
+        if started is not None:
+            if self.import_ms is None:
+                # Only the first app of the process paid for the imports
+                self.import_ms = (started - IMPORT_STARTED) * 1000
+            self.create_app_ms = (now - started) * 1000
+        app.logger.info('import %.0f ms, create_app %.0f ms', self.import_ms or 0, self.create_app_ms or 0)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        from flask import g
+
+        g.startup_started = time.perf_counter()
+
+    def _after_request(self, response):
+        from flask import g, request
+
+        started = g.pop('startup_started', None)
+        if started is None or request.endpoint is None:
+            return response
+        elapsed = (time.perf_counter() - started) * 1000
+        endpoint = f'{request.method} {request.endpoint}'
+        with self._lock:
+            timings = self._first.setdefault(endpoint, [])
+            if len(timings) >= 2:
+                return response
+            timings.append(elapsed)
+        if len(timings) == 1:
+            self.app.logger.info('first request to %s took %.1f ms', endpoint, elapsed)
+        return response
+
+    def report(self):
+        from app import templating
+
+        with self._lock:
+            endpoints = {endpoint: {'first_ms': round(timings[0], 1),
+                                    'second_ms': round(timings[1], 1) if len(timings) > 1 else None}
+                         for endpoint, timings in self._first.items()}
+        return {'enabled': self.enabled,
+                'import_ms': round(self.import_ms, 1) if self.import_ms is not None else None,
+                'create_app_ms': round(self.create_app_ms, 1) if self.create_app_ms is not None else None,
+                'endpoints': endpoints,
+                'templates': templating.stats(self.app) if self.app else None}
+
+
+def _parse_importtime(lines):
+    """``-X importtime`` output as ``[(module, self us, cumulative us)]``"""
+    modules = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def profile(paths, credentials=None):
+    """Profile a fresh interpreter requesting ``paths`` twice each
+
+    Returns its ``report()`` plus ``total_ms`` and the self import time in ms per
+    ``packages`` and ``modules``, slowest first.
+    """
+    import json
+    import os
+    import subprocess
+    import sys
+    from collections import Counter
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'STARTUP_PROFILE': '1'}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD, json.dumps([paths, credentials])],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'child failed')
+    modules = _parse_importtime(result.stderr.splitlines())
+    packages = Counter()
+    for name, own, _ in modules:
+        packages[name.split('.')[0]] += own
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['packages'] = [(name, own / 1000) for name, own in packages.most_common()]
+    report['modules'] = sorted(((name, own / 1000) for name, own, _ in modules), key=lambda item: -item[1])
+    return report
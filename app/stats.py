@@ -0,0 +1,136 @@
+"""Materialized dashboard statistics
+
+Global counters live in ``stat_counter`` and per-donor totals in
+``user_donation_total``. Both are adjusted with SQL-side deltas in the same
+transaction as the write that changes them, so the dashboards read a handful
+of rows instead of counting and summing whole tables.
+"""
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from app import db
+from app.archive import PARTITIONS, all_donations
+from app.models import User, Campaign, StatCounter, UserDonationTotal
+
+COUNTERS = ('users', 'campaigns', 'donations', 'collected')
+
+
+def _execute(statement, connection=None):
+    """Run a write on ``connection`` if given, otherwise in the current session"""
+    return (connection or db.session).execute(statement, execution_options={'synchronize_session': False})
+
+
+def bump(connection=None, **deltas):
+    """Add deltas to global counters, e.g. ``bump(donations=1, collected=5000)``"""
+    rows = [{'name': name, 'value': delta} for name, delta in deltas.items()]
+    if not rows:
+        return
+    statement = insert(StatCounter).values(rows)
+    _execute(statement.on_conflict_do_update(
+        index_elements=[StatCounter.name],
+        set_={'value': StatCounter.value + statement.excluded.value}), connection)
+
+
+def bump_user(user_id, amount, count=0, connection=None):
+    """Add to one donor's running total and donation count"""
+    statement = insert(UserDonationTotal).values(user_id=user_id, total_amount=amount, donation_count=count)
+    _execute(statement.on_conflict_do_update(
+        index_elements=[UserDonationTotal.user_id],
+        set_={'total_amount': UserDonationTotal.total_amount + statement.excluded.total_amount,
+              'donation_count': UserDonationTotal.donation_count + statement.excluded.donation_count}),
+        connection)
+
+
+def bump_users(totals):
+    """Apply ``{user_id: (amount, count)}`` to many donors in one executemany"""
+    if not totals:
+        return
+    table = UserDonationTotal.__table__
+    statement = insert(table)
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={'total_amount': table.c.total_amount + statement.excluded.total_amount,
+                  'donation_count': table.c.donation_count + statement.excluded.donation_count}),
+        [{'user_id': user_id, 'total_amount': amount, 'donation_count': count}
+         for user_id, (amount, count) in totals.items()])
+
+
+def donation_added(user_id, amount, connection=None):
+    bump(connection, donations=1, collected=amount)
+    bump_user(user_id, amount, 1, connection)
+
+
+def donation_changed(user_id, delta):
+    """Apply an amount change; ``delta`` may be a SQL expression"""
+    bump(collected=delta)
+    bump_user(user_id, delta)
+
+
+def donation_removed(user_id, amount):
+    bump(donations=-1, collected=-amount)
+    bump_user(user_id, -amount, -1)
+
+
+def users_deleted(user_ids):
+    """Remove donors and everything they donated from the counters, before they are deleted
+
+    Their per-donor totals go with the user rows through ON DELETE CASCADE.
+    """
+    totals = select(UserDonationTotal).where(UserDonationTotal.user_id.in_(user_ids)).subquery()
+    count = select(func.coalesce(func.sum(totals.c.donation_count), 0)).scalar_subquery()
+    amount = select(func.coalesce(func.sum(totals.c.total_amount), 0)).scalar_subquery()
+    users = select(func.count(User.id)).where(User.id.in_(user_ids)).scalar_subquery()
+    bump(users=-users, donations=-count, collected=-amount)
+
+
+def campaigns_deleted(campaign_ids):
+    """Remove campaigns and their donations from the global and per-donor counters, before they are deleted"""
+    campaigns = select(func.count(Campaign.id)).where(Campaign.id.in_(campaign_ids)).scalar_subquery()
+    bump(campaigns=-campaigns)
+    # Hot and archived donations one table at a time, so each statement keeps to its indexes
+    for model in PARTITIONS:
+        in_campaigns = model.campaign_id.in_(campaign_ids)
+        count = select(func.count(model.id)).where(in_campaigns).scalar_subquery()
+        amount = select(func.coalesce(func.sum(model.amount), 0)).where(in_campaigns).scalar_subquery()
+        bump(donations=-count, collected=-amount)
+
+        per_donor = (model.user_id == UserDonationTotal.user_id) & in_campaigns
+        _execute(update(UserDonationTotal)
+                 .where(UserDonationTotal.user_id.in_(select(model.user_id).where(in_campaigns)))
+                 .values(total_amount=UserDonationTotal.total_amount
+                         - select(func.coalesce(func.sum(model.amount), 0)).where(per_donor).scalar_subquery(),
+                         donation_count=UserDonationTotal.donation_count
+                         - select(func.count(model.id)).where(per_donor).scalar_subquery()))
+
+
+def get_counters():
+    """Return every global counter in one query"""
+    values = dict(db.session.execute(select(StatCounter.name, StatCounter.value)).all())
+    return {name: values.get(name, 0) for name in COUNTERS}
+
+
+def get_user_total(user_id):
+    return db.session.execute(
+        select(UserDonationTotal.total_amount).where(UserDonationTotal.user_id == user_id)
+    ).scalar() or 0
+
+
+def is_initialized():
+    return db.session.get(StatCounter, 'users') is not None
+
+
+def rebuild():
+    """Recompute every counter from the source tables, archive included, in one transaction"""
+    donations = all_donations()
+    _execute(delete(StatCounter))
+    _execute(delete(UserDonationTotal))
+    bump(users=db.session.scalar(select(func.count(User.id))),
+         campaigns=db.session.scalar(select(func.count(Campaign.id))),
+         donations=db.session.scalar(select(func.count()).select_from(donations)),
+         collected=db.session.scalar(select(func.coalesce(func.sum(donations.c.amount), 0))))
+    _execute(insert(UserDonationTotal).from_select(
+        ['user_id', 'total_amount', 'donation_count'],
+        select(donations.c.user_id, func.sum(donations.c.amount), func.count())
+        .group_by(donations.c.user_id)))
+    db.session.commit()
+    return get_counters()
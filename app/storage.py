@@ -0,0 +1,173 @@
+"""Content-addressed storage for campaign images
+
+Uploads are hashed while they are streamed to disk and stored as
+``<sha256>.<ext>``, so identical files are kept once and shared through a
+reference count in ``image_blob``. Requests only ever add or drop
+references; files whose count reached zero are unlinked later by
+``collect_garbage``, run as the ``images.gc`` job (queued when a reference
+is dropped and scheduled every ``IMAGE_GC_INTERVAL`` by ``flask run-jobs``)
+or by ``flask gc-images``, so no request waits for the filesystem.
+
+Ordering matters for safety on SQLite: ``store`` takes the database write
+lock (by upserting the reference) before moving the file into place, and
+``collect_garbage`` deletes the row before unlinking the file while holding
+the same lock, so a file can never be removed under a live reference.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+CHUNK_SIZE = 64 * 1024
+INCOMING_DIR = '.incoming'
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+def is_content_addressed(filename):
+    return bool(filename and HASHED_NAME.match(filename))
+
+
+class ImageStore:
+    """Flask extension managing uploads in ``UPLOAD_FOLDER``"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self.collected = self.sweeps = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['image_store'] = self
+
+    @property
+    def folder(self):
+        return self.app.config['UPLOAD_FOLDER']
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    # ==================== REFERENCES ====================
+
+    def store(self, file, ext):
+        """Save an upload and add a reference to it, returning its filename"""
+        from app import db
+        from app.models import ImageBlob
+
+        incoming = os.path.join(self.folder, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            filename = f'{digest.hexdigest()}.{ext}'
+
+            statement = insert(ImageBlob).values(filename=filename, size=size, ref_count=1,
+                                                 created_at=datetime.utcnow())
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[ImageBlob.filename],
+                set_={'ref_count': ImageBlob.ref_count + 1, 'released_at': None}))
+
+            final_path = self.path(filename)
+            if os.path.exists(final_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, final_path)
+            return filename
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def release(self, filename):
+        """Drop one reference; the file itself is removed by a later ``images.gc`` job"""
+        self.release_many([filename])
+
+    def release_many(self, filenames):
+        """Drop one reference per occurrence in ``filenames``, for campaigns deleted in bulk"""
+        from app import db, jobs
+        from app.models import ImageBlob
+
+        counts = Counter(filename for filename in filenames if filename)
+        if not counts:
+            return
+        rows = [{'name': filename, 'count': count} for filename, count in counts.items()
+                if is_content_addressed(filename)]
+        if rows:
+            table = ImageBlob.__table__
+            db.session.execute(
+                update(table)
+                .where(table.c.filename == bindparam('name'))
+                .values(ref_count=table.c.ref_count - bindparam('count'), released_at=datetime.utcnow()),
+                rows)
+        # Legacy uploads have no row and are removed by the same sweep once unreferenced
+        grace = self.app.config.get('IMAGE_GC_GRACE', 3600)
+        jobs.enqueue('images.gc', dedupe_key='images.gc', delay=grace + 60)
+
+    # ==================== GARBAGE COLLECTION ====================
+
+    def collect_garbage(self, grace=None):
+        """Remove unreferenced files older than ``grace`` seconds, returning how many"""
+        from app import db
+        from app.models import Campaign, ImageBlob
+
+        grace = self.app.config.get('IMAGE_GC_GRACE', 3600) if grace is None else grace
+        cutoff = datetime.utcnow() - timedelta(seconds=grace)
+        removed = 0
+
+        candidates = db.session.scalars(
+            select(ImageBlob.filename)
+            .where(ImageBlob.ref_count <= 0, ImageBlob.released_at < cutoff)).all()
+        for filename in candidates:
+            deleted = db.session.execute(
+                delete(ImageBlob)
+                .where(ImageBlob.filename == filename, ImageBlob.ref_count <= 0)
+                .where(~select(Campaign.id).where(Campaign.image == filename).exists()),
+                execution_options={'synchronize_session': False})
+            if deleted.rowcount and self._unlink(filename):
+                removed += 1
+
+        # Files on disk nobody knows about: legacy uploads and abandoned temp files
+        known = set(db.session.scalars(select(ImageBlob.filename)))
+        referenced = set(db.session.scalars(select(Campaign.image).where(Campaign.image.isnot(None))))
+        oldest = time.time() - grace
+        for directory in (self.folder, os.path.join(self.folder, INCOMING_DIR)):
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if not entry.is_file() or entry.name in known or entry.name in referenced:
+                    continue
+                if entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+                    removed += 1
+        db.session.commit()
+
+        with self._lock:
+            self.collected += removed
+            self.sweeps += 1
+        return removed
+
+    def _unlink(self, filename):
+        try:
+            os.remove(self.path(filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stats(self):
+        return {'sweeps': self.sweeps, 'collected': self.collected}
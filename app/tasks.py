@@ -0,0 +1,64 @@
+"""Tasks run by ``flask run-jobs``, registered by name for ``jobs.enqueue``
+
+Jobs may run more than once (a worker can die after finishing the work but
+before recording it), so every task is safe to repeat.
+"""
+import os
+from flask import current_app
+from app import archive, db, image_store, jobs, rollups, stats
+
+
+@jobs.task('images.gc', queue='maintenance', max_attempts=3)
+def collect_images(grace=None):
+    """Unlink uploads no campaign references any more"""
+    return {'removed': image_store.collect_garbage(grace)}
+
+
+@jobs.task('stats.rebuild', queue='maintenance', max_attempts=3)
+def rebuild_stats():
+    return stats.rebuild()
+
+
+@jobs.task('rollups.rebuild', queue='maintenance', max_attempts=3)
+def rebuild_rollups(campaign_ids=None):
+    return {'buckets': rollups.rebuild(campaign_ids)}
+
+
+@jobs.task('donations.archive', queue='maintenance', max_attempts=3)
+def archive_donations():
+    """Move donations past ``ARCHIVE_AFTER_DAYS`` and those of closed campaigns into the archive"""
+    return archive.archive()
+
+
+@jobs.task('exports.donations', queue='exports', max_attempts=2)
+def export_donations(filename, format='csv', gzip=False, filters=None):
+    """Write a donation export into ``EXPORT_FOLDER`` for download from the jobs page"""
+    from app import export
+    from app.pagination import DonationFilters
+
+    folder = current_app.config['EXPORT_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, filename)
+    chunks = export.generate(DonationFilters.from_payload(filters or {}), format, gzip,
+                             current_app.config['EXPORT_BATCH_SIZE'])
+    # A retry starts over, the file only appears under its name once complete
+    with open(path + '.part', 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    os.replace(path + '.part', path)
+    return {'file': filename, 'format': format, 'gzip': gzip, 'bytes': os.path.getsize(path)}
+
+
+@jobs.task('jobs.prune', queue='maintenance', max_attempts=3)
+def prune_jobs():
+    """Forget finished jobs past ``JOBS_RETENTION`` together with their export files"""
+    import json
+
+    pruned = jobs.prune(current_app.config['JOBS_RETENTION'])
+    db.session.commit()
+    for id, name, result in pruned:
+        if name == 'exports.donations' and result:
+            path = os.path.join(current_app.config['EXPORT_FOLDER'], json.loads(result)['file'])
+            if os.path.exists(path):
+                os.remove(path)
+    return {'pruned': len(pruned)}
@@ -0,0 +1,61 @@
+"""Persistent Jinja bytecode cache
+
+Compiling a template to Python code is most of the cost of its first render,
+and every worker used to pay it again for every template after each start.
+With ``JINJA_BYTECODE_CACHE`` set, compiled templates are marshalled into that
+directory, keyed by template path and checked against a hash of the source,
+so other workers and later starts load them instead of compiling. A changed
+template simply misses and is compiled and stored again.
+``flask precompile-templates`` fills the cache ahead of time, e.g. during a
+deploy, so not even the first request compiles.
+"""
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """``FileSystemBytecodeCache`` counting whether loads found compiled code"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.directory = directory
+        self.hits = self.misses = 0
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def stats(self):
+        return {'directory': self.directory, 'hits': self.hits, 'misses': self.misses}
+
+
+def configure(app):
+    """Hand the bytecode cache to the Jinja environment; must run before it is first used"""
+    directory = app.config.get('JINJA_BYTECODE_CACHE')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': BytecodeCache(directory)}
+
+
+def stats(app):
+    cache = app.jinja_env.bytecode_cache
+    return cache.stats() if isinstance(cache, BytecodeCache) else None
+
+
+def precompile(app):
+    """Compile every template, storing the bytecode; returns ``(compiled names, [(name, error)])``"""
+    from jinja2 import TemplateSyntaxError
+
+    compiled, failed = [], []
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        try:
+            app.jinja_env.get_template(name)
+        except TemplateSyntaxError as error:
+            failed.append((name, f'line {error.lineno}: {error.message}'))
+        else:
+            compiled.append(name)
+    return compiled, failed
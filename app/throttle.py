@@ -0,0 +1,218 @@
+"""Login admission control with sliding-window counters
+
+Every login POST is counted per client IP and per username before the user
+is looked up or a password is hashed. Once either counter is over its limit
+the attempt is answered with a 429 and ``Retry-After`` straight away, so a
+credential-stuffing burst costs a dictionary lookup per request instead of a
+query and a pbkdf2 run.
+
+The window slides by weighting the previous fixed window by how much of it
+still overlaps: ``previous * (1 - elapsed / window) + current``. That keeps
+two integers per key instead of a timestamp per attempt and never lets a
+burst through at a window boundary. A successful login clears the
+username's counter, so a few typos do not lock out the owner.
+
+The ``memory`` backend keeps at most ``LOGIN_THROTTLE_MAX_KEYS`` keys per
+process in an LRU; each worker counts on its own, so the effective limit is
+multiplied by the number of worker processes. The ``sqlite`` backend shares
+the counters between the workers of a host through a small SQLite file,
+checking and counting in one write transaction.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _slide(state, now, window):
+    """Move ``(index, previous, current)`` forward to the window containing ``now``"""
+    index = int(now // window)
+    if state is None or state[0] < index - 1:
+        return index, 0, 0
+    if state[0] == index - 1:
+        return index, state[2], 0
+    return state
+
+
+def _weighted(state, now, window):
+    index, previous, current = state
+    return previous * (1 - (now - index * window) / window) + current
+
+
+def _retry_after(state, now, limit, window):
+    """Seconds until the weighted count drops below ``limit`` again"""
+    index, previous, current = state
+    elapsed = now - index * window
+    if current >= limit:
+        # Only once this window became the previous one and partly slid out
+        wait = window - elapsed + window * (1 - (limit - 1) / current)
+    else:
+        wait = window * (1 - (limit - 1 - current) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+class MemoryBackend:
+    """Per-process counters in a bounded LRU"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.evictions = 0
+        self._windows = OrderedDict()  # key -> (index, previous, current)
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        """Count an attempt unless over ``limit``; returns None or the seconds to wait"""
+        now = time.time() if now is None else now
+        with self._lock:
+            state = _slide(self._windows.get(key), now, window)
+            if _weighted(state, now, window) + 1 > limit:
+                self._windows[key] = state
+                self._windows.move_to_end(key)
+                return _retry_after(state, now, limit, window)
+            self._windows[key] = (state[0], state[1], state[2] + 1)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+        return None
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+    def __len__(self):
+        return len(self._windows)
+
+
+class SQLiteBackend:
+    """Counters shared by every worker on the host through a small SQLite file"""
+
+    def __init__(self, path, purge_every=500):
+        self.path = path
+        self.purge_every = purge_every
+        self.evictions = 0
+        self._writes = 0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute('CREATE TABLE IF NOT EXISTS throttle_window '
+                                '(key TEXT PRIMARY KEY, window_index INTEGER NOT NULL, '
+                                'previous INTEGER NOT NULL, current INTEGER NOT NULL, '
+                                'window REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        # Read, decide and count under the write lock so concurrent workers cannot overshoot
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT window_index, previous, current FROM throttle_window WHERE key = ?',
+                               (key,)).fetchone()
+            state = _slide(row, now, window)
+            if _weighted(state, now, window) + 1 > limit:
+                conn.execute('ROLLBACK')
+                return _retry_after(state, now, limit, window)
+            conn.execute('INSERT OR REPLACE INTO throttle_window VALUES (?, ?, ?, ?, ?)',
+                         (key, state[0], state[1], state[2] + 1, window))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self._purge(conn, now)
+        return None
+
+    def _purge(self, conn, now):
+        # Rows two windows old count for nothing any more
+        cursor = conn.execute('DELETE FROM throttle_window WHERE (window_index + 2) * window <= ?', (now,))
+        self.evictions += max(cursor.rowcount, 0)
+
+    def reset(self, key):
+        self._connect().execute('DELETE FROM throttle_window WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM throttle_window')
+
+    def __len__(self):
+        return self._connect().execute('SELECT count(*) FROM throttle_window').fetchone()[0]
+
+
+class LoginThrottle:
+    """Flask extension admitting login attempts per IP and per username"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        self.ip_limit, self.ip_window = 30, 300
+        self.user_limit, self.user_window = 10, 300
+        self._lock = threading.Lock()
+        self.allowed = self.rejected_ip = self.rejected_user = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('LOGIN_THROTTLE_ENABLED', True)
+        self.ip_limit = config.get('LOGIN_THROTTLE_IP_LIMIT', self.ip_limit)
+        self.ip_window = config.get('LOGIN_THROTTLE_IP_WINDOW', self.ip_window)
+        self.user_limit = config.get('LOGIN_THROTTLE_USER_LIMIT', self.user_limit)
+        self.user_window = config.get('LOGIN_THROTTLE_USER_WINDOW', self.user_window)
+        backend = config.get('LOGIN_THROTTLE_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryBackend(config.get('LOGIN_THROTTLE_MAX_KEYS', 10000))
+        elif backend == 'sqlite':
+            self.backend = SQLiteBackend(config['LOGIN_THROTTLE_SQLITE_PATH'])
+        else:
+            raise ValueError(f'Unknown LOGIN_THROTTLE_BACKEND {backend!r}')
+        app.extensions['login_throttle'] = self
+
+    @staticmethod
+    def _user_key(username):
+        return 'user:' + (username or '').strip().lower()
+
+    def admit(self, ip, username):
+        """Count a login attempt; returns None if it may proceed, else the seconds to wait"""
+        if not self.enabled:
+            return None
+        retry_after = self.backend.hit(f'ip:{ip}', self.ip_limit, self.ip_window)
+        if retry_after is not None:
+            with self._lock:
+                self.rejected_ip += 1
+            return retry_after
+        retry_after = self.backend.hit(self._user_key(username), self.user_limit, self.user_window)
+        with self._lock:
+            if retry_after is None:
+                self.allowed += 1
+            else:
+                self.rejected_user += 1
+        return retry_after
+
+    def succeeded(self, username):
+        """Forget the username's attempts after a successful login"""
+        if self.enabled:
+            self.backend.reset(self._user_key(username))
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'backend': type(self.backend).__name__, 'keys': len(self.backend),
+                    'evictions': self.backend.evictions, 'allowed': self.allowed,
+                    'rejected_ip': self.rejected_ip, 'rejected_user': self.rejected_user,
+                    'ip_limit': f'{self.ip_limit}/{self.ip_window}s',
+                    'user_limit': f'{self.user_limit}/{self.user_window}s'}
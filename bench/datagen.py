@@ -0,0 +1,146 @@
+"""Fill a SQLite database with synthetic users, campaigns and donations
+
+Usage: python -m bench.datagen PATH [--users 10000] [--campaigns 200] [--donations 1000000]
+
+Creates the schema at PATH and bulk-loads it with executemany on the raw
+DBAPI connection, in chunks, with durability pragmas relaxed for the load and
+the donation and full-text indexes built once at the end. Every generated user shares the
+password ``bench123``; ``admin`` / ``admin123`` is created as well. Campaign
+totals, dashboard counters and donation rollups are recomputed afterwards so
+the result is consistent with what the app would have produced.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app import create_app, db, hasher, ledger, rollups, search, stats  # noqa: E402
+from app.models import Donation  # noqa: E402
+
+PASSWORD = 'bench123'
+ADMIN_PASSWORD = 'admin123'
+CHUNK_SIZE = 50000
+MESSAGES = (None, None, None, 'Semoga bermanfaat', 'Semangat!', 'Untuk saudara kita', 'Lekas pulih')
+
+
+def build_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(path)
+        IMAGE_GC_INTERVAL = 0
+
+    return create_app(BenchConfig)
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load(connection, sql, rows, label, echo):
+    started = time.perf_counter()
+    total = 0
+    for chunk in _chunks(rows):
+        connection.executemany(sql, chunk)
+        connection.commit()
+        total += len(chunk)
+    elapsed = time.perf_counter() - started
+    echo(f'{label}: {total:,} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:,.0f} rows/s)')
+
+
+def generate(app, users, campaigns, donations, days=365, seed=1, echo=print):
+    """Create the schema and load it; ``users``, ``campaigns`` and ``donations`` are row counts"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span = days * 86400
+
+    def moment():
+        return (start + timedelta(seconds=rng.randrange(span))).isoformat(sep=' ')
+
+    with app.app_context():
+        db.create_all()
+        donation_indexes = list(Donation.__table__.indexes)
+        with db.engine.connect() as connection:
+            for index in donation_indexes:
+                index.drop(connection, checkfirst=True)
+            search.drop_triggers(connection)
+            connection.commit()
+
+        password_hash = hasher.hash(PASSWORD)
+        connection = db.engine.raw_connection()
+        connection.detach()  # the relaxed pragmas must not leak back into the pool
+        try:
+            connection.execute('PRAGMA synchronous=OFF')
+            _load(connection,
+                  'INSERT INTO user (username, email, password_hash, role, created_at) VALUES (?, ?, ?, ?, ?)',
+                  itertools.chain([('admin', 'admin@example.com', hasher.hash(ADMIN_PASSWORD), 'admin', moment())],
+                                  ((f'user{i}', f'user{i}@example.com', password_hash, 'donor', moment())
+                                   for i in range(1, users + 1))),
+                  'users', echo)
+            _load(connection,
+                  'INSERT INTO campaign (title, description, target_amount, collected_amount, is_active, created_at) '
+                  'VALUES (?, ?, ?, 0, ?, ?)',
+                  ((f'Campaign {i}', f'Campaign sintetis nomor {i}', rng.randrange(10, 1000) * 1000000,
+                    rng.random() < 0.8, moment()) for i in range(1, campaigns + 1)),
+                  'campaigns', echo)
+            # Donor ids start at 2, after the admin
+            _load(connection,
+                  'INSERT INTO donation (user_id, campaign_id, amount, message, created_at) VALUES (?, ?, ?, ?, ?)',
+                  ((rng.randint(2, users + 1), rng.randint(1, campaigns), rng.randrange(1, 500) * 1000,
+                    rng.choice(MESSAGES), moment()) for _ in range(donations)),
+                  'donations', echo)
+        finally:
+            connection.close()
+
+        started = time.perf_counter()
+        with db.engine.connect() as connection:
+            for index in donation_indexes:
+                index.create(connection)
+            connection.commit()
+        echo(f'donation indexes built in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        with db.engine.connect() as connection:
+            search.rebuild(connection)
+            connection.commit()
+        echo(f'search indexes built in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        ledger.reconcile(fix=True)
+        stats.rebuild()
+        echo(f'totals and counters rebuilt in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        rollups.rebuild()
+        echo(f'donation rollups built in {time.perf_counter() - started:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='SQLite file to create; must not exist yet.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--campaigns', type=int, default=200)
+    parser.add_argument('--donations', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=365, help='Spread donations over this many days.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} already exists')
+    generate(build_app(args.path), args.users, args.campaigns, args.donations, args.days, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measure the queries the identity cache removes from authenticated requests
+
+Usage: python -m bench.identity_cache [--requests 200]
+
+Runs the same authenticated page loads against a throwaway SQLite database
+with IDENTITY_CACHE_ENABLED off and on, and prints queries and latency per
+request for each.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from config import Config  # noqa: E402
+from app import create_app, db, stats  # noqa: E402
+from app.models import User, Campaign  # noqa: E402
+
+PAGES = ('/donor/', '/donor/history')
+
+
+def build_app(directory, enabled):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        WTF_CSRF_ENABLED = False
+        IDENTITY_CACHE_ENABLED = enabled
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(username='bench').first():
+            user = User(username='bench', email='bench@example.com')
+            user.set_password('bench123')
+            db.session.add(user)
+            db.session.add(Campaign(title='Bench', target_amount=1000000))
+            db.session.commit()
+            stats.rebuild()
+    return app
+
+
+def run(enabled, requests, directory):
+    app = build_app(directory, enabled)
+    queries = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.__setitem__(0, queries[0] + 1))
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench123'})
+    for page in PAGES:
+        client.get(page)
+
+    queries[0] = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        client.get(PAGES[i % len(PAGES)])
+    elapsed = time.perf_counter() - started
+    return queries[0] / requests, elapsed / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {enabled: run(enabled, args.requests, directory) for enabled in (False, True)}
+
+    for enabled, (queries, latency) in results.items():
+        print(f'identity cache {"on " if enabled else "off"}: {queries:.2f} queries/request, {latency:.2f} ms/request')
+    print(f'queries removed per request: {results[False][0] - results[True][0]:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Replay a realistic request mix against a generated database
+
+Usage:
+    python -m bench.datagen /tmp/bench.db --donations 1000000
+    python -m bench.loadtest /tmp/bench.db [--threads 8] [--seconds 30] [--http]
+        [--output run.json] [--baseline old.json --threshold 10]
+
+Each worker thread logs in as a random donor and as the admin, then picks
+actions from a weighted mix of logins, donor pages, donations and admin
+pages until the time is up. Requests run in process through the Flask test
+client, or with ``--http`` against a local threaded server. Query counts come
+from the profiler's ``Server-Timing`` header. The per-endpoint report is
+printed, optionally saved as JSON, and compared against a baseline run.
+"""
+import argparse
+import http.cookiejar
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server  # noqa: E402
+from config import Config  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import Campaign, User  # noqa: E402
+from bench import report  # noqa: E402
+from bench.datagen import ADMIN_PASSWORD, PASSWORD  # noqa: E402
+
+# (endpoint label, weight, admin?)
+MIX = (
+    ('POST /login', 2, False),
+    ('GET /donor/', 30, False),
+    ('GET /donor/history', 20, False),
+    ('GET /donor/donate/<id>', 8, False),
+    ('POST /donor/donate/<id>', 10, False),
+    ('GET /admin/', 10, True),
+    ('GET /admin/donations', 12, True),
+    ('GET /admin/campaigns', 4, True),
+    ('GET /admin/users', 4, True),
+)
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def build_app(path, directory):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(path)
+        WTF_CSRF_ENABLED = False
+        LOGIN_THROTTLE_ENABLED = False  # every simulated user logs in from 127.0.0.1
+        IMAGE_GC_INTERVAL = 0
+        PROFILER_ENABLED = True
+        PROFILER_SLOW_QUERY_LOG = os.path.join(directory, 'slow_queries.log')
+
+    return create_app(BenchConfig)
+
+
+class LocalClient:
+    """Requests through the Flask test client, on the calling thread"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Requests over HTTP with a cookie jar, redirects are not followed"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code, error.headers.get('Server-Timing', '')
+
+
+def run(app, make_client, threads, seconds, seed=1):
+    """Drive the mix from ``threads`` workers and return the summarized result"""
+    with app.app_context():
+        donors = db.session.query(User.id).filter(User.role == 'donor').count()
+        campaign_ids = [id for id, in db.session.query(Campaign.id).filter(Campaign.is_active.is_(True))]
+    if not donors or not campaign_ids:
+        raise SystemExit('the database has no donors or active campaigns, fill it with bench.datagen first')
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+    labels = [label for label, _, _ in MIX]
+    weights = [weight for _, weight, _ in MIX]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        donor, admin = make_client(), make_client()
+        username = f'user{rng.randint(1, donors)}'
+        donor.request('POST', '/login', {'username': username, 'password': PASSWORD})
+        admin.request('POST', '/login', {'username': 'admin', 'password': ADMIN_PASSWORD})
+        barrier.wait()
+        deadline = time.perf_counter() + seconds
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            label = rng.choices(labels, weights)[0]
+            campaign_id = rng.choice(campaign_ids)
+            if label == 'POST /login':
+                client, args = make_client(), ('POST', '/login', {'username': username, 'password': PASSWORD})
+            elif label == 'POST /donor/donate/<id>':
+                client, args = donor, ('POST', f'/donor/donate/{campaign_id}',
+                                       {'amount': rng.randrange(1, 100) * 1000, 'message': ''})
+            elif label == 'GET /donor/donate/<id>':
+                client, args = donor, ('GET', f'/donor/donate/{campaign_id}')
+            else:
+                method, path = label.split(' ')
+                client, args = (admin if path.startswith('/admin') else donor), (method, path)
+            started = time.perf_counter()
+            try:
+                status, timing = client.request(*args)
+            except Exception:
+                status, timing = None, ''
+            elapsed = time.perf_counter() - started
+            match = SERVER_TIMING_QUERIES.search(timing)
+            local[label].append((elapsed, status is not None and status < 400,
+                                 int(match.group(1)) if match else None))
+        with lock:
+            for label, rows in local.items():
+                samples[label].extend(rows)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {'threads': threads, 'seconds': elapsed, 'endpoints': report.summarize(samples, elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file made by bench.datagen.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--http', action='store_true', help='Go through a local HTTP server.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', help='Name stored with the result, defaults to the output file name.')
+    parser.add_argument('--output', '-o', help='Save the result as JSON.')
+    parser.add_argument('--baseline', help='Earlier JSON result to compare against.')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed regression in percent.')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    if not os.path.exists(args.database):
+        parser.error(f'{args.database} does not exist, create it with python -m bench.datagen')
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(args.database, directory)
+        server = None
+        if args.http:
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+            result = run(app, lambda: HttpClient(base_url), args.threads, args.seconds, args.seed)
+            server.shutdown()
+        else:
+            result = run(app, lambda: LocalClient(app), args.threads, args.seconds, args.seed)
+
+    result['mode'] = 'http' if args.http else 'in-process'
+    result['label'] = args.label or (os.path.basename(args.output) if args.output else 'run')
+    report.print_table(result)
+    if args.output:
+        report.save(result, args.output)
+    if args.baseline:
+        sys.exit(report.check(result, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
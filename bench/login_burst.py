@@ -0,0 +1,130 @@
+"""Page latency for logged-in users while a burst of logins is hashing
+
+Usage: python -m bench.login_burst [--attackers 16] [--rate 10] [--seconds 5]
+
+Starts the app on a local threaded server three times: hashing on the
+request thread (PASSWORD_HASH_WORKERS=0), on the bounded pool, and on the
+pool behind the login throttle. Each run measures /donor/ latency for an
+already logged-in user while attacker processes post bad logins at a fixed
+rate, so every configuration faces the same offered load however fast it
+answers.
+"""
+import argparse
+import http.cookiejar
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import request  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+from config import Config  # noqa: E402
+from app import create_app, db, stats  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+def build_app(directory, workers, throttle):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, f'bench-{workers}-{throttle:d}.db')
+        WTF_CSRF_ENABLED = False
+        PASSWORD_HASH_WORKERS = workers
+        LOGIN_THROTTLE_ENABLED = throttle
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench123')
+        db.session.add(user)
+        db.session.commit()
+        stats.rebuild()
+    return app
+
+
+def login(base_url, password):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'username': 'bench', 'password': password}).encode()
+    try:
+        opener.open(base_url + '/login', data=data).read()
+    except urllib.error.HTTPError:
+        pass
+    return opener
+
+
+def attack(base_url, stop, rate):
+    due = time.perf_counter()
+    while not stop.is_set():
+        login(base_url, 'wrong-password')
+        due += 1 / rate
+        time.sleep(max(0.0, due - time.perf_counter()))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(workers, throttle, attackers, rate, seconds, directory):
+    app = build_app(directory, workers, throttle)
+    attempts = []
+    app.before_request(lambda: attempts.append(1) if request.method == 'POST' else None)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    reader = login(base_url, 'bench123')
+    # Attackers in their own processes, so only the server's work competes for this GIL
+    stop = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=attack, args=(base_url, stop, rate), daemon=True)
+                 for _ in range(attackers)]
+    for process in processes:
+        process.start()
+
+    latencies = []
+    cpu = time.process_time()  # this process is the server; attackers have their own
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        reader.open(base_url + '/donor/').read()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    cpu = time.process_time() - cpu
+    stop.set()
+    for process in processes:
+        process.join()
+    server.shutdown()
+    return latencies, cpu, len(attempts) - 1, app.extensions['login_throttle'].stats()
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--attackers', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=10, help='Logins per second per attacker.')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for workers, throttle in ((0, False), (2, False), (2, True)):
+            latencies, cpu, logins, throttled = run(workers, throttle, args.attackers, args.rate, args.seconds, directory)
+            label = 'request thread' if workers == 0 else f'pool of {workers}'
+            if throttle:
+                label += ' + throttle'
+            print(f'hashing on {label:>25}: /donor/ p50 {statistics.median(latencies):7.1f} ms, '
+                  f'p99 {percentile(latencies, 99):7.1f} ms over {len(latencies)} requests')
+            line = f'{logins} bad logins, server CPU {cpu:.1f} s ({cpu / max(logins, 1) * 1000:.1f} ms per login)'
+            if throttle:
+                line += f', {throttled["rejected_ip"] + throttled["rejected_user"]} rejected with 429'
+            print(f'{"":>37}{line}')
+
+
+if __name__ == '__main__':
+    main()
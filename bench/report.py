@@ -0,0 +1,107 @@
+"""Summaries, JSON results and regression checks for load-test runs
+
+Usage: python -m bench.report RESULT.json [--baseline OLD.json] [--threshold 10]
+
+Prints the per-endpoint table of a saved run. With ``--baseline`` every
+endpoint is compared against the older run and the command exits with status
+1 if p95 latency grew, or throughput fell, by more than ``--threshold``
+percent.
+"""
+import argparse
+import json
+import statistics
+import sys
+
+METRICS = ('requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'avg_queries')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def summarize(samples, elapsed):
+    """Turn ``{endpoint: [(seconds, ok, queries), ...]}`` into per-endpoint metrics"""
+    endpoints = {}
+    for endpoint, rows in sorted(samples.items()):
+        latencies = [seconds * 1000 for seconds, _, _ in rows]
+        queries = [count for _, _, count in rows if count is not None]
+        endpoints[endpoint] = {
+            'requests': len(rows),
+            'errors': sum(1 for _, ok, _ in rows if not ok),
+            'throughput': len(rows) / elapsed if elapsed else 0.0,
+            'p50_ms': statistics.median(latencies) if latencies else 0.0,
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'avg_queries': statistics.fmean(queries) if queries else None,
+        }
+    return endpoints
+
+
+def save(result, path):
+    with open(path, 'w') as out:
+        json.dump(result, out, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def print_table(result, out=sys.stdout):
+    print(f'{result.get("label", "run")}: {result["threads"]} threads, {result["seconds"]:.1f}s, '
+          f'mode={result["mode"]}', file=out)
+    print(f'{"endpoint":<28} {"req":>7} {"err":>5} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"queries":>8}', file=out)
+    for endpoint, row in result['endpoints'].items():
+        queries = f'{row["avg_queries"]:.1f}' if row['avg_queries'] is not None else '-'
+        print(f'{endpoint:<28} {row["requests"]:>7} {row["errors"]:>5} {row["throughput"]:>8.1f} '
+              f'{row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {queries:>8}', file=out)
+
+
+def compare(current, baseline, threshold):
+    """Return a list of regression messages, empty if the run is within ``threshold`` percent"""
+    regressions = []
+    for endpoint, row in current['endpoints'].items():
+        old = baseline['endpoints'].get(endpoint)
+        if old is None:
+            continue
+        if old['p95_ms'] and row['p95_ms'] > old['p95_ms'] * (1 + threshold / 100):
+            regressions.append(f'{endpoint}: p95 {old["p95_ms"]:.1f} -> {row["p95_ms"]:.1f} ms '
+                               f'(+{(row["p95_ms"] / old["p95_ms"] - 1) * 100:.0f}%)')
+        if old['throughput'] and row['throughput'] < old['throughput'] * (1 - threshold / 100):
+            regressions.append(f'{endpoint}: throughput {old["throughput"]:.1f} -> {row["throughput"]:.1f} req/s '
+                               f'({(row["throughput"] / old["throughput"] - 1) * 100:.0f}%)')
+        if old.get('avg_queries') is not None and row.get('avg_queries') is not None \
+                and row['avg_queries'] > old['avg_queries'] + 0.5:
+            regressions.append(f'{endpoint}: queries per request {old["avg_queries"]:.1f} -> {row["avg_queries"]:.1f}')
+    return regressions
+
+
+def check(current, baseline_path, threshold):
+    """Print the comparison with a baseline file and return the exit status"""
+    regressions = compare(current, load(baseline_path), threshold)
+    for message in regressions:
+        print(f'REGRESSION {message}')
+    if regressions:
+        print(f'{len(regressions)} regression(s) over the {threshold:g}% threshold against {baseline_path}')
+        return 1
+    print(f'No regressions over the {threshold:g}% threshold against {baseline_path}')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('result')
+    parser.add_argument('--baseline', help='Earlier result to compare against.')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed regression in percent.')
+    args = parser.parse_args()
+
+    result = load(args.result)
+    print_table(result)
+    if args.baseline:
+        sys.exit(check(result, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Donation throughput and tail latency under concurrent donors
+
+Usage: python -m bench.sqlite_profile [--threads 16] [--donations 50]
+
+Runs the same workload three times against a fresh database: the ``default``
+profile (rollback journal, stock pool), the ``production`` profile (WAL,
+busy timeout, tuned pool) and the production profile with the write queue.
+Each thread logs in as its own donor and posts donations while a reader
+thread keeps loading the donor dashboard. Reports donations per second,
+p50/p99 latency of the donate POST, failed requests and reader p99.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app import create_app, db, ledger, stats  # noqa: E402
+from app.models import User, Campaign  # noqa: E402
+
+RUNS = (
+    ('default', 'default', False),
+    ('production', 'production', False),
+    ('production + write queue', 'production', True),
+)
+
+
+def build_app(directory, name, profile, write_queue, donors):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, f'bench-{name.replace(" ", "")}.db')
+        WTF_CSRF_ENABLED = False
+        LOGIN_THROTTLE_ENABLED = False
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        PASSWORD_HASH_WORKERS = 0
+        IMAGE_GC_INTERVAL = 0
+        SQLITE_PROFILE = profile
+        SQLITE_WRITE_QUEUE = write_queue
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Campaign(title='Bench', description='bench', target_amount=10 ** 9))
+        for i in range(donors + 1):
+            user = User(username=f'donor{i}', email=f'donor{i}@example.com')
+            user.set_password('bench123')
+            db.session.add(user)
+        db.session.commit()
+        stats.rebuild()
+    return app
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def run(app, threads, donations):
+    latencies, read_latencies = [], []
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+    done = threading.Event()
+
+    def donor(i):
+        client = app.test_client()
+        client.post('/login', data={'username': f'donor{i}', 'password': 'bench123'})
+        barrier.wait()
+        for _ in range(donations):
+            started = time.perf_counter()
+            try:
+                response = client.post('/donor/donate/1', data={'amount': 10000, 'message': ''})
+                if response.status_code != 302:
+                    errors.append(response.status_code)
+            except Exception as exc:  # "database is locked" surfaces here
+                errors.append(type(exc).__name__)
+            latencies.append(time.perf_counter() - started)
+
+    def reader():
+        client = app.test_client()
+        client.post('/login', data={'username': f'donor{threads}', 'password': 'bench123'})
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get('/donor/')
+            read_latencies.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=donor, args=(i,)) for i in range(threads)]
+    reading = threading.Thread(target=reader)
+    for thread in workers:
+        thread.start()
+    reading.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    reading.join()
+
+    with app.app_context():
+        drift = ledger.reconcile()
+    return {
+        'throughput': (len(latencies) - len(errors)) / elapsed,
+        'p50': statistics.median(latencies),
+        'p99': percentile(latencies, 99),
+        'errors': len(errors),
+        'read_p99': percentile(read_latencies, 99),
+        'drift': len(drift),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--donations', type=int, default=50, help='donations per thread')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    print(f'{args.threads} donors x {args.donations} donations, one dashboard reader\n')
+    print(f'{"profile":<26} {"donations/s":>12} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7} {"read p99 ms":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile, write_queue in RUNS:
+            app = build_app(directory, name, profile, write_queue, args.threads)
+            result = run(app, args.threads, args.donations)
+            print(f'{name:<26} {result["throughput"]:>12.0f} {result["p50"] * 1000:>8.1f} '
+                  f'{result["p99"] * 1000:>8.1f} {result["errors"]:>7} {result["read_p99"] * 1000:>12.1f}')
+            if result['drift']:
+                print(f'  warning: {result["drift"]} campaign totals drifted')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Hold many idle progress streams open against one worker and time the fan-out
+
+Usage:
+    python -m bench.datagen /tmp/bench.db --donations 100000
+    python -m bench.sse_soak /tmp/bench.db [--clients 1000] [--hold 30] [--donations 20]
+        [--output soak.json]
+
+Starts the app on a local threaded server (one process, one thread per open
+stream, like a threaded worker), logs in one donor and opens ``--clients``
+event streams with that session from a single selector thread. Once every
+stream has its snapshot it holds them for ``--hold`` seconds, counting
+heartbeats and drops, then makes ``--donations`` donations and measures how
+long each takes to reach every stream. Reports the process RSS and thread
+count per open stream alongside the delivery latencies.
+"""
+import argparse
+import json
+import os
+import resource
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import http.cookiejar
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server  # noqa: E402
+from app import db  # noqa: E402
+from app.models import Campaign  # noqa: E402
+from bench.datagen import PASSWORD  # noqa: E402
+from bench.loadtest import build_app  # noqa: E402
+from bench.report import percentile  # noqa: E402
+
+
+def rss_kib():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class Stream:
+    """One raw event-stream connection, only counting what arrives"""
+
+    def __init__(self, port, cookie):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.sendall((f'GET /donor/progress/stream HTTP/1.1\r\nHost: localhost\r\n'
+                           f'Cookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n').encode())
+        self.sock.setblocking(False)
+        self.status = None
+        self.snapshots = self.progress = self.pings = 0
+        self.last_progress_at = None
+        self.closed = False
+        self._buffer = b''
+
+    def feed(self, data):
+        self._buffer += data
+        if self.status is None and b'\r\n' in self._buffer:
+            self.status = int(self._buffer.split(b' ', 2)[1])
+        *blocks, self._buffer = self._buffer.split(b'\n\n')
+        for block in blocks:
+            if b'event: snapshot' in block:
+                self.snapshots += 1
+            elif b'event: progress' in block:
+                self.progress += 1
+                self.last_progress_at = time.perf_counter()
+            elif b': ping' in block:
+                self.pings += 1
+
+
+def pump(selector, until):
+    """Read from every stream until ``until()`` is true; returns False on a timeout"""
+    deadline = time.perf_counter() + 30
+    while not until():
+        if time.perf_counter() > deadline:
+            return False
+        for key, _ in selector.select(timeout=0.1):
+            stream = key.data
+            try:
+                data = stream.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                data = b''
+            if not data:
+                stream.closed = True
+                selector.unregister(stream.sock)
+                stream.sock.close()
+                continue
+            stream.feed(data)
+    return True
+
+
+def soak(app, clients, hold, donations, batch=100):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    opener.open(base_url + '/login', urllib.parse.urlencode({'username': 'user1', 'password': PASSWORD}).encode())
+    cookie = '; '.join(f'{item.name}={item.value}' for item in jar)
+    with app.app_context():
+        campaign_id = db.session.query(Campaign.id).filter(Campaign.is_active.is_(True)).first()[0]
+
+    rss_before, threads_before = rss_kib(), threading.active_count()
+    selector = selectors.DefaultSelector()
+    streams = []
+    started = time.perf_counter()
+    for offset in range(0, clients, batch):
+        for _ in range(min(batch, clients - offset)):
+            try:
+                stream = Stream(server.server_port, cookie)
+            except OSError as error:
+                print(f'connect failed after {len(streams)} streams: {error}')
+                break
+            selector.register(stream.sock, selectors.EVENT_READ, stream)
+            streams.append(stream)
+        pump(selector, lambda: all(s.snapshots or s.closed or (s.status and s.status != 200) for s in streams))
+    connect_seconds = time.perf_counter() - started
+    open_streams = [s for s in streams if s.status == 200 and not s.closed]
+    rss_open, threads_open = rss_kib(), threading.active_count()
+    print(f'{len(open_streams):,} of {clients:,} streams open in {connect_seconds:.1f}s '
+          f'({sum(1 for s in streams if s.status == 503):,} refused with 503)')
+
+    hold_until = time.perf_counter() + hold
+    pump(selector, lambda: time.perf_counter() >= hold_until)
+    dropped = sum(1 for s in open_streams if s.closed)
+    print(f'held {hold:.0f}s: {sum(s.pings for s in open_streams):,} heartbeats, {dropped:,} dropped')
+
+    latencies, first, last = [], [], []
+    for number in range(1, donations + 1):
+        live = [s for s in open_streams if not s.closed]
+        sent = time.perf_counter()
+        opener.open(f'{base_url}/donor/donate/{campaign_id}',
+                    urllib.parse.urlencode({'amount': 1000, 'message': ''}).encode()).read()
+        done = pump(selector, lambda: all(s.progress >= number or s.closed for s in live))
+        arrivals = [s.last_progress_at - sent for s in live if s.progress >= number]
+        if not done or not arrivals:
+            print(f'donation {number}: not delivered to every stream within 30s')
+            continue
+        latencies.extend(arrivals)
+        first.append(min(arrivals))
+        last.append(max(arrivals))
+
+    for stream in streams:
+        if not stream.closed:
+            stream.sock.close()
+    server.shutdown()
+
+    per_stream = len(open_streams) or 1
+    return {
+        'clients': clients,
+        'open': len(open_streams),
+        'refused': sum(1 for s in streams if s.status == 503),
+        'connect_seconds': connect_seconds,
+        'dropped': dropped,
+        'rss_kib_before': rss_before,
+        'rss_kib_open': rss_open,
+        'rss_kib_per_stream': (rss_open - rss_before) / per_stream,
+        'threads_per_stream': (threads_open - threads_before) / per_stream,
+        'donations': len(first),
+        'latency_ms': {'p50': percentile(latencies, 50) * 1000 if latencies else None,
+                       'p95': percentile(latencies, 95) * 1000 if latencies else None,
+                       'max': max(latencies) * 1000 if latencies else None},
+        'first_stream_ms': percentile(first, 50) * 1000 if first else None,
+        'last_stream_ms': percentile(last, 50) * 1000 if last else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file made by bench.datagen.')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--hold', type=float, default=30, help='Seconds to keep the streams idle.')
+    parser.add_argument('--donations', type=int, default=20)
+    parser.add_argument('--heartbeat', type=int, default=15, help='SSE_HEARTBEAT for the run.')
+    parser.add_argument('--output', '-o', help='Save the result as JSON.')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    if not os.path.exists(args.database):
+        parser.error(f'{args.database} does not exist, create it with python -m bench.datagen')
+    # Each stream needs a descriptor on both ends, plus headroom for the database and logs
+    limit = raise_fd_limit(args.clients * 2 + 256)
+    if limit < args.clients * 2 + 64:
+        print(f'warning: only {limit} file descriptors available, streams beyond ~{(limit - 64) // 2} will fail')
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(args.database, directory)
+        app.config.update(PROFILER_ENABLED=False, SSE_MAX_CLIENTS=args.clients, SSE_HEARTBEAT=args.heartbeat)
+        from app import broadcaster
+        broadcaster.init_app(app)
+        result = soak(app, args.clients, args.hold, args.donations)
+
+    latency = result['latency_ms']
+    print(f"per stream: {result['rss_kib_per_stream']:.0f} KiB RSS, {result['threads_per_stream']:.2f} threads")
+    if latency['p50'] is not None:
+        print(f"fan-out over {result['donations']} donations: p50 {latency['p50']:.1f} ms, "
+              f"p95 {latency['p95']:.1f} ms, max {latency['max']:.1f} ms "
+              f"(first stream {result['first_stream_ms']:.1f} ms, last {result['last_stream_ms']:.1f} ms)")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
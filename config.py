@@ -8,9 +8,106 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'donasi.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = True
+
+    # SQLite engine profile: 'production' (WAL, busy timeout, tuned pool) or 'default'
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+    SQLITE_PRAGMAS = {}  # per-deployment overrides of the profile's pragmas
+    # Group-commit short writes such as donations on a single writer thread
+    SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE', '0') == '1'
+    SQLITE_WRITE_QUEUE_MAX_BATCH = 64
+    SQLITE_WRITE_QUEUE_MAX_DELAY = 0.0  # seconds to wait for more jobs before committing
+    SQLITE_WRITE_QUEUE_LIMIT = 1024
+    SQLITE_WRITE_QUEUE_TIMEOUT = 10  # seconds to wait for room in the queue, then WriteQueueBusy
     
     # Upload settings
     UPLOAD_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB max
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600  # content-addressed images never change
+    IMAGE_GC_INTERVAL = int(os.environ.get('IMAGE_GC_INTERVAL', 600))  # seconds between images.gc jobs, 0 disables
+    IMAGE_GC_GRACE = 3600  # keep unreferenced files this long before removing them
+
+    # Donation listing pagination
+    DONATIONS_PER_PAGE = int(os.environ.get('DONATIONS_PER_PAGE', 20))
+    DONATIONS_MAX_PER_PAGE = 100
+    DONATIONS_PER_PAGE_CHOICES = (20, 50, 100)
+    SEARCH_CANDIDATE_LIMIT = 1000  # newest full-text matches scored per search
+    ROLLUP_MAX_BUCKETS = 1000  # longest series /admin/analytics/donations returns
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER') or os.path.join(basedir, 'exports')  # background exports
+    IMPORT_BATCH_SIZE = 1000
+    # Hot/cold split: `flask archive-donations` moves these into donation_archive, read-only from then on
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_CLOSED_CAMPAIGNS = True  # also every donation of a deactivated campaign
+    ARCHIVE_BATCH_SIZE = 5000  # donations moved per write transaction
+    ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 0))  # seconds between donations.archive jobs, 0 disables
+
+    # Background jobs run by `flask run-jobs`: queue -> concurrent jobs across all workers
+    JOBS_QUEUES = {'default': 2, 'maintenance': 1, 'exports': 1}
+    JOBS_POLL_INTERVAL = 1.0  # seconds between claims while idle
+    JOBS_VISIBILITY_TIMEOUT = 300  # lease of a running job, renewed while it runs
+    JOBS_BACKOFF_BASE = 10  # seconds before the first retry, doubled per attempt
+    JOBS_BACKOFF_MAX = 3600
+    JOBS_RETENTION = 7 * 24 * 3600  # finished jobs and their exports are kept this long
+    JOBS_PRUNE_INTERVAL = 3600
+
+    # Cache: 'memory' (per-process LRU), 'sqlite' (shared by all workers) or 'null'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 30))  # max staleness in seconds
+    CACHE_MAX_ENTRIES = 1024
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH') or os.path.join(basedir, 'cache.sqlite')
+
+    # Flask-Login user_loader cache
+    IDENTITY_CACHE_ENABLED = os.environ.get('IDENTITY_CACHE_ENABLED', '1') == '1'
+    # Other workers see role changes and deletions only after this many seconds, unless CACHE_BACKEND=sqlite
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 5))
+    IDENTITY_CACHE_MAX_ENTRIES = 4096
+
+    # Per-request SQL profiler (Server-Timing headers, N+1 detection, slow-query log)
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+    PROFILER_SLOW_QUERY_MS = int(os.environ.get('PROFILER_SLOW_QUERY_MS', 100))
+    PROFILER_N_PLUS_ONE_THRESHOLD = 5  # identical statements per request before flagging
+    PROFILER_SERVER_TIMING = True
+    PROFILER_SLOW_QUERY_LOG = os.path.join(basedir, 'logs', 'slow_queries.log')
+    PROFILER_SLOW_QUERY_LOG_MAX_BYTES = 1024 * 1024
+    PROFILER_SLOW_QUERY_LOG_BACKUPS = 5
+
+    # Live campaign progress over Server-Sent Events; every open stream holds a worker thread
+    SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 1000))  # per process, further streams get 503
+    SSE_HEARTBEAT = 15  # seconds between keep-alive comments
+    SSE_POLL_INTERVAL = 5  # seconds, picks up commits made by other workers; 0 only reacts to this process
+    SSE_HISTORY = 256  # change batches kept so reconnecting streams get a diff instead of a snapshot
+
+    # Static files fingerprinted and precompressed by `flask build-assets` (app/static/dist)
+    ASSETS_CACHE_MAX_AGE = 365 * 24 * 3600  # fingerprinted names change with the content
+    # gzip for rendered pages, JSON and exports; precompressed assets and images are sent as they are
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = 1024  # bytes, smaller bodies are not worth the header and CPU
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'text/plain', 'text/csv', 'image/svg+xml',
+                          'application/json', 'application/x-ndjson', 'application/javascript'}
+
+    # Compiled templates shared by all workers and restarts; empty compiles in memory per process
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', os.path.join(basedir, 'cache', 'jinja'))
+    # Log import, create_app and first-request timings (also in /admin/metrics)
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', '0') == '1'
+
+    # Password hashing; hashes made with other parameters are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 hashes on the request thread
+    PASSWORD_HASH_QUEUE_LIMIT = 64
+    PASSWORD_HASH_BULK_WORKERS = int(os.environ.get('PASSWORD_HASH_BULK_WORKERS', 1))  # user imports, apart from logins
+    PASSWORD_HASH_TIMEOUT = 30
+
+    # Login attempts admitted per client IP and per username in a sliding window, checked before hashing
+    LOGIN_THROTTLE_ENABLED = os.environ.get('LOGIN_THROTTLE_ENABLED', '1') == '1'
+    LOGIN_THROTTLE_IP_LIMIT = int(os.environ.get('LOGIN_THROTTLE_IP_LIMIT', 30))
+    LOGIN_THROTTLE_IP_WINDOW = 300  # seconds
+    LOGIN_THROTTLE_USER_LIMIT = int(os.environ.get('LOGIN_THROTTLE_USER_LIMIT', 10))  # cleared on success
+    LOGIN_THROTTLE_USER_WINDOW = 300
+    # 'memory' (per process, limits multiply by the worker count) or 'sqlite' (shared by the workers of a host)
+    LOGIN_THROTTLE_BACKEND = os.environ.get('LOGIN_THROTTLE_BACKEND', 'memory')
+    LOGIN_THROTTLE_MAX_KEYS = 10000  # memory backend, least recently used keys are dropped
+    LOGIN_THROTTLE_SQLITE_PATH = os.environ.get('LOGIN_THROTTLE_SQLITE_PATH') or os.path.join(basedir, 'cache.sqlite')
 
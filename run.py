@@ -1,6 +1,7 @@
 from app import create_app, db
 from app.models import User, Campaign, Donation
 
+# Creating the schema and the admin account is a one-time step: flask --app run init-db
 app = create_app()
 
 @app.shell_context_processor
@@ -8,13 +9,4 @@ def make_shell_context():
     return {'db': db, 'User': User, 'Campaign': Campaign, 'Donation': Donation}
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        # Create admin user if not exists
-        if not User.query.filter_by(username='admin').first():
-            admin = User(username='admin', email='admin@example.com', role='admin')
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
-            print('Admin user created: admin / admin123')
     app.run(debug=True)
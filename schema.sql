@@ -8,6 +8,7 @@ CREATE TABLE user (
     email VARCHAR(120) UNIQUE NOT NULL,
     password_hash VARCHAR(256) NOT NULL,
     role VARCHAR(20) DEFAULT 'donor',
+    is_active BOOLEAN NOT NULL DEFAULT 1,   -- 0: tidak bisa login
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -16,8 +17,9 @@ CREATE TABLE campaign (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     title VARCHAR(200) NOT NULL,
     description TEXT,
-    target_amount FLOAT NOT NULL,
-    collected_amount FLOAT DEFAULT 0,
+    image VARCHAR(255),
+    target_amount INTEGER NOT NULL,    -- rupiah penuh
+    collected_amount INTEGER DEFAULT 0,
     is_active BOOLEAN DEFAULT 1,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
@@ -27,18 +29,39 @@ CREATE TABLE donation (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     campaign_id INTEGER NOT NULL,
-    amount FLOAT NOT NULL,
+    amount INTEGER NOT NULL,           -- rupiah penuh
     message TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE,
     FOREIGN KEY (campaign_id) REFERENCES campaign(id) ON DELETE CASCADE
 );
 
--- Index untuk optimasi query
-CREATE INDEX idx_donation_user ON donation(user_id);
-CREATE INDEX idx_donation_campaign ON donation(campaign_id);
+-- Arsip donasi lama / campaign nonaktif (flask archive-donations), hanya-baca, id tetap sama
+CREATE TABLE donation_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    campaign_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,           -- rupiah penuh
+    message TEXT,
+    created_at DATETIME,
+    archived_at DATETIME NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE,
+    FOREIGN KEY (campaign_id) REFERENCES campaign(id) ON DELETE CASCADE
+);
+
+-- Index untuk optimasi query, sesuai filter + urutan query di route
+-- (rowid/id ikut tersimpan di setiap index sebagai kolom terakhir)
+CREATE INDEX ix_donation_user_created ON donation(user_id, created_at);
+CREATE INDEX ix_donation_campaign_created ON donation(campaign_id, created_at);
+CREATE INDEX ix_donation_created ON donation(created_at);
+CREATE INDEX ix_donation_archive_user_created ON donation_archive(user_id, created_at);
+CREATE INDEX ix_donation_archive_campaign_created ON donation_archive(campaign_id, created_at);
+CREATE INDEX ix_donation_archive_created ON donation_archive(created_at);
 CREATE INDEX idx_user_role ON user(role);
-CREATE INDEX idx_campaign_active ON campaign(is_active);
+CREATE INDEX ix_user_created_at ON user(created_at);
+CREATE INDEX ix_campaign_active_created ON campaign(is_active, created_at);
+CREATE INDEX ix_campaign_created ON campaign(created_at);
+CREATE INDEX ix_campaign_title ON campaign(title);
 
 -- Contoh data awal
 INSERT INTO user (username, email, password_hash, role) 